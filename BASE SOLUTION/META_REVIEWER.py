@@ -1,122 +1,123 @@
 from ollama import Client
-from pydantic import BaseModel
-import json
 from dotenv import dotenv_values
+from cascade import open_cascade
+from jsonl_writer import open_writer
+from llm_calls import setup, ollama_chat
+from mistake_merge import MergeStats, merge_mistakes, open_merge
+from run_state import RunState, load_completed, model_key
+from shards import open_shard, open_problems, shard_input
+from stages import (
+    proposed_solution_file, review_file, meta_review_file, MistakeReview, meta_review_messages,
+    merged_meta_review_messages, mistake_record, accepted_record,
+)
 
 MAX_TIME_LIMIT = 180 # seconds
 
 # Load environment variables from the .env file (if present)
 config = dotenv_values(".env")
+CACHE = setup(config, "meta_review")
+open_shard(config)
 
 # Access environment variables as if they came from the actual environment
 META_REVIEWER = config['META_REVIEWER']
 REVIEWERS = config['REVIEWERS'].split(" ")
 MODEL = config['MODEL']
+# How long Ollama keeps the model loaded after its last request
+KEEP_ALIVE = config.get('KEEP_ALIVE') or "30m"
+# Problems that the REVIEWERS accepted in a cascade (CASCADE=true) are not sent to the META_REVIEWER
+CASCADE = open_cascade(config)
+# With MERGE_MISTAKES=true the META_REVIEWER only gets the merged mistakes of the reviews, not the full reviews
+MERGE_SIMILARITY = open_merge(config)
+MERGE_STATS = MergeStats()
 
-def sanitize_file_name(name: str):
-    _forbidden_chars = "<>:\"/\\|?* "
-    for _c in _forbidden_chars:
-        name = name.replace(_c, "_")
-    return name
-
-OUTPUT_FILE = f'./REVIEWS/meta_review_of_{sanitize_file_name(MODEL)}_by_{sanitize_file_name(META_REVIEWER)}_for_{"_and_".join([sanitize_file_name(i) for i in REVIEWERS])}.jsonl'
-
-
-class Review(BaseModel):
-  mistakes: list[str]
+OUTPUT_FILE = meta_review_file(MODEL, META_REVIEWER, REVIEWERS)
 
 chat = Client(timeout=MAX_TIME_LIMIT).chat
 
 
 ERROR_COUNT = 0
-INPUT_FILE = f"./SOLUTIONS/proposed_solution_by_{sanitize_file_name(MODEL)}.jsonl"
+INPUT_FILE = proposed_solution_file(MODEL)
 
 print("Review by", META_REVIEWER)
-all_reviews = {}
+# Reviews are looked up by Problem_ID through the run state index instead of being loaded into memory
+STATE = RunState()
 for REVIEWER in REVIEWERS:
-    with open(f"./REVIEWS/review_of_{sanitize_file_name(MODEL)}_by_{sanitize_file_name(REVIEWER)}.jsonl", "r", encoding='utf-8') as f:
-        reviews = {}
-        i = 0
-        for line in f:
-            try:
-                DATA = json.loads(line)
-                ID = DATA['Problem_ID']
-                del DATA['Problem_ID']
-                reviews[ID] =  DATA
-            except Exception as e:
-                print(i, e)
-            i += 1
-        all_reviews[REVIEWER] = reviews
-
-COMPLETED_PROBLEMS = []
-try:
-    with open(OUTPUT_FILE, 'r', encoding='utf-8') as f:
-        for line in f:
-            COMPLETED_PROBLEMS.append(json.loads(line)['Problem_ID'])
-except Exception as e:
-    pass
-
-
-with open(INPUT_FILE, "r", encoding='utf-8') as f:
-    PROBLEMS = [json.loads(line) for line in f]
-    
+    STATE.sync_jsonl("review", model_key(MODEL, REVIEWER), shard_input(review_file(MODEL, REVIEWER)))
+
+def get_review(REVIEWER: str, ID: str):
+    try:
+        DATA = STATE.read_record("review", model_key(MODEL, REVIEWER), ID)
+    except Exception as e:
+        print(ID, e)
+        return None
+    if DATA is not None:
+        del DATA['Problem_ID']
+    return DATA
+
+COMPLETED_PROBLEMS = load_completed("meta_review", model_key(MODEL, META_REVIEWER, *REVIEWERS), OUTPUT_FILE)
+MISSING_REVIEWS = []
+ACCEPTED = 0
+
+# The solutions are memory-mapped, so only the current problem and its reviews are held in memory
+PROBLEMS = open_problems(INPUT_FILE)
 for i, problem in enumerate(PROBLEMS, start=1):
     ID = problem['Problem_ID']
     if ID in COMPLETED_PROBLEMS:
         continue
     print(f"Problem {i}/{len(PROBLEMS)}")
 
-    PROMPT = (f"Problem: {problem['problem']} \n\n I had an LLM generate a solution to this. Solution: {problem['ai_solution']}  \n\n I had three other LLMs review this solution and point out any mistakes."
-                    "Are there any mistakes in the solution? If there are, list them down. Consider the following:"
-                    """Accuracy of calculations: Are the numbers correct based on the formulas used?
-
-Correctness of formulas and principles: Are the right physics and engineering concepts being applied?
-
-Logical consistency: Does the reasoning flow correctly from one step to the next?
-
-Completeness: Does it address all parts of the question?
-
-Assumptions made: Are any new assumptions introduced, and are they reasonable?
-
-Clarty and coherence: Is the explanation clear and easy to understand?
-
-Each score must be between 0 and 10.
+    reviews = {REVIEWER: get_review(REVIEWER, ID) for REVIEWER in REVIEWERS}
+    if CASCADE.enabled:
+        # A cascade stops at the first reviewers that accept the solution, so later reviews may be missing
+        REVIEWED = []
+        for REVIEWER in REVIEWERS:
+            if reviews[REVIEWER] is None:
+                break
+            REVIEWED.append(reviews[REVIEWER])
+        accepted = CASCADE.accepted_after(REVIEWED)
+        if accepted:
+            print("Accepted by", ", ".join(REVIEWERS[:accepted]))
+            open_writer(OUTPUT_FILE, ensure_ascii=False).write(accepted_record(ID, REVIEWERS[:accepted]))
+            ACCEPTED += 1
+            continue
+    missing = [REVIEWER for REVIEWER, review in reviews.items() if review is None]
+    if missing:
+        print("Missing review by", ", ".join(missing), "for", ID)
+        MISSING_REVIEWS.append(ID)
+        continue
 
-Also, the mistakes made in each of the categories have been mentioned.
-"""
-        )
-    for REVIEWER in REVIEWERS:
-        PROMPT += f"{REVIEWER}  had the following review:"
-        PROMPT += f"{json.dumps(all_reviews[REVIEWER][ID])}"
-    PROMPT += "Now, from these lists of mistakes, based on the problem and solution, finalize a list of mistakes which you think are actually mistakes."
+    messages = meta_review_messages(problem, reviews)
+    if MERGE_SIMILARITY is not None:
+        merged = merge_mistakes(reviews, MERGE_SIMILARITY)
+        merged_messages = merged_meta_review_messages(problem, merged, len(REVIEWERS))
+        MERGE_STATS.add(reviews, merged, messages, merged_messages)
+        messages = merged_messages
 
     try:
-        response = chat(
-            messages=[
-                {
-                    'role': 'system',
-                    'content': 'You are an expert on Physics. You are tasked to review the solutions to some problems.',
-                },
-                {
-                    'role': 'user',
-                    'content': PROMPT,
-                }
-            ],
-            model=META_REVIEWER,
-            format=Review.model_json_schema(),
+        content = ollama_chat(
+            chat, META_REVIEWER, messages,
+            format=MistakeReview.model_json_schema(), validate=MistakeReview.model_validate_json,
+            keep_alive=KEEP_ALIVE, timeout=MAX_TIME_LIMIT, problem=problem
         )
 
-        review = Review.model_validate_json(response.message.content)
-        review = review.model_dump()
-        review['Problem_ID'] = ID
+        review = mistake_record(content, ID)
         print("Found errors:", len(review['mistakes']))
-        with open(OUTPUT_FILE, 'a', encoding='utf-8') as out_f:
-            out_f.write(json.dumps(review, ensure_ascii=False) + '\n')
+        open_writer(OUTPUT_FILE, ensure_ascii=False).write(review)
     except Exception as e:
         print(e)
         ERROR_COUNT += 1
 
+PROBLEMS.close()
+STATE.close()
+
+print(CACHE.summary())
+if MERGE_SIMILARITY is not None:
+    print(MERGE_STATS.summary())
+if ACCEPTED:
+    print(f"{ACCEPTED} problems were accepted by the review cascade without the META_REVIEWER.")
+if MISSING_REVIEWS:
+    print(f"{len(MISSING_REVIEWS)} problems were skipped because some reviews are missing. Run REVIEWERS.py first.")
 if ERROR_COUNT:
     print(f"There were {ERROR_COUNT} errors. Please run again.")
-else:
+elif not MISSING_REVIEWS:
     print(f"All problems reviewed successfully")
\ No newline at end of file
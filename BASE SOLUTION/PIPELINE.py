@@ -0,0 +1,279 @@
+from openai import AsyncOpenAI
+from ollama import AsyncClient
+import asyncio
+import os
+from dotenv import dotenv_values
+from cascade import open_cascade
+from dataset import open_dataset
+from jsonl_writer import open_writer
+from llm_calls import setup, openai_chat_async, ollama_chat_async
+from metrics import STAGE
+from mistake_merge import MergeStats, merge_mistakes, open_merge
+from ollama_scheduler import create_scheduler
+from packing import Packer
+from run_state import RunState, model_key
+from shards import open_shard, select, unsharded_path
+from stages import (
+    proposed_solution_file, self_refined_solution_file, review_file, meta_review_file,
+    single_agent_review_file, single_agent_solution_file, multi_agent_solution_file,
+    proposer_messages, self_refinement_messages, feedback_messages, solution_record,
+    Review, MistakeReview, review_messages, score_review, meta_review_messages,
+    merged_meta_review_messages, single_agent_review_messages, mistake_record, accepted_record,
+    PackedReviews, packed_review_messages, packed_review_records,
+)
+
+MAX_TIME_LIMIT = 180 # seconds
+
+# Load environment variables from the .env file (if present)
+config = dotenv_values(".env")
+CACHE = setup(config, "pipeline")
+open_shard(config)
+
+# Access environment variables as if they came from the actual environment
+BASE_URL = config['BASE_URL']
+MODEL = config['MODEL']
+API_KEY = config['API_KEY']
+REVIEWERS = config['REVIEWERS'].split(" ")
+META_REVIEWER = config['META_REVIEWER']
+# Branches that run after the PROPOSER: self_refinement, single_agent, multi_agent
+BRANCHES = (config.get('PIPELINE_BRANCHES') or "self_refinement single_agent multi_agent").split()
+# Requests in flight for the proposer model and for each Ollama model
+CONCURRENCY = int(config.get('CONCURRENCY') or 4)
+REVIEW_CONCURRENCY = int(config.get('REVIEW_CONCURRENCY') or 1)
+META_REVIEW_CONCURRENCY = int(config.get('META_REVIEW_CONCURRENCY') or 1)
+# Problems per review request, as in REVIEWERS.py
+REVIEW_PACK = int(config.get('REVIEW_PACK') or 1)
+# Problems that can be somewhere in the pipeline at the same time
+PROBLEMS_IN_FLIGHT = int(config.get('PROBLEMS_IN_FLIGHT') or 4 * CONCURRENCY)
+# With CASCADE=true each reviewer waits for the ones before it and only reviews what they did not accept
+CASCADE = open_cascade(config)
+# With MERGE_MISTAKES=true the META_REVIEWER only gets the merged mistakes of the reviews, as in META_REVIEWER.py
+MERGE_SIMILARITY = open_merge(config)
+MERGE_STATS = MergeStats()
+SKIPPED = object() # Returned by a stage that the cascade skips. Nothing is written for it
+
+os.makedirs("./SOLUTIONS", exist_ok=True)
+os.makedirs("./REVIEWS", exist_ok=True)
+
+# Can be used with openai, ollama, gemini, openrouter etc.
+async_client = AsyncOpenAI(
+  base_url=BASE_URL,
+  api_key=API_KEY,
+)
+# Ollama requests are grouped by model so the reviewers are not swapped in and out for every problem
+SCHEDULER = create_scheduler(AsyncClient(timeout=MAX_TIME_LIMIT), config, max(REVIEW_CONCURRENCY, META_REVIEW_CONCURRENCY))
+async_chat = SCHEDULER.chat
+
+STATE = RunState()
+
+
+class Stage:
+    """One node of the pipeline DAG. It writes the same output file as the matching script."""
+
+    def __init__(self, node, stage, model, output_file, upstream, call, concurrency, ensure_ascii=True):
+        self.node = node
+        self.stage = stage
+        self.model = model
+        self.output_file = output_file
+        self.upstream = upstream
+        self.call = call
+        self.semaphore = asyncio.Semaphore(max(1, concurrency))
+        self.ensure_ascii = ensure_ascii
+        STATE.sync_jsonl(stage, model, output_file)
+        if unsharded_path(output_file) != output_file:
+            STATE.sync_jsonl(stage, model, unsharded_path(output_file))
+        self.completed = STATE.completed(stage, model)
+        self.done = 0
+        self.failed = 0
+        self.skipped = 0
+
+    async def run(self, problem: dict, inputs: dict):
+        """Returns this stage's record for a problem, reusing the one on disk if it exists."""
+        ID = problem['Problem_ID']
+        if ID in self.completed:
+            return STATE.read_record(self.stage, self.model, ID)
+        # Label the model calls of this task with the stage in the metrics
+        STAGE.set(self.stage)
+        async with self.semaphore:
+            try:
+                record = await self.call(problem, inputs)
+            except Exception as e:
+                print(f"[{self.node}] {ID}: {e}")
+                record = None
+        if record is SKIPPED:
+            self.skipped += 1
+            return record
+        if not record:
+            self.failed += 1
+            print(f"[{self.node}] Failed:", ID)
+            return None
+        open_writer(self.output_file, ensure_ascii=self.ensure_ascii).write(record)
+        self.done += 1
+        print(f"[{self.node}] Done:", ID)
+        return record
+
+
+async def complete(messages: list, problem: dict):
+    return await openai_chat_async(async_client, MODEL, messages, timeout=MAX_TIME_LIMIT, early_stop=True, problem=problem)
+
+async def propose(problem: dict, inputs: dict):
+    solution = await complete(proposer_messages(problem['problem']), problem)
+    return solution_record(problem, solution) if solution else None
+
+async def self_refine(problem: dict, inputs: dict):
+    proposed = inputs["propose"]
+    solution = await complete(self_refinement_messages(proposed['problem'], proposed['ai_solution']), problem)
+    return solution_record(proposed, solution) if solution else None
+
+async def refine_with_feedback(problem: dict, proposed: dict, feedback: list[str]):
+    if len(feedback) == 0:
+        return solution_record(proposed, proposed['ai_solution'], no_mistakes=True)
+    solution = await complete(feedback_messages(proposed['problem'], proposed['ai_solution'], feedback), problem)
+    return solution_record(proposed, solution) if solution else None
+
+def reviewer(REVIEWER: str):
+    async def review_one(problem: dict):
+        content = await ollama_chat_async(
+            async_chat, REVIEWER, review_messages(problem),
+            format=Review.model_json_schema(), validate=Review.model_validate_json,
+            timeout=MAX_TIME_LIMIT, problem=problem
+        )
+        return score_review(content, problem['Problem_ID'])
+
+    async def review_pack(problems: list[dict]):
+        content = await ollama_chat_async(
+            async_chat, REVIEWER, packed_review_messages(problems),
+            format=PackedReviews.model_json_schema(), validate=PackedReviews.model_validate_json,
+            timeout=MAX_TIME_LIMIT * len(problems)
+        )
+        return packed_review_records(content, [problem['Problem_ID'] for problem in problems])
+
+    packer = Packer(REVIEW_PACK, review_pack, review_one) if REVIEW_PACK > 1 else None
+
+    async def review(problem: dict, inputs: dict):
+        if CASCADE.enabled:
+            earlier = [inputs[f"review:{EARLIER}"] for EARLIER in REVIEWERS[:REVIEWERS.index(REVIEWER)]]
+            if SKIPPED in earlier or CASCADE.accepted_after(earlier):
+                return SKIPPED
+        return await (packer.review(inputs["propose"]) if packer else review_one(inputs["propose"]))
+    return review
+
+async def meta_review(problem: dict, inputs: dict):
+    reviews = {}
+    for REVIEWER in REVIEWERS:
+        if inputs[f"review:{REVIEWER}"] is SKIPPED:
+            break
+        reviews[REVIEWER] = {k: v for k, v in inputs[f"review:{REVIEWER}"].items() if k != 'Problem_ID'}
+    accepted = CASCADE.accepted_after(list(reviews.values()))
+    if accepted:
+        return accepted_record(problem['Problem_ID'], REVIEWERS[:accepted])
+    messages = meta_review_messages(inputs["propose"], reviews)
+    if MERGE_SIMILARITY is not None:
+        merged = merge_mistakes(reviews, MERGE_SIMILARITY)
+        merged_messages = merged_meta_review_messages(inputs["propose"], merged, len(REVIEWERS))
+        MERGE_STATS.add(reviews, merged, messages, merged_messages)
+        messages = merged_messages
+    content = await ollama_chat_async(
+        async_chat, META_REVIEWER, messages,
+        format=MistakeReview.model_json_schema(), validate=MistakeReview.model_validate_json,
+        timeout=MAX_TIME_LIMIT, problem=problem
+    )
+    return mistake_record(content, problem['Problem_ID'])
+
+async def single_agent_review(problem: dict, inputs: dict):
+    content = await ollama_chat_async(
+        async_chat, META_REVIEWER, single_agent_review_messages(inputs["propose"]),
+        format=MistakeReview.model_json_schema(), validate=MistakeReview.model_validate_json,
+        timeout=MAX_TIME_LIMIT, problem=problem
+    )
+    return mistake_record(content, problem['Problem_ID'])
+
+async def single_agent_refine(problem: dict, inputs: dict):
+    return await refine_with_feedback(problem, inputs["propose"], inputs["single_agent_review"]['mistakes'])
+
+async def multi_agent_refine(problem: dict, inputs: dict):
+    return await refine_with_feedback(problem, inputs["propose"], inputs["meta_review"]['mistakes'])
+
+
+# Stages are listed in topological order, each after the stages it depends on
+STAGES = [Stage("propose", "propose", MODEL, proposed_solution_file(MODEL), [], propose, CONCURRENCY)]
+if "self_refinement" in BRANCHES:
+    STAGES.append(Stage("self_refine", "self_refine", MODEL, self_refined_solution_file(MODEL), ["propose"], self_refine, CONCURRENCY))
+if "single_agent" in BRANCHES:
+    STAGES += [
+        Stage("single_agent_review", "single_agent_review", model_key(MODEL, META_REVIEWER), single_agent_review_file(MODEL, META_REVIEWER),
+              ["propose"], single_agent_review, META_REVIEW_CONCURRENCY, ensure_ascii=False),
+        Stage("single_agent_refine", "single_agent_refine", model_key(MODEL, META_REVIEWER), single_agent_solution_file(MODEL, META_REVIEWER),
+              ["propose", "single_agent_review"], single_agent_refine, CONCURRENCY),
+    ]
+if "multi_agent" in BRANCHES:
+    STAGES += [
+        Stage(f"review:{REVIEWER}", "review", model_key(MODEL, REVIEWER), review_file(MODEL, REVIEWER),
+              ["propose"] + ([f"review:{EARLIER}" for EARLIER in REVIEWERS[:i]] if CASCADE.enabled else []),
+              reviewer(REVIEWER), REVIEW_CONCURRENCY * REVIEW_PACK, ensure_ascii=False)
+        for i, REVIEWER in enumerate(REVIEWERS)
+    ]
+    STAGES += [
+        Stage("meta_review", "meta_review", model_key(MODEL, META_REVIEWER, *REVIEWERS), meta_review_file(MODEL, META_REVIEWER, REVIEWERS),
+              ["propose"] + [f"review:{REVIEWER}" for REVIEWER in REVIEWERS], meta_review, META_REVIEW_CONCURRENCY, ensure_ascii=False),
+        Stage("multi_agent_refine", "multi_agent_refine", model_key(MODEL, META_REVIEWER, *REVIEWERS), multi_agent_solution_file(MODEL, META_REVIEWER, REVIEWERS),
+              ["propose", "meta_review"], multi_agent_refine, CONCURRENCY),
+    ]
+
+
+async def run_problem(problem: dict):
+    """Starts every stage of a problem at once. Each stage waits only for its own upstream stages."""
+    tasks = {}
+
+    async def run_stage(stage: Stage):
+        inputs = {}
+        for node in stage.upstream:
+            record = await tasks[node]
+            if record is None:
+                return None
+            inputs[node] = record
+        return await stage.run(problem, inputs)
+
+    for stage in STAGES:
+        tasks[stage.node] = asyncio.ensure_future(run_stage(stage))
+    await asyncio.gather(*tasks.values())
+
+async def run_pipeline(problems: list):
+    pending = iter([
+        (i, problem) for i, problem in enumerate(problems, start=1)
+        if any(problem['Problem_ID'] not in stage.completed for stage in STAGES)
+    ])
+
+    async def worker():
+        for i, problem in pending:
+            print(f"Problem {i}/{len(problems)}")
+            await run_problem(problem)
+
+    # Load the first Ollama models while the proposer works on the first problems
+    OLLAMA_MODELS = []
+    if "multi_agent" in BRANCHES:
+        OLLAMA_MODELS += REVIEWERS
+    if "single_agent" in BRANCHES or "multi_agent" in BRANCHES:
+        OLLAMA_MODELS.append(META_REVIEWER)
+    await SCHEDULER.prefetch(list(dict.fromkeys(OLLAMA_MODELS)))
+    await asyncio.gather(*(worker() for _ in range(max(1, PROBLEMS_IN_FLIGHT))))
+
+
+# Replace with API call to Huggingface dataset when dataset is made public "https://huggingface.co/datasets/IUTVanguard/PhysicsEval"
+PROBLEMS = select(open_dataset("test set.json"))
+
+asyncio.run(run_pipeline(PROBLEMS))
+STATE.close()
+
+print(CACHE.summary())
+print(SCHEDULER.summary())
+if MERGE_SIMILARITY is not None:
+    print(MERGE_STATS.summary())
+ERROR_COUNT = 0
+for stage in STAGES:
+    print(f"{stage.node:<40} {stage.done} done, {stage.failed} failed" + (f", {stage.skipped} skipped by the cascade" if stage.skipped else ""))
+    ERROR_COUNT += stage.failed
+if ERROR_COUNT:
+    print(f"There were {ERROR_COUNT} error/s: Please run the code again")
+else:
+    print("All problems solved successfully")
@@ -1,17 +1,32 @@
-from openai import OpenAI
-import json
+from openai import OpenAI, AsyncOpenAI
 import os
 from dotenv import dotenv_values
+from dataset import open_dataset
+from async_engine import run_async
+from batch_api import run_batch
+from jsonl_writer import open_writer
+from llm_calls import setup, openai_chat, openai_chat_async
+from run_state import load_completed
+from shards import open_shard, select
+from stages import proposed_solution_file, proposer_messages, solution_record
 
 MAX_TIME_LIMIT = 180 # seconds
 
 # Load environment variables from the .env file (if present)
 config = dotenv_values(".env")
+CACHE = setup(config, "propose")
+open_shard(config)
 
 # Access environment variables as if they came from the actual environment
 BASE_URL = config['BASE_URL']
 MODEL = config['MODEL']
 API_KEY = config['API_KEY']
+# Number of requests kept in flight at once. 1 runs the problems one after another
+CONCURRENCY = int(config.get('CONCURRENCY') or 1)
+# Submit all problems through the provider's batch API instead of one request per problem
+BATCH = (config.get('BATCH') or "").lower() in ("1", "true", "yes")
+BATCH_SIZE = int(config.get('BATCH_SIZE') or 1000)
+BATCH_POLL_INTERVAL = float(config.get('BATCH_POLL_INTERVAL') or 30)
 
 os.makedirs("./SOLUTIONS", exist_ok=True)
 
@@ -20,73 +35,73 @@ client = OpenAI(
   base_url=BASE_URL,
   api_key=API_KEY,
 )
+async_client = AsyncOpenAI(
+  base_url=BASE_URL,
+  api_key=API_KEY,
+)
 
-def sanitize_file_name(name: str):
-    _forbidden_chars = "<>:\"/\\|?* "
-    for _c in _forbidden_chars:
-        name = name.replace(_c, "_")
-    return name
-
-OUTPUT_FILE = f"./SOLUTIONS/proposed_solution_by_{sanitize_file_name(MODEL)}.jsonl"
+OUTPUT_FILE = proposed_solution_file(MODEL)
 
 # Replace with API call to Huggingface dataset when dataset is made public "https://huggingface.co/datasets/IUTVanguard/PhysicsEval"
-with open("test set.json", "r", encoding="utf-8") as f:
-    PROBLEMS = json.load(f)
+PROBLEMS = select(open_dataset("test set.json"))
 
-def get_solution(problem: str):
+def get_solution(problem: dict):
     try:
-        completion = client.chat.completions.create(
-            model=MODEL,
-            messages=[
-                {
-                    "role": "user",
-                    "content": (f"You are an expert on Physics. You solve problems step by step while maintaining logical consistency. Solve the following Physics problem: {problem}"
-
-                    "Finally, write the final answers in brief. Make sure you write all equations in LaTeX.")
-                }
-            ],
-            timeout=MAX_TIME_LIMIT
-        )
-
-        return completion.choices[0].message.content
+        return openai_chat(client, MODEL, proposer_messages(problem['problem']), timeout=MAX_TIME_LIMIT, early_stop=True, problem=problem)
     except Exception as e:
         print(e)
         return None
 
+async def get_solution_async(problem: dict):
+    try:
+        return await openai_chat_async(async_client, MODEL, proposer_messages(problem['problem']), timeout=MAX_TIME_LIMIT, early_stop=True, problem=problem)
+    except Exception as e:
+        print(e)
+        return None
 
-
-COMPLETED_PROBLEMS = set()
-if os.path.exists(OUTPUT_FILE):
-    with open(OUTPUT_FILE, 'r', encoding='utf-8') as f:
-        COMPLETED_PROBLEMS = set(json.loads(line)['Problem_ID'] for line in f)
-ERROR_COUNT = 0
-for i, problem in enumerate(PROBLEMS, start=1):
-    ID = problem['Problem_ID']
-    if ID in COMPLETED_PROBLEMS:
-        continue
-    print(f"Problem {i}/{len(PROBLEMS)}")
-
-    solution = get_solution(problem['problem'])
+async def solve(problem: dict):
+    solution = await get_solution_async(problem)
     if not solution:
-        ERROR_COUNT += 1
-        print("Failed to solve:", ID)
-        continue
-
-    DATA = {}
-    DATA['Problem_ID'] = ID
-    DATA['problem'] = problem['problem']
-    DATA['ai_solution'] = solution
-    DATA['elaborated_solution_steps'] = problem['elaborated_solution_steps']
-
-    with open(OUTPUT_FILE, 'a', encoding='utf-8') as f:
-        f.write(json.dumps(DATA) + '\n')
-if ERROR_COUNT:
-    print(f"There were {ERROR_COUNT} error/s: Please run the code again")
-else:
-    print("All problems solved successfully")
+        return None
+    return solution_record(problem, solution)
 
 
-    
 
+COMPLETED_PROBLEMS = load_completed("propose", MODEL, OUTPUT_FILE)
+if BATCH:
+    ERROR_COUNT = 0
+    PENDING = {problem['Problem_ID']: problem for problem in PROBLEMS if problem['Problem_ID'] not in COMPLETED_PROBLEMS}
+    REQUESTS = {ID: proposer_messages(problem['problem']) for ID, problem in PENDING.items()}
+    for ID, solution in run_batch(client, MODEL, REQUESTS, OUTPUT_FILE, BATCH_SIZE, BATCH_POLL_INTERVAL):
+        if not solution:
+            ERROR_COUNT += 1
+            print("Failed to solve:", ID)
+            continue
 
+        DATA = solution_record(PENDING[ID], solution)
 
+        open_writer(OUTPUT_FILE).write(DATA)
+elif CONCURRENCY > 1:
+    ERROR_COUNT = run_async(PROBLEMS, solve, OUTPUT_FILE, COMPLETED_PROBLEMS, CONCURRENCY)
+else:
+    ERROR_COUNT = 0
+    for i, problem in enumerate(PROBLEMS, start=1):
+        ID = problem['Problem_ID']
+        if ID in COMPLETED_PROBLEMS:
+            continue
+        print(f"Problem {i}/{len(PROBLEMS)}")
+
+        solution = get_solution(problem)
+        if not solution:
+            ERROR_COUNT += 1
+            print("Failed to solve:", ID)
+            continue
+
+        DATA = solution_record(problem, solution)
+
+        open_writer(OUTPUT_FILE).write(DATA)
+print(CACHE.summary())
+if ERROR_COUNT:
+    print(f"There were {ERROR_COUNT} error/s: Please run the code again")
+else:
+    print("All problems solved successfully")
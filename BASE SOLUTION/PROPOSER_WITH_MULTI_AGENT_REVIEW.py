@@ -1,12 +1,18 @@
-from openai import OpenAI
-import json
-import os
+from openai import OpenAI, AsyncOpenAI
 from dotenv import dotenv_values
+from async_engine import run_async
+from jsonl_writer import open_writer, read_jsonl
+from llm_calls import setup, openai_chat, openai_chat_async
+from run_state import load_completed, model_key
+from shards import open_shard, open_problems, shard_input
+from stages import proposed_solution_file, meta_review_file, multi_agent_solution_file, feedback_messages, solution_record
 
 MAX_TIME_LIMIT = 180 # seconds
 
 # Load environment variables from the .env file (if present)
 config = dotenv_values(".env")
+CACHE = setup(config, "multi_agent_refine")
+open_shard(config)
 
 # Access environment variables as if they came from the actual environment
 META_REVIEWER = config['META_REVIEWER']
@@ -14,92 +20,77 @@ REVIEWERS = config['REVIEWERS'].split(" ")
 MODEL = config['MODEL']
 API_KEY = config['API_KEY']
 BASE_URL = config['BASE_URL']
-REVIEWERS = config['REVIEWERS'].split(" ")
+# Number of requests kept in flight at once. 1 runs the problems one after another
+CONCURRENCY = int(config.get('CONCURRENCY') or 1)
 
 # Can be used with openai, ollama, gemini, openrouter etc.
 client = OpenAI(
   base_url=BASE_URL,
   api_key=API_KEY,
 )
+async_client = AsyncOpenAI(
+  base_url=BASE_URL,
+  api_key=API_KEY,
+)
 
-def sanitize_file_name(name: str):
-    _forbidden_chars = "<>:\"/\\|?* "
-    for _c in _forbidden_chars:
-        name = name.replace(_c, "_")
-    return name
-
-INPUT_FILE = f"./SOLUTIONS/proposed_solution_by_{sanitize_file_name(MODEL)}.jsonl"
-OUTPUT_FILE = f"./SOLUTIONS/solution_by_{sanitize_file_name(MODEL)}_after_multi_agent_review_by_{sanitize_file_name(META_REVIEWER)}_for_{"_and_".join([sanitize_file_name(i) for i in REVIEWERS])}.jsonl"
-REVIEW_FILE = f'./REVIEWS/meta_review_of_{sanitize_file_name(MODEL)}_by_{sanitize_file_name(META_REVIEWER)}_for_{"_and_".join([sanitize_file_name(i) for i in REVIEWERS])}.jsonl'
+INPUT_FILE = proposed_solution_file(MODEL)
+OUTPUT_FILE = multi_agent_solution_file(MODEL, META_REVIEWER, REVIEWERS)
+REVIEW_FILE = meta_review_file(MODEL, META_REVIEWER, REVIEWERS)
 
-with open(INPUT_FILE, "r", encoding="utf-8") as f:
-    PROBLEMS = [json.loads(line) for line in f]
+PROBLEMS = open_problems(INPUT_FILE)
 
-with open(REVIEW_FILE, "r", encoding="utf-8") as f:
-    REVIEWS = [json.loads(line) for line in f]
-    REVIEWS = {i['Problem_ID']: i["mistakes"] for i in REVIEWS}
+REVIEWS = {i['Problem_ID']: i["mistakes"] for i in read_jsonl(shard_input(REVIEW_FILE))}
 
 def get_solution(problem: str, ai_solution: str, feedback: list[str]):
     try:
-        completion = client.chat.completions.create(
-            model=MODEL,
-            messages=[
-                {
-                    "role": "user",
-                    "content": (f"You are an expert on Physics. You solve problems step by step while maintaining logical consistency. Solve the following Physics problem: {problem}"
-
-                    "Finally, write the final answers in brief. Make sure you write all equations in LaTeX.")
-                },
-                {
-                    "role": "assistant",
-                    "content": f"{ai_solution}"
-                },
-                {
-                    "role": "user",
-                    "content": f"I have some feedback. {" ".join(feedback)} After taking this into account, please generate the solution once again. Remember to write all equations in LaTeX" 
-                }
-            ],
-            timeout=MAX_TIME_LIMIT
-        )
-
-        return completion.choices[0].message.content
+        return openai_chat(client, MODEL, feedback_messages(problem, ai_solution, feedback), timeout=MAX_TIME_LIMIT, early_stop=True)
     except Exception as e:
         print(e)
         return None
 
+async def get_solution_async(problem: str, ai_solution: str, feedback: list[str]):
+    try:
+        return await openai_chat_async(async_client, MODEL, feedback_messages(problem, ai_solution, feedback), timeout=MAX_TIME_LIMIT, early_stop=True)
+    except Exception as e:
+        print(e)
+        return None
 
-COMPLETED_PROBLEMS = set()
-if os.path.exists(OUTPUT_FILE):
-    with open(OUTPUT_FILE, 'r', encoding='utf-8') as f:
-        COMPLETED_PROBLEMS = set(json.loads(line)['Problem_ID'] for line in f)
-ERROR_COUNT = 0
-for i, problem in enumerate(PROBLEMS, start=1):
-    ID = problem['Problem_ID']
-    NO_MISTAKES = False
-    if ID in COMPLETED_PROBLEMS:
-        continue
-    print(f"Problem {i}/{len(PROBLEMS)}")
-    solution = ""
-    if len(REVIEWS[ID]) != 0:
-        solution = get_solution(problem['problem'], problem['ai_solution'], REVIEWS[ID])
-    else:
-        solution = problem['ai_solution']
-        NO_MISTAKES = True
+async def solve(problem: dict):
+    feedback = REVIEWS[problem['Problem_ID']]
+    if len(feedback) == 0:
+        return solution_record(problem, problem['ai_solution'], no_mistakes=True)
+    solution = await get_solution_async(problem['problem'], problem['ai_solution'], feedback)
     if not solution:
-        ERROR_COUNT += 1
-        print("Failed to solve:", ID)
-        continue
+        return None
+    return solution_record(problem, solution)
+
+
+COMPLETED_PROBLEMS = load_completed("multi_agent_refine", model_key(MODEL, META_REVIEWER, *REVIEWERS), OUTPUT_FILE)
+if CONCURRENCY > 1:
+    ERROR_COUNT = run_async(PROBLEMS, solve, OUTPUT_FILE, COMPLETED_PROBLEMS, CONCURRENCY)
+else:
+    ERROR_COUNT = 0
+    for i, problem in enumerate(PROBLEMS, start=1):
+        ID = problem['Problem_ID']
+        NO_MISTAKES = False
+        if ID in COMPLETED_PROBLEMS:
+            continue
+        print(f"Problem {i}/{len(PROBLEMS)}")
+        solution = ""
+        if len(REVIEWS[ID]) != 0:
+            solution = get_solution(problem['problem'], problem['ai_solution'], REVIEWS[ID])
+        else:
+            solution = problem['ai_solution']
+            NO_MISTAKES = True
+        if not solution:
+            ERROR_COUNT += 1
+            print("Failed to solve:", ID)
+            continue
 
-    DATA = {}
-    DATA['Problem_ID'] = ID
-    DATA['problem'] = problem['problem']
-    DATA['ai_solution'] = solution
-    DATA['elaborated_solution_steps'] = problem['elaborated_solution_steps']
-    if NO_MISTAKES:
-        DATA['no_mistakes'] = True
+        DATA = solution_record(problem, solution, NO_MISTAKES)
 
-    with open(OUTPUT_FILE, 'a', encoding='utf-8') as f:
-        f.write(json.dumps(DATA) + '\n')
+        open_writer(OUTPUT_FILE).write(DATA)
+print(CACHE.summary())
 if ERROR_COUNT:
     print(f"There were {ERROR_COUNT} error/s: Please run the code again")
 else:
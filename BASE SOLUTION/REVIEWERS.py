@@ -1,122 +1,178 @@
-from ollama import Client
-from pydantic import BaseModel
-import json
+from ollama import Client, AsyncClient
+import asyncio
 import os
 from dotenv import dotenv_values
+from async_engine import solve_all
+from cascade import open_cascade
+from jsonl_writer import open_writer, close_writer
+from llm_calls import setup, ollama_chat, ollama_chat_async
+from ollama_scheduler import create_scheduler
+from run_state import RunState, load_completed, model_key
+from shards import Selection, open_shard, open_problems
+from packing import Packer
+from stages import (
+    proposed_solution_file, review_file, Review, review_messages, score_review,
+    PackedReviews, packed_review_messages, packed_review_records,
+)
 
 MAX_TIME_LIMIT = 180 # seconds
 
 # Load environment variables from the .env file (if present)
 config = dotenv_values(".env")
+CACHE = setup(config, "review")
+open_shard(config)
 
 # Access environment variables as if they came from the actual environment
 REVIEWERS = config['REVIEWERS'].split(" ")
 MODEL = config['MODEL']
-
-
-def sanitize_file_name(name: str):
-    _forbidden_chars = "<>:\"/\\|?* "
-    for _c in _forbidden_chars:
-        name = name.replace(_c, "_")
-    return name
-
-INPUT_FILE = f"./SOLUTIONS/proposed_solution_by_{sanitize_file_name(MODEL)}.jsonl"
+# Number of review requests kept in flight per reviewer model. 1 reviews the problems one after another
+REVIEW_CONCURRENCY = int(config.get('REVIEW_CONCURRENCY') or 1)
+# Problems reviewed per request. Above 1, each request sends REVIEW_PACK problems with the rubric once
+REVIEW_PACK = int(config.get('REVIEW_PACK') or 1)
+# Review with every model in REVIEWERS at the same time instead of one model after another
+PARALLEL_REVIEWERS = (config.get('PARALLEL_REVIEWERS') or "").lower() in ("1", "true", "yes")
+# How long Ollama keeps a reviewer loaded after its last request
+KEEP_ALIVE = config.get('KEEP_ALIVE') or "30m"
+# With CASCADE=true the REVIEWERS (cheapest first) only review what the ones before them did not accept
+CASCADE = open_cascade(config)
+if CASCADE.enabled and PARALLEL_REVIEWERS:
+    print("CASCADE reviews with one model after another, PARALLEL_REVIEWERS is ignored")
+    PARALLEL_REVIEWERS = False
+
+
+INPUT_FILE = proposed_solution_file(MODEL)
 os.makedirs("./REVIEWS", exist_ok=True)
 
-
-class Review(BaseModel):
-  calculation_accuracy_score: float
-  calculation_mistakes: list[str]
-  formula_correctness_score: float
-  formula_mistakes: list[str]
-  logical_consistency_score: float
-  logical_mistakes: list[str]
-  completeness_score: float
-  incomplete_requirements: list[str]
-  assumption_validity_score: float
-  mistaken_assumptions: list[str]
-  clarity_and_coherence_score: float
-  incoherent_statements: list[str]
-
-chat = Client(timeout=MAX_TIME_LIMIT).chat
-
-ERROR_COUNT = 0
-for REVIEWER in REVIEWERS:
-    print("Review by", REVIEWER)
-    OUTPUT_FILE = f"./REVIEWS/review_of_{sanitize_file_name(MODEL)}_by_{sanitize_file_name(REVIEWER)}.jsonl"
-    COMPLETED_PROBLEMS = []
-    try:
-        with open(OUTPUT_FILE, 'r', encoding='utf-8') as f:
-            for line in f:
-                COMPLETED_PROBLEMS.append(json.loads(line)['Problem_ID'])
-    except Exception as e:
-        pass
-
-    
-    with open(INPUT_FILE, "r", encoding='utf-8') as f:
-        PROBLEMS = [json.loads(line) for line in f]
-        
-    for i, problem in enumerate(PROBLEMS, start=1):
-        ID = problem['Problem_ID']
-        if ID in COMPLETED_PROBLEMS:
-            continue
-        print(f"Problem {i}/{len(PROBLEMS)}")
-
-        PROMPT = (f"Problem: {problem['problem']} \n\n Solution: {problem['ai_solution']} \n\n Is this solution correct? If there are any mathematical or logical mistakes, point out the mistakes briefly."
-    """ 
-    Score the solution on the following criteria:
-    Accuracy of calculations (calculation_accuracy_score): Are the numbers correct based on the formulas used?
-
-    Correctness of formulas and principles (formula_correctness_score): Are the right physics and engineering concepts being applied?
-
-    Logical consistency (logical_consistency_score): Does the reasoning flow correctly from one step to the next?
-
-    Completeness (completeness_score): Does it address all parts of the question?
-
-    Assumptions made (assumption_validity_score): Are any new assumptions introduced, and are they reasonable?
-
-    Clarty and coherence (clarity_and_coherence_score): Is the explanation clear and easy to understand?
-
-    Each score must be between 0 and 10.
-
-    Also, point out the mistakes made in each of the categories mentioned.
-    """
-    )
+def get_output_file(REVIEWER: str):
+    return review_file(MODEL, REVIEWER)
+
+def get_completed_problems(REVIEWER: str):
+    return load_completed("review", model_key(MODEL, REVIEWER), get_output_file(REVIEWER))
+
+client = Client(timeout=MAX_TIME_LIMIT)
+chat = client.chat
+
+PROBLEMS = open_problems(INPUT_FILE)
+STATE = RunState() if CASCADE.enabled else None
+
+def get_problems(REVIEWER: str):
+    """The problems for REVIEWER. In a cascade, those that the reviewers before it reviewed and did not accept."""
+    index = REVIEWERS.index(REVIEWER)
+    if not CASCADE.enabled or index == 0:
+        return PROBLEMS
+    EARLIER = REVIEWERS[:index]
+    for EARLIER_REVIEWER in EARLIER:
+        # Their reviews are read back from disk, so write out what is still buffered
+        close_writer(get_output_file(EARLIER_REVIEWER))
+        STATE.sync_jsonl("review", model_key(MODEL, EARLIER_REVIEWER), get_output_file(EARLIER_REVIEWER))
+    selected, accepted, waiting = [], 0, 0
+    for i, problem in enumerate(PROBLEMS):
+        reviews = [STATE.read_record("review", model_key(MODEL, EARLIER_REVIEWER), problem['Problem_ID']) for EARLIER_REVIEWER in EARLIER]
+        # The reviews that exist may already accept it, even if later ones are missing
+        if CASCADE.accepted_after(reviews):
+            accepted += 1
+        elif None in reviews:
+            waiting += 1
+        else:
+            selected.append(i)
+    print(f"[{REVIEWER}] {accepted} problems accepted by {', '.join(EARLIER)}, {len(selected)} to review")
+    if waiting:
+        print(f"[{REVIEWER}] {waiting} problems wait for a review by {', '.join(EARLIER)}")
+    return Selection(PROBLEMS, selected)
+
+async def review_with(async_chat, REVIEWER: str):
+    OUTPUT_FILE = get_output_file(REVIEWER)
+
+    async def review_one(problem: dict):
+        content = await ollama_chat_async(
+            async_chat, REVIEWER, review_messages(problem),
+            format=Review.model_json_schema(), validate=Review.model_validate_json,
+            timeout=MAX_TIME_LIMIT, problem=problem
+        )
+        return score_review(content, problem['Problem_ID'])
+
+    async def review_pack(problems: list[dict]):
+        content = await ollama_chat_async(
+            async_chat, REVIEWER, packed_review_messages(problems),
+            format=PackedReviews.model_json_schema(), validate=PackedReviews.model_validate_json,
+            timeout=MAX_TIME_LIMIT * len(problems)
+        )
+        return packed_review_records(content, [problem['Problem_ID'] for problem in problems])
+
+    packer = Packer(REVIEW_PACK, review_pack, review_one) if REVIEW_PACK > 1 else None
+
+    async def solve(problem: dict):
         try:
-            response = chat(
-                messages=[
-                    {
-                        'role': 'system',
-                        'content': 'You are an expert on Physics. You are tasked to review the solutions to some problems.',
-                    },
-                    {
-                        'role': 'user',
-                        'content': PROMPT,
-                    }
-                ],
-                model=REVIEWER,
-                format=Review.model_json_schema(),
-            )
-
-            review = Review.model_validate_json(response.message.content)
-            review = review.model_dump()
-            review['Problem_ID'] = ID
-            review['final_score'] = (
-                review['calculation_accuracy_score'] * 0.3 
-                + review['formula_correctness_score'] * 0.25 
-                + review['logical_consistency_score'] * 0.25 
-                + review['completeness_score'] * 0.1 
-                + review['assumption_validity_score'] * 0.05 
-                + review['clarity_and_coherence_score'] * 0.05
-            )
-            print("Final Score:", review['final_score'])
-            with open(OUTPUT_FILE, 'a', encoding='utf-8') as out_f:
-                out_f.write(json.dumps(review, ensure_ascii=False) + '\n')
+            review = await (packer.review(problem) if packer else review_one(problem))
+            print(f"[{REVIEWER}] Final Score:", review['final_score'])
+            return review
         except Exception as e:
             print(e)
-            ERROR_COUNT += 1
+            return None
 
+    # Enough problems in flight to fill REVIEW_CONCURRENCY packs
+    error_count = await solve_all(
+        get_problems(REVIEWER), solve, OUTPUT_FILE, get_completed_problems(REVIEWER),
+        REVIEW_CONCURRENCY * REVIEW_PACK, label=f"[{REVIEWER}] ", ensure_ascii=False
+    )
+    if packer:
+        print(f"[{REVIEWER}]", packer.summary())
+    return error_count
+
+async def review_all(scheduler):
+    async_chat = scheduler.chat
+    if PARALLEL_REVIEWERS:
+        print("Review by", ", ".join(REVIEWERS))
+        return sum(await asyncio.gather(*(review_with(async_chat, REVIEWER) for REVIEWER in REVIEWERS)))
+    error_count = 0
+    for REVIEWER in REVIEWERS:
+        print("Review by", REVIEWER)
+        error_count += await review_with(async_chat, REVIEWER)
+    return error_count
 
+ERROR_COUNT = 0
+if REVIEW_CONCURRENCY > 1 or PARALLEL_REVIEWERS or REVIEW_PACK > 1:
+    # The scheduler serves the reviewers in batches per model instead of interleaving them
+    SCHEDULER = create_scheduler(AsyncClient(timeout=MAX_TIME_LIMIT), config, REVIEW_CONCURRENCY)
+    ERROR_COUNT = asyncio.run(review_all(SCHEDULER))
+    print(SCHEDULER.summary())
+else:
+    for REVIEWER_INDEX, REVIEWER in enumerate(REVIEWERS):
+        print("Review by", REVIEWER)
+        OUTPUT_FILE = get_output_file(REVIEWER)
+        COMPLETED_PROBLEMS = get_completed_problems(REVIEWER)
+        REVIEWER_PROBLEMS = get_problems(REVIEWER)
+
+        for i, problem in enumerate(REVIEWER_PROBLEMS, start=1):
+            ID = problem['Problem_ID']
+            if ID in COMPLETED_PROBLEMS:
+                continue
+            print(f"Problem {i}/{len(REVIEWER_PROBLEMS)}")
+
+            try:
+                content = ollama_chat(
+                    chat, REVIEWER, review_messages(problem),
+                    format=Review.model_json_schema(), validate=Review.model_validate_json,
+                    keep_alive=KEEP_ALIVE, timeout=MAX_TIME_LIMIT, problem=problem
+                )
+
+                review = score_review(content, ID)
+                print("Final Score:", review['final_score'])
+                open_writer(OUTPUT_FILE, ensure_ascii=False).write(review)
+            except Exception as e:
+                print(e)
+                ERROR_COUNT += 1
+
+        # Free the memory for the next reviewer instead of waiting for KEEP_ALIVE to run out
+        if REVIEWER_INDEX < len(REVIEWERS) - 1:
+            try:
+                client.generate(model=REVIEWER, keep_alive=0)
+            except Exception as e:
+                print(e)
+
+if STATE:
+    STATE.close()
+print(CACHE.summary())
 if ERROR_COUNT:
     print(f"There were {ERROR_COUNT} errors. Please run again.")
 else:
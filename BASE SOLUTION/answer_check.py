@@ -0,0 +1,383 @@
+import ast
+import math
+import re
+import sys
+from streaming import FINAL_ANSWERS_HEADING, strip_thinking
+
+# Local check of the final answers of a solution against the final_answers_in_brief of the dataset.
+# The answers are read from the "Final answers" section (or the \boxed{} values) of the solution,
+# their LaTeX is turned into plain expressions, and every number is compared in SI units with a
+# tolerance. Each reference answer is paired with one answer of the solution, by its label ("(a)",
+# "b.", "2)") or else by position, and their numbers are compared in order. The verdict is only
+# "match" or "mismatch" when the answers pair up one-to-one and every reference value agrees or
+# every one is clearly contradicted; everything else is left to the judge.
+
+MATCH_TOLERANCE = 0.02 # relative difference up to which two values agree
+MISMATCH_TOLERANCE = 0.1 # relative difference from which two values contradict each other
+MAX_STATEMENT = 300 # characters of one answer statement that are parsed
+CLEAR_VERDICTS = ("match", "mismatch")
+
+# Exponents of (m, kg, s, A, K, mol) in the dimension of a unit
+def dims(m=0, kg=0, s=0, A=0, K=0, mol=0):
+    return (m, kg, s, A, K, mol)
+
+NONE = dims()
+ENERGY = dims(m=2, kg=1, s=-2)
+UNITS = {
+    "m": (1, dims(m=1)), "g": (1e-3, dims(kg=1)), "s": (1, dims(s=1)), "A": (1, dims(A=1)),
+    "K": (1, dims(K=1)), "mol": (1, dims(mol=1)),
+    "N": (1, dims(m=1, kg=1, s=-2)), "J": (1, ENERGY), "W": (1, dims(m=2, kg=1, s=-3)),
+    "Pa": (1, dims(m=-1, kg=1, s=-2)), "Hz": (1, dims(s=-1)), "C": (1, dims(s=1, A=1)),
+    "V": (1, dims(m=2, kg=1, s=-3, A=-1)), "ohm": (1, dims(m=2, kg=1, s=-3, A=-2)),
+    "F": (1, dims(m=-2, kg=-1, s=4, A=2)), "T": (1, dims(kg=1, s=-2, A=-1)),
+    "Wb": (1, dims(m=2, kg=1, s=-2, A=-1)), "H": (1, dims(m=2, kg=1, s=-2, A=-2)),
+    "eV": (1.602176634e-19, ENERGY), "cal": (4.184, ENERGY), "Wh": (3600, ENERGY),
+    "L": (1e-3, dims(m=3)), "min": (60, dims(s=1)), "h": (3600, dims(s=1)), "hr": (3600, dims(s=1)),
+    "atm": (101325, dims(m=-1, kg=1, s=-2)), "bar": (1e5, dims(m=-1, kg=1, s=-2)),
+    "u": (1.66053906660e-27, dims(kg=1)), "amu": (1.66053906660e-27, dims(kg=1)),
+    "rad": (1, NONE), "deg": (math.pi / 180, NONE), "percent": (0.01, NONE),
+}
+PREFIXES = {"T": 1e12, "G": 1e9, "M": 1e6, "k": 1e3, "c": 1e-2, "m": 1e-3, "u": 1e-6, "n": 1e-9, "p": 1e-12, "f": 1e-15}
+PREFIXED = {"m", "g", "s", "A", "K", "mol", "N", "J", "W", "Pa", "Hz", "C", "V", "ohm", "F", "T", "Wb", "H", "eV", "L", "Wh"}
+UNIT_NAMES = {"meter": "m", "meters": "m", "second": "s", "seconds": "s", "sec": "s", "kilogram": "kg", "kilograms": "kg",
+              "newton": "N", "newtons": "N", "joule": "J", "joules": "J", "watt": "W", "watts": "W", "volt": "V",
+              "volts": "V", "degree": "deg", "degrees": "deg", "radian": "rad", "radians": "rad", "liter": "L",
+              "liters": "L", "l": "L", "Ohm": "ohm", "ohms": "ohm", "kelvin": "K", "hours": "h", "minutes": "min"}
+
+LATEX_WRAPPERS = re.compile(r"\\(?:text|mathrm|textrm|mathit|mathbf|boldsymbol|operatorname|textbf|rm|vec|overline|bar|hat)\s*\{([^{}]*)\}")
+LATEX_REPLACEMENTS = [
+    (re.compile(r"\\(?:left|right|big|Big|bigg|Bigg)\b\s*\\?"), ""),
+    (re.compile(r"\\[,;:! ]|~|\\quad|\\qquad"), " "),
+    (re.compile(r"\{,\}"), ""), # 1{,}000
+    (re.compile(r"\\(?:times|cdot)|[×·⋅]"), "*"),
+    (re.compile(r"\\div|÷"), "/"),
+    (re.compile(r"\^\s*\{?\s*\\circ\s*\}?|\\circ|\\degree|°"), " deg "),
+    (re.compile(r"\\%|%"), " percent "),
+    (re.compile(r"\\(?:approx|simeq|sim|equiv|cong)|≈|\\Rightarrow|\\implies|→"), "="),
+    (re.compile(r"\\Omega|Ω"), "ohm"),
+    (re.compile(r"\\mu\s*|μ|µ"), "u"),
+    (re.compile(r"\\pi\b|π"), "pi"),
+    (re.compile(r"−|–"), "-"),
+    (re.compile(r"\\(?:displaystyle|boxed)\b"), ""),
+]
+NUMBER_START = re.compile(r"[-+]?(?:\d|\.\d|sqrt\(|pi\b|\()")
+EXPRESSION = re.compile(r"(?:[0-9.+\-*/() ]|sqrt|pi\b|[eE](?=[-+]?\d))+")
+UNIT_TOKEN = re.compile(r"\s*(\*\*\s*\(?\s*[-+]?\d+(?:\.\d+)?\s*\)?|/|\*|\(|\)|[A-Za-z]+)")
+LABEL = re.compile(r"(?:^|\s)\(?([a-hA-H])(?:\)|\.|:)\s+|^\s*(?:(\d+)[.)]|[-*•])\s+", re.MULTILINE)
+SPLIT = re.compile(r";|\\\\|\s+and\s+|,\s+(?=[^,=]*=)")
+# An answer that rules a value out, e.g. "not 5 m", is neither a match nor a contradiction
+NEGATION = re.compile(r"\\neq?\b|≠|\bnot\b|n't\b|\bnever\b", re.IGNORECASE)
+
+
+def find_group(text: str, start: int):
+    """Returns the end of the {...} group that starts at `start`, or -1."""
+    depth = 0
+    for position in range(start, len(text)):
+        if text[position] == "{":
+            depth += 1
+        elif text[position] == "}":
+            depth -= 1
+            if depth == 0:
+                return position + 1
+    return -1
+
+def replace_command(text: str, command: str, arguments: int, template: str):
+    """Replaces `\\command{a}{b}` by `template` filled with the arguments."""
+    pattern = re.compile(r"\\" + command + r"\s*(?=\{)")
+    while True:
+        match = pattern.search(text)
+        if not match:
+            return text
+        values, position = [], match.end()
+        for _ in range(arguments):
+            while position < len(text) and text[position] == " ":
+                position += 1
+            end = find_group(text, position) if position < len(text) and text[position] == "{" else -1
+            if end < 0:
+                return text
+            values.append(text[position + 1:end - 1])
+            position = end
+        text = text[:match.start()] + template.format(*values) + text[position:]
+
+def normalize(text: str):
+    """Turns LaTeX into a plain expression, e.g. "\\frac{1}{2} \\times 10^{3}\\,\\text{m/s}^2" -> "((1)/(2)) * 10**(3) m/s**2"."""
+    text = re.sub(r"\$+|\\\(|\\\)|\\\[|\\\]", " ", text)
+    previous = None
+    while previous != text:
+        previous, text = text, LATEX_WRAPPERS.sub(r"\1", text)
+    for pattern, replacement in LATEX_REPLACEMENTS:
+        text = pattern.sub(replacement, text)
+    text = replace_command(text, r"[dt]?frac", 2, "(({})/({}))")
+    text = replace_command(text, "sqrt", 1, "sqrt({})")
+    text = re.sub(r"\^\s*\{([^{}]*)\}", r"**(\1)", text)
+    text = re.sub(r"\^\s*([-+]?\d+(?:\.\d+)?|\w)", r"**\1", text)
+    text = text.replace("{", "(").replace("}", ")")
+    # Implicit products, e.g. 2pi or 3(4)
+    text = re.sub(r"(\d|\))\s*(?=pi\b|sqrt\(|\()", r"\1*", text)
+    return text
+
+
+def evaluate(expression: str):
+    """Evaluates a numeric expression with + - * / **, pi and sqrt. Returns None if it is not one."""
+    try:
+        tree = ast.parse(expression.strip(), mode="eval")
+    except (SyntaxError, ValueError):
+        return None
+
+    def value(node):
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+            return float(node.value)
+        if isinstance(node, ast.Name) and node.id == "pi":
+            return math.pi
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.UAdd, ast.USub)):
+            operand = value(node.operand)
+            return -operand if isinstance(node.op, ast.USub) else operand
+        if isinstance(node, ast.BinOp) and isinstance(node.op, (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow)):
+            left, right = value(node.left), value(node.right)
+            if isinstance(node.op, ast.Add):
+                return left + right
+            if isinstance(node.op, ast.Sub):
+                return left - right
+            if isinstance(node.op, ast.Mult):
+                return left * right
+            if isinstance(node.op, ast.Div):
+                return left / right
+            if abs(right) > 400:
+                raise OverflowError
+            return left ** right
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == "sqrt" and len(node.args) == 1 and not node.keywords:
+            return math.sqrt(value(node.args[0]))
+        raise ValueError
+
+    try:
+        result = value(tree.body)
+    except (ValueError, ZeroDivisionError, OverflowError, TypeError):
+        return None
+    return result if isinstance(result, float) and math.isfinite(result) else None
+
+def lookup_unit(name: str):
+    name = UNIT_NAMES.get(name, name)
+    if name in UNITS:
+        return UNITS[name]
+    if len(name) > 1 and name[0] in PREFIXES and name[1:] in PREFIXED:
+        scale, dimension = UNITS[name[1:]]
+        return PREFIXES[name[0]] * scale, dimension
+    return None
+
+def parse_unit(text: str):
+    """Parses the unit at the start of `text`, e.g. "kg*m/s**2 to the east". Returns (scale, dimension,
+    length of the unit), with dimension None if there is no unit or it is not known."""
+    scale, dimension, found = 1.0, [0] * len(NONE), False
+    signs, pending, position, last, end = [1], 1, 0, None, 0
+    while True:
+        match = UNIT_TOKEN.match(text, position)
+        if not match:
+            break
+        token = match.group(1)
+        if token.startswith("**"):
+            if last is None:
+                break
+            exponent = float(re.sub(r"[^\d.+-]", "", token))
+            unit_scale, unit_dimension, sign = last
+            # The unit was already counted once
+            scale *= unit_scale ** (sign * (exponent - 1))
+            for i, power in enumerate(unit_dimension):
+                dimension[i] += sign * power * (exponent - 1)
+            last = None
+        elif token == "/":
+            pending = -1
+        elif token == "*":
+            pass
+        elif token == "(":
+            signs.append(signs[-1] * pending)
+            pending = 1
+        elif token == ")":
+            if len(signs) == 1:
+                break
+            signs.pop()
+            last = None
+        else:
+            unit = lookup_unit(token)
+            if unit is None:
+                break
+            sign = signs[-1] * pending
+            pending = 1
+            scale *= unit[0] ** sign
+            for i, power in enumerate(unit[1]):
+                dimension[i] += sign * power
+            last = (unit[0], unit[1], sign)
+            found = True
+        position = match.end()
+        if found:
+            end = position
+    if not found:
+        return 1.0, None, 0
+    return scale, tuple(dimension), end
+
+
+class Quantity:
+    def __init__(self, value: float, scale: float, dimension):
+        self.value = value # as written
+        self.si = value * scale
+        self.dimension = dimension # None without a known unit
+
+    def __repr__(self):
+        return f"Quantity({self.value}, si={self.si}, dimension={self.dimension})"
+
+
+def difference(a: float, b: float):
+    scale = max(abs(a), abs(b))
+    return 0.0 if scale == 0 else abs(a - b) / scale
+
+def quantities(statement: str):
+    """The numbers in one answer statement, with their units."""
+    text = normalize(statement)[:MAX_STATEMENT]
+    if "=" in text:
+        text = text[text.rindex("=") + 1:]
+    found, position = [], 0
+    while True:
+        start = NUMBER_START.search(text, position)
+        if not start:
+            return found
+        # Variable names such as v2 or x_1 are not numbers
+        if start.start() > 0 and (text[start.start() - 1].isalpha() or text[start.start() - 1] == "_"):
+            position = start.end()
+            continue
+        span = EXPRESSION.match(text, start.start())
+        end = span.end() if span else start.end()
+        while end > start.start():
+            value = evaluate(text[start.start():end])
+            if value is not None:
+                break
+            end -= 1
+        if end == start.start():
+            position = start.end()
+            continue
+        scale, dimension, length = parse_unit(text[end:])
+        found.append(Quantity(value, scale, dimension))
+        position = end + length
+
+def statements(text: str):
+    """The (label, statement) pairs of an answer text. The statements on the line of a label share it."""
+    lines = LABEL.sub(lambda match: f"\n\0{(match.group(1) or match.group(2) or '').lower()}\0", strip_thinking(text)).split("\n")
+    found = []
+    for line in lines:
+        label = None
+        if line.startswith("\0"):
+            label, line = line[1:].split("\0", 1)
+        found += [(label or None, statement.strip()) for statement in SPLIT.split(line) if statement and statement.strip()]
+    return found
+
+class Answer:
+    """The numbers of one answer: a labelled answer, or a single statement of an unlabelled one."""
+
+    def __init__(self, label: str | None):
+        self.label = label
+        self.quantities = []
+        self.negated = False
+
+def answers_of(text: str):
+    found = []
+    for label, statement in statements(text):
+        if label is None or not found or found[-1].label != label:
+            found.append(Answer(label))
+        found[-1].quantities += quantities(statement)
+        found[-1].negated = found[-1].negated or bool(NEGATION.search(statement))
+    return [answer for answer in found if answer.quantities]
+
+def pair_answers(reference: list, given: list):
+    """Pairs every reference answer with one given answer, by label if every reference answer has
+    one that is given once, else by position if there are as many of each. Returns None otherwise."""
+    labels = [answer.label for answer in given]
+    if all(answer.label and labels.count(answer.label) == 1 for answer in reference):
+        return [(answer, given[labels.index(answer.label)]) for answer in reference]
+    if len(reference) == len(given):
+        return list(zip(reference, given))
+    return None
+
+def compare(expected: Quantity, given: Quantity):
+    """"match", "contradicted" or None for two values."""
+    if expected.dimension == given.dimension:
+        if difference(given.si, expected.si) <= MATCH_TOLERANCE:
+            return "match"
+        # Magnitudes, as a sign may only be a different choice of direction
+        if difference(abs(given.si), abs(expected.si)) >= MISMATCH_TOLERANCE:
+            return "contradicted"
+    elif None in (expected.dimension, given.dimension) and difference(given.value, expected.value) <= MATCH_TOLERANCE:
+        return "match"
+    return None
+
+def reference_text(answers):
+    if isinstance(answers, list):
+        return "\n".join(str(answer) for answer in answers)
+    return str(answers or "")
+
+def solution_answers(ai_solution: str):
+    """The final answers of a solution: its "Final answers" section, else its \\boxed{} values, else None."""
+    text = strip_thinking(ai_solution or "")
+    headings = list(FINAL_ANSWERS_HEADING.finditer(text))
+    if headings:
+        # The answer may follow the heading on the same line, as in "**Final Answer:** 5 m"
+        heading = re.sub(r"^.*?final\s+answers?\b[\s:*#]*", "", headings[-1].group(0), flags=re.IGNORECASE)
+        section = heading + text[headings[-1].end():]
+        if section.strip():
+            return section
+    boxed = []
+    for match in re.finditer(r"\\boxed\s*(?=\{)", text):
+        end = find_group(text, match.end())
+        if end > 0:
+            boxed.append(text[match.end() + 1:end - 1])
+    return "\n".join(boxed) if boxed else None
+
+def symbol_form(statement: str):
+    text = normalize(statement)
+    if "=" in text:
+        text = text[text.rindex("=") + 1:]
+    return re.sub(r"[\s*.\\(){}]", "", text).lower()
+
+def check_answers(ai_solution: str, final_answers_in_brief):
+    """Compares the final answers of a solution with the reference answers. Returns a dict with the
+    verdict ("match", "mismatch", "partial" or "unknown") and the counts it is based on."""
+    reference = answers_of(reference_text(final_answers_in_brief))
+    count = sum(len(answer.quantities) for answer in reference)
+    answers = solution_answers(ai_solution)
+    result = {"verdict": "unknown", "reference_values": count, "matched": 0, "contradicted": 0}
+    if answers is None:
+        result["reason"] = "no final answers"
+        return result
+    if not reference:
+        # A symbolic answer is only matched when it is written the same way
+        expected = [symbol_form(statement) for _, statement in statements(reference_text(final_answers_in_brief))]
+        given = {symbol_form(statement) for _, statement in statements(answers)}
+        if expected and all(form and form in given for form in expected):
+            result["verdict"] = "match"
+        else:
+            result["reason"] = "no numeric reference"
+        return result
+
+    pairs = pair_answers(reference, answers_of(answers))
+    if pairs is None:
+        result["reason"] = "answers do not pair up"
+        return result
+    for expected, given in pairs:
+        # The numbers of an answer are only compared one-to-one, e.g. not 7 m against a list of ten distances
+        if given.negated or len(given.quantities) != len(expected.quantities):
+            result.setdefault("reason", "an answer rules a value out" if given.negated else "numbers do not pair up")
+            continue
+        for outcome in map(compare, expected.quantities, given.quantities):
+            if outcome == "match":
+                result["matched"] += 1
+            elif outcome == "contradicted":
+                result["contradicted"] += 1
+    if result["matched"] == count:
+        result["verdict"] = "match"
+    elif result["contradicted"] == count:
+        result["verdict"] = "mismatch"
+    elif result["matched"]:
+        result["verdict"] = "partial"
+    return result
+
+
+if __name__ == "__main__":
+    # python answer_check.py "<reference answers>" "<solution text>"
+    print(check_answers(sys.argv[2], sys.argv[1]))
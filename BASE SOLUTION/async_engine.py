@@ -0,0 +1,40 @@
+import asyncio
+from jsonl_writer import open_writer
+
+
+async def solve_all(problems, solve, output_file, completed, concurrency, label="", ensure_ascii=True):
+    """Runs `solve` over every problem not in `completed`, keeping `concurrency` calls in flight.
+
+    `solve` is a coroutine that takes a problem and returns the record to append to
+    `output_file`, or None on failure. Returns the number of failed problems.
+    """
+    pending = iter([
+        (i, problem) for i, problem in enumerate(problems, start=1)
+        if problem['Problem_ID'] not in completed
+    ])
+    error_count = 0
+
+    async def worker():
+        nonlocal error_count
+        # Workers pull from a shared iterator, so at most `concurrency` requests are ever in flight
+        for i, problem in pending:
+            ID = problem['Problem_ID']
+            print(f"{label}Problem {i}/{len(problems)}")
+            try:
+                DATA = await solve(problem)
+            except Exception as e:
+                print(e)
+                DATA = None
+            if not DATA:
+                error_count += 1
+                print(f"{label}Failed:", ID)
+                continue
+            open_writer(output_file, ensure_ascii=ensure_ascii).write(DATA)
+
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    return error_count
+
+
+def run_async(problems, solve, output_file, completed, concurrency):
+    """Synchronous entry point for `solve_all`, used by the PROPOSER scripts."""
+    return asyncio.run(solve_all(problems, solve, output_file, completed, concurrency))
@@ -0,0 +1,107 @@
+import json
+import os
+import time
+import llm_calls
+from stages import sanitize_file_name
+
+# Batch mode for OpenAI compatible providers: requests are packed into a JSONL file, uploaded to
+# /files, submitted to /batches and polled until the provider has answered all of them.
+
+BATCH_DIR = "./BATCHES"
+BATCH_SIZE = 1000 # Requests per submitted batch
+POLL_INTERVAL = 30 # seconds
+ENDPOINT = "/v1/chat/completions"
+DONE_STATES = ("completed", "failed", "expired", "cancelled")
+
+
+def get_state_path(name: str):
+    return os.path.join(BATCH_DIR, f"{sanitize_file_name(os.path.basename(name))}.json")
+
+def load_state(name: str):
+    try:
+        with open(get_state_path(name), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return []
+
+def save_state(name: str, state: list):
+    os.makedirs(BATCH_DIR, exist_ok=True)
+    temp_path = get_state_path(name) + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=4)
+    os.replace(temp_path, get_state_path(name))
+
+def submit_batch(client, name: str, model: str, requests: dict):
+    """Uploads the requests as a batch input file and submits it. Returns the batch id."""
+    lines = [
+        json.dumps({"custom_id": ID, "method": "POST", "url": ENDPOINT, "body": {"model": model, "messages": messages}}, ensure_ascii=False)
+        for ID, messages in requests.items()
+    ]
+    input_file = client.files.create(file=(f"{sanitize_file_name(os.path.basename(name))}", ("\n".join(lines) + "\n").encode('utf-8')), purpose="batch")
+    batch = client.batches.create(input_file_id=input_file.id, endpoint=ENDPOINT, completion_window="24h")
+    print(f"Submitted batch {batch.id} with {len(requests)} requests")
+    return batch.id
+
+def read_results(client, batch):
+    """Returns {custom_id: content or None} for a finished batch."""
+    results = {}
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if not file_id:
+            continue
+        for line in client.files.content(file_id).text.splitlines():
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            try:
+                results[result['custom_id']] = result['response']['body']['choices'][0]['message']['content']
+            except (KeyError, IndexError, TypeError):
+                print("Batch request failed:", result['custom_id'], result.get('error') or result.get('response'))
+                results.setdefault(result['custom_id'], None)
+    return results
+
+def run_batch(client, model: str, requests: dict, name: str, batch_size: int = BATCH_SIZE, poll_interval: float = POLL_INTERVAL):
+    """Yields (custom_id, content or None) for every request in `requests` ({custom_id: messages}).
+
+    Cached responses are yielded first. The rest are submitted in batches of `batch_size`, and the
+    submitted batch ids are saved under BATCH_DIR, so a restarted run keeps polling the same
+    batches instead of submitting them again. A batch is forgotten once its results are yielded.
+    """
+    backend = f"openai:{client.base_url}"
+    keys = {}
+    uncached = {}
+    for ID, messages in requests.items():
+        keys[ID] = llm_calls.CACHE.key(backend, model, messages, params={})
+        content = llm_calls.CACHE.get(keys[ID])
+        if content is not None:
+            yield ID, content
+        else:
+            uncached[ID] = messages
+
+    state = load_state(name)
+    submitted = {ID for batch in state for ID in batch['custom_ids']}
+    unsubmitted = [ID for ID in uncached if ID not in submitted]
+    for i in range(0, len(unsubmitted), batch_size):
+        chunk = {ID: uncached[ID] for ID in unsubmitted[i:i + batch_size]}
+        state.append({"id": submit_batch(client, name, model, chunk), "custom_ids": list(chunk)})
+        save_state(name, state)
+
+    while state:
+        for entry in list(state):
+            batch = client.batches.retrieve(entry['id'])
+            if batch.status not in DONE_STATES:
+                counts = batch.request_counts
+                progress = f" ({counts.completed}/{counts.total})" if counts else ""
+                print(f"Batch {batch.id}: {batch.status}{progress}")
+                continue
+            print(f"Batch {batch.id}: {batch.status}")
+            results = read_results(client, batch)
+            for ID in entry['custom_ids']:
+                content = results.get(ID)
+                if content and ID in uncached:
+                    llm_calls.CACHE.put(keys[ID], backend, model, content)
+                if ID in requests:
+                    yield ID, content
+            state.remove(entry)
+            save_state(name, state)
+        if state:
+            time.sleep(poll_interval)
@@ -0,0 +1,215 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from mock_servers import start_mock_server
+
+# Offline throughput benchmark. Runs the pipeline scripts against mock_servers.py on a synthetic
+# dataset and reports, for every stage, problems/sec, call latency percentiles and the time the
+# orchestration code adds on top of the model calls:
+#   python benchmark.py --problems 200 --concurrency 8 --latency-median 0.3 --error-rate 0.02
+#   python benchmark.py --compare benchmark_report.json        (shows the change against an earlier report)
+#   python benchmark.py --stages propose review --review-pack 4 --token-latency 0.002   (packed reviews)
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+EVALUATIONS_DIR = os.path.join(os.path.dirname(SCRIPT_DIR), "EVALUATIONS")
+MODEL = "mock-proposer"
+REVIEWERS = ["mock-reviewer-a", "mock-reviewer-b"]
+META_REVIEWER = "mock-meta-reviewer"
+API_KEY_COUNT = 4
+STAGES = [
+    ("propose", "PROPOSER.py"),
+    ("self_refine", "PROPOSER_AFTER_SELF_REFINEMENT.py"),
+    ("single_agent_review", "SINGLE_AGENT_REVIEWER.py"),
+    ("single_agent_refine", "PROPOSER_WITH_SINGLE_AGENT_REVIEW.py"),
+    ("review", "REVIEWERS.py"),
+    ("meta_review", "META_REVIEWER.py"),
+    ("multi_agent_refine", "PROPOSER_WITH_MULTI_AGENT_REVIEW.py"),
+]
+
+
+def make_problems(count: int):
+    return [
+        {
+            "Problem_ID": f"BENCH-{i:05d}",
+            "problem": f"A block of mass {i % 7 + 1} kg slides down a frictionless incline of {10 + i % 60} degrees. Find its acceleration.",
+            "elaborated_solution_steps": "Step 1: Resolve gravity along the incline.\nStep 2: a = g sin(theta).",
+            "category": ["Mechanics", "Optics", "Thermodynamics"][i % 3],
+            "problem_difficulty": i % 10 + 1,
+            "steps": i % 5 + 1,
+            # The mock proposer always answers 42 m/s, so the final answer check sees matches, mismatches and symbolic answers
+            "final_answers_in_brief": ["a = g sin(theta)", "v = 10 m/s", "v = 42 m/s", "v = 42.0 m/s"][i % 4],
+        }
+        for i in range(count)
+    ]
+
+def percentile(values: list, q: float):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+def summarize(name: str, calls: list, wall: float, started: float, problems: int, concurrency: int):
+    ok = [call for call in calls if call["status"] == 200]
+    latencies = [call["end"] - call["start"] for call in calls]
+    # The stage can not finish faster than its model calls spread over its concurrency; the rest is overhead
+    ideal = sum(latencies) / max(1, concurrency)
+    return {
+        "stage": name,
+        "problems": problems,
+        "wall_s": round(wall, 3),
+        "problems_per_s": round(problems / wall, 3) if wall else 0,
+        "calls": len(calls),
+        "errors": sum(1 for call in calls if call["status"] == 500),
+        "rate_limited": sum(1 for call in calls if call["status"] == 429),
+        "connections": len({call["connection"] for call in calls}),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "tokens": sum(call["tokens"] for call in ok),
+        "startup_s": round(min(call["start"] for call in calls) - started, 3) if calls else round(wall, 3),
+        "overhead_s": round(max(0.0, wall - ideal), 3),
+    }
+
+def run_stage(server, name: str, command: list, cwd: str, env: dict, problems: int, concurrency: int, verbose: bool):
+    server.reset()
+    started = time.monotonic()
+    result = subprocess.run(command, cwd=cwd, env=env, stdout=None if verbose else subprocess.DEVNULL,
+                            stderr=None if verbose else subprocess.PIPE, text=True)
+    wall = time.monotonic() - started
+    if result.returncode != 0:
+        print(f"{name} exited with {result.returncode}")
+        if result.stderr:
+            print(result.stderr[-2000:])
+    return summarize(name, server.reset(), wall, started, problems, concurrency)
+
+def write_env(directory: str, port: int, args):
+    settings = {
+        "API_KEY": "mock-key",
+        "BASE_URL": f"http://127.0.0.1:{port}/v1",
+        "MODEL": MODEL,
+        "REVIEWERS": " ".join(REVIEWERS),
+        "META_REVIEWER": META_REVIEWER,
+        "CONCURRENCY": args.concurrency,
+        "REVIEW_CONCURRENCY": args.review_concurrency,
+        "REVIEW_PACK": args.review_pack,
+        "MERGE_MISTAKES": "true" if args.merge_mistakes else "false",
+        "META_REVIEW_CONCURRENCY": args.review_concurrency,
+        "PARALLEL_REVIEWERS": "true",
+        "MAX_LOADED_MODELS": len(REVIEWERS) + 1,
+        "MODEL_MAX_WAIT": 0.5,
+        "LLM_CACHE": "bypass",
+        "STREAM": "true" if args.stream else "false",
+    }
+    with open(os.path.join(directory, ".env"), "w", encoding="utf-8") as f:
+        f.write("".join(f"{key}={value}\n" for key, value in settings.items()))
+
+def prepare(directory: str, port: int, args):
+    os.makedirs(directory)
+    write_env(directory, port, args)
+    with open(os.path.join(directory, "test set.json"), "w", encoding="utf-8") as f:
+        json.dump(make_problems(args.problems), f, indent=4)
+
+def run_benchmark(args):
+    server = start_mock_server(
+        latency_median=args.latency_median, latency_sigma=args.latency_sigma,
+        error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate,
+        prompt_token_latency=args.prompt_token_latency, token_latency=args.token_latency,
+    )
+    port = server.server_address[1]
+    env = {**os.environ, "OLLAMA_HOST": f"http://127.0.0.1:{port}", "PYTHONUNBUFFERED": "1"}
+    root = tempfile.mkdtemp(prefix="physicseval-bench-")
+    results = []
+    try:
+        scripts_dir = os.path.join(root, "scripts")
+        prepare(scripts_dir, port, args)
+        for name, script in STAGES:
+            if name not in args.stages:
+                continue
+            problems = args.problems * (len(REVIEWERS) if name == "review" else 1)
+            concurrency = args.review_concurrency * (len(REVIEWERS) if name == "review" else 1) if "review" in name else args.concurrency
+            if name in ("single_agent_review", "meta_review"):
+                concurrency = 1
+            results.append(run_stage(server, name, [sys.executable, os.path.join(SCRIPT_DIR, script)], scripts_dir, env,
+                                     problems, concurrency, args.verbose))
+
+        if "evaluate" in args.stages:
+            eval_dir = os.path.join(root, "evaluations")
+            os.makedirs(eval_dir)
+            solutions = os.path.join(scripts_dir, "SOLUTIONS")
+            files = sorted(os.listdir(solutions)) if os.path.isdir(solutions) else []
+            for file_name in files:
+                if file_name.endswith(".jsonl"):
+                    shutil.copy(os.path.join(solutions, file_name), eval_dir)
+            with open(os.path.join(eval_dir, "api_keys.txt"), "w") as f:
+                f.write("".join(f"mock-api-key-{i:04d}\n" for i in range(API_KEY_COUNT)))
+            evaluated = args.problems * sum(1 for file_name in files if file_name.endswith(".jsonl"))
+            command = [sys.executable, os.path.join(EVALUATIONS_DIR, "eval_ollama.py"),
+                       "--cache", "bypass", "--base-url", f"http://127.0.0.1:{port}/v1beta", "--prescreen", args.prescreen]
+            results.append(run_stage(server, "evaluate", command, eval_dir, env, evaluated, API_KEY_COUNT * 2, args.verbose))
+
+        if "pipeline" in args.stages:
+            pipeline_dir = os.path.join(root, "pipeline")
+            prepare(pipeline_dir, port, args)
+            results.append(run_stage(server, "pipeline", [sys.executable, os.path.join(SCRIPT_DIR, "PIPELINE.py")], pipeline_dir,
+                                     env, args.problems, args.concurrency, args.verbose))
+    finally:
+        server.shutdown()
+        if args.keep:
+            print("Benchmark files kept in", root)
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+    return results
+
+def print_report(results: list, baseline: dict | None = None):
+    columns = ["stage", "problems", "wall_s", "problems_per_s", "calls", "connections", "errors", "rate_limited", "p50_ms", "p99_ms", "startup_s", "overhead_s"]
+    print(" ".join(f"{column:>14}" for column in columns) + (f" {'vs baseline':>12}" if baseline else ""))
+    for result in results:
+        line = " ".join(f"{result[column]:>14}" for column in columns)
+        if baseline and result["stage"] in baseline and baseline[result["stage"]]["problems_per_s"]:
+            change = result["problems_per_s"] / baseline[result["stage"]]["problems_per_s"] - 1
+            line += f" {change:>+12.1%}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline scripts against local mock servers.")
+    parser.add_argument("--problems", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=8, help="CONCURRENCY for the PROPOSER scripts")
+    parser.add_argument("--review-concurrency", type=int, default=4, help="REVIEW_CONCURRENCY for each reviewer")
+    parser.add_argument("--review-pack", type=int, default=1, help="REVIEW_PACK, problems per review request")
+    parser.add_argument("--latency-median", type=float, default=0.2, help="Median seconds per mock call")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="Spread of the log-normal latency")
+    parser.add_argument("--error-rate", type=float, default=0, help="Fraction of calls failed with a 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0, help="Fraction of calls failed with a 429")
+    parser.add_argument("--prompt-token-latency", type=float, default=0, help="Extra seconds per prompt token of a mock call")
+    parser.add_argument("--token-latency", type=float, default=0, help="Extra seconds per completion token of a mock call")
+    parser.add_argument("--stream", action="store_true", help="Run the scripts in streaming mode")
+    parser.add_argument("--merge-mistakes", action="store_true", help="Run the META_REVIEWER with MERGE_MISTAKES=true")
+    parser.add_argument("--prescreen", default="record", help="--prescreen mode of eval_ollama.py")
+    parser.add_argument("--stages", nargs="+", default=[name for name, _ in STAGES] + ["evaluate", "pipeline"],
+                        help="Stages to run, in order: " + ", ".join([name for name, _ in STAGES] + ["evaluate", "pipeline"]))
+    parser.add_argument("--output", default="benchmark_report.json", help="Where to save the report")
+    parser.add_argument("--compare", help="An earlier report to compare problems/sec against")
+    parser.add_argument("--keep", action="store_true", help="Keep the generated files")
+    parser.add_argument("--verbose", action="store_true", help="Show the output of the scripts")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = {result["stage"]: result for result in json.load(f)["results"]}
+
+    results = run_benchmark(args)
+    print_report(results, baseline)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"settings": {key: value for key, value in vars(args).items() if key not in ("compare", "output")},
+                   "results": results}, f, indent=4)
+    print("Report saved to", args.output)
+
+
+if __name__ == "__main__":
+    main()
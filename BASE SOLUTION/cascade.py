@@ -0,0 +1,61 @@
+import re
+
+# Cascaded review for the multi-agent path. The models in REVIEWERS review one after another,
+# cheapest first, and a problem only goes to the next reviewer while the reviews so far do not
+# accept its solution. Once they do, the META_REVIEWER is skipped as well and the problem gets an
+# empty list of mistakes. Problems that no prefix of the reviewers accepts are reviewed by all of
+# them and then by the META_REVIEWER, as without the cascade.
+
+ACCEPT_SCORE = 9.0 # mean final_score from which the reviews accept a solution
+MAX_SPREAD = 1.0 # largest difference between the final_scores of reviewers that agree
+MISTAKE_FIELDS = ("calculation_mistakes", "formula_mistakes", "logical_mistakes", "incomplete_requirements",
+                  "mistaken_assumptions", "incoherent_statements")
+# Entries that small models put into a mistake list when there is nothing to report
+NO_MISTAKE = re.compile(r"^\W*(?:none|n/?a|nil|no(?:ne| mistakes?| errors?| issues?)?(?: found| identified)?)?\W*$", re.IGNORECASE)
+
+
+def review_mistakes(review: dict):
+    """The mistakes listed in a review of the REVIEWERS."""
+    return [mistake for field in MISTAKE_FIELDS for mistake in review.get(field) or [] if not NO_MISTAKE.match(str(mistake))]
+
+
+class Cascade:
+    def __init__(self, enabled: bool = False, accept_score: float = ACCEPT_SCORE, max_spread: float = MAX_SPREAD):
+        self.enabled = enabled
+        self.accept_score = accept_score
+        self.max_spread = max_spread
+
+    def accepts(self, reviews: list):
+        """True if the reviews agree on a high score and list no mistakes."""
+        if not reviews:
+            return False
+        scores = [review['final_score'] for review in reviews]
+        return (
+            sum(scores) / len(scores) >= self.accept_score
+            and max(scores) - min(scores) <= self.max_spread
+            and not any(review_mistakes(review) for review in reviews)
+        )
+
+    def accepted_after(self, reviews: list):
+        """The number of reviews, in REVIEWERS order, after which the cascade accepted the solution, or 0.
+
+        A missing review (None) ends the reviews that are looked at: the reviewers after it have
+        not seen the problem yet, or skipped it because the ones before accepted it.
+        """
+        if not self.enabled:
+            return 0
+        if None in reviews:
+            reviews = reviews[:reviews.index(None)]
+        for count in range(1, len(reviews) + 1):
+            if self.accepts(reviews[:count]):
+                return count
+        return 0
+
+
+def open_cascade(config: dict):
+    """Creates the cascade from the CASCADE, CASCADE_ACCEPT_SCORE and CASCADE_MAX_SPREAD keys of a .env config."""
+    return Cascade(
+        enabled=(config.get('CASCADE') or "").lower() in ("1", "true", "yes"),
+        accept_score=float(config.get('CASCADE_ACCEPT_SCORE') or ACCEPT_SCORE),
+        max_spread=float(config.get('CASCADE_MAX_SPREAD') or MAX_SPREAD),
+    )
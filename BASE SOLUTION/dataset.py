@@ -0,0 +1,319 @@
+import json
+import mmap
+import os
+import shutil
+import sys
+from array import array
+from collections.abc import Mapping, Sequence
+from jsonl_writer import locked
+
+# Columnar copy of a dataset or solution file, stored next to it as "<file>.cols":
+#   meta.json        record count, field -> column number, and the size and mtime of the source it was built from
+#   <n>.bin          the JSON encoded values of one field, back to back
+#   <n>.off          count + 1 offsets (uint64) into <n>.bin. An empty slice means the record lacks the field
+# The columns are memory-mapped, so opening a dataset costs almost nothing and a field is only
+# decoded when it is read. Several processes may share the columns: updates and opening them for
+# reading hold an exclusive lock on "<file>.cols.lock", so a reader never sees a half-written update.
+
+COLUMNS_SUFFIX = ".cols"
+LOCK_SUFFIX = ".lock"
+OFFSET_TYPE = "Q"
+TAIL_SIZE = 64
+
+
+def scan_records(data: bytes):
+    """Yields (offset, length, record) for every problem in a JSON array or JSON Lines file, with byte offsets."""
+    text = data.decode('utf-8')
+    decoder = json.JSONDecoder()
+
+    def skip(position, characters):
+        while position < len(text) and text[position] in characters:
+            position += 1
+        return position
+
+    start = skip(0, " \t\r\n")
+    is_array = text[start:start + 1] == "["
+    position = start + 1 if is_array else start
+    byte_position = len(text[:position].encode('utf-8'))
+    while True:
+        end = skip(position, " \t\r\n,")
+        byte_position += len(text[position:end].encode('utf-8'))
+        position = end
+        if position >= len(text) or text[position] == "]":
+            return
+        record, end = decoder.raw_decode(text, position)
+        length = len(text[position:end].encode('utf-8'))
+        yield byte_position, length, record
+        byte_position += length
+        position = end
+
+def get_columns_path(source: str):
+    return source + COLUMNS_SUFFIX
+
+def columns_lock(directory: str):
+    return locked(directory + LOCK_SUFFIX)
+
+def remove_columns(source: str):
+    """Deletes the columns of `source` and their lock file, e.g. after the source was deleted."""
+    directory = get_columns_path(source)
+    shutil.rmtree(directory, ignore_errors=True)
+    if os.path.exists(directory + LOCK_SUFFIX):
+        os.remove(directory + LOCK_SUFFIX)
+
+
+class ColumnWriter:
+    """Appends records to the columns in `directory`, starting from the state described by `meta`."""
+
+    def __init__(self, directory: str, meta: dict):
+        self.directory = directory
+        self.meta = meta
+        self.files = {}
+        self.offsets = {}
+        for field, column in meta["fields"].items():
+            # Drop anything a crashed append wrote after the last committed record
+            offsets = array(OFFSET_TYPE)
+            with open(self._path(column, ".off"), "rb") as f:
+                offsets.fromfile(f, meta["count"] + 1)
+            with open(self._path(column, ".off"), "r+b") as f:
+                f.truncate((meta["count"] + 1) * offsets.itemsize)
+            self.files[field] = open(self._path(column, ".bin"), "r+b")
+            self.files[field].truncate(offsets[-1])
+            self.files[field].seek(offsets[-1])
+            self.offsets[field] = array(OFFSET_TYPE)
+
+    def _path(self, column: int, extension: str):
+        return os.path.join(self.directory, f"{column}{extension}")
+
+    def _add_field(self, field: str):
+        column = len(self.meta["fields"])
+        self.meta["fields"][field] = column
+        # Earlier records do not have the field
+        with open(self._path(column, ".off"), "wb") as f:
+            array(OFFSET_TYPE, [0] * (self.meta["count"] + 1)).tofile(f)
+        self.files[field] = open(self._path(column, ".bin"), "w+b")
+        self.offsets[field] = array(OFFSET_TYPE)
+
+    def append(self, record: dict):
+        for field in record:
+            if field not in self.files:
+                self._add_field(field)
+        for field, f in self.files.items():
+            if field in record:
+                f.write(json.dumps(record[field], ensure_ascii=False).encode('utf-8'))
+            self.offsets[field].append(f.tell())
+        self.meta["count"] += 1
+
+    def commit(self, source: str, source_size: int):
+        for field, f in self.files.items():
+            f.close()
+            with open(self._path(self.meta["fields"][field], ".off"), "ab") as off:
+                self.offsets[field].tofile(off)
+        self.meta["source_size"] = source_size
+        self.meta["source_tail"] = read_tail(source, source_size)
+        self.meta["source_mtime"] = os.stat(source).st_mtime_ns
+        temp_path = os.path.join(self.directory, "meta.json.tmp")
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self.meta, f, ensure_ascii=False)
+        os.replace(temp_path, os.path.join(self.directory, "meta.json"))
+
+
+def append_line(writer: ColumnWriter, line: bytes):
+    # Lines that are not a JSON object are skipped, like a torn or corrupted write
+    try:
+        record = json.loads(line)
+    except json.JSONDecodeError:
+        return
+    if isinstance(record, dict):
+        writer.append(record)
+
+def read_tail(source: str, size: int):
+    with open(source, "rb") as f:
+        f.seek(max(0, size - TAIL_SIZE))
+        return f.read(min(size, TAIL_SIZE)).hex()
+
+def convert(source: str, directory: str | None = None):
+    """Converts a JSON array or JSON Lines file to columns. Returns the columns directory."""
+    directory = directory or get_columns_path(source)
+    with columns_lock(directory):
+        return _convert(source, directory)
+
+def _convert(source: str, directory: str):
+    temp_directory = f"{directory}.{os.getpid()}.tmp"
+    shutil.rmtree(temp_directory, ignore_errors=True)
+    os.makedirs(temp_directory)
+    writer = ColumnWriter(temp_directory, {"count": 0, "fields": {}})
+    with open(source, "rb") as f:
+        data = f.read()
+    if source.endswith(".jsonl"):
+        # Only complete lines are converted, the rest is picked up by the next append
+        size = data.rfind(b"\n") + 1
+        for line in data[:size].splitlines():
+            append_line(writer, line)
+    else:
+        size = len(data)
+        for _, _, record in scan_records(data):
+            writer.append(record)
+    writer.commit(source, size)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(temp_directory, directory)
+    return directory
+
+def update(source: str, directory: str | None = None):
+    """Brings the columns of `source` up to date, converting only the new lines of a JSON Lines file."""
+    directory = directory or get_columns_path(source)
+    with columns_lock(directory):
+        return _update(source, directory)
+
+def _update(source: str, directory: str):
+    try:
+        with open(os.path.join(directory, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return _convert(source, directory)
+    stat = os.stat(source)
+    if stat.st_mtime_ns == meta["source_mtime"] and stat.st_size == meta["source_size"]:
+        return directory
+    # Appending is only safe if the part that was already converted has not changed
+    if not source.endswith(".jsonl") or stat.st_size < meta["source_size"] or read_tail(source, meta["source_size"]) != meta["source_tail"]:
+        return _convert(source, directory)
+    writer = ColumnWriter(directory, meta)
+    with open(source, "rb") as f:
+        f.seek(meta["source_size"])
+        consumed = meta["source_size"]
+        for line in iter(f.readline, b""):
+            if not line.endswith(b"\n"):
+                break
+            consumed += len(line)
+            append_line(writer, line)
+    writer.commit(source, consumed)
+    return directory
+
+
+class RecordView(Mapping):
+    """Read-only view of one record. Each field is decoded from its column when it is accessed."""
+
+    __slots__ = ("dataset", "index")
+
+    def __init__(self, dataset, index: int):
+        self.dataset = dataset
+        self.index = index
+
+    def __getitem__(self, field: str):
+        raw = self.dataset.raw(self.index, field)
+        if not raw:
+            raise KeyError(field)
+        return json.loads(raw)
+
+    def __contains__(self, field):
+        return bool(self.dataset.raw(self.index, field))
+
+    def __iter__(self):
+        return (field for field in self.dataset.fields if field in self)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"RecordView({self.dataset.directory!r}, {self.index})"
+
+
+class Dataset(Sequence):
+    """Memory-mapped columns written by `convert`. Indexing returns a `RecordView`.
+
+    All columns are mapped when the dataset is opened, under the columns lock. A later update only
+    appends past the mapped records, and a later conversion replaces the files, so the mapped
+    records stay valid.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.maps = []
+        self.values = {}
+        self.offsets = {}
+        self.ids = None
+        with columns_lock(directory):
+            with open(os.path.join(directory, "meta.json"), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            self.count = meta["count"]
+            self.columns = meta["fields"]
+            self.fields = list(self.columns)
+            for field in self.fields:
+                self._column(field)
+
+    def _map(self, path: str):
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b""
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.maps.append(mapped)
+        return mapped
+
+    def _column(self, field: str):
+        if field not in self.values:
+            column = self.columns[field]
+            self.values[field] = self._map(os.path.join(self.directory, f"{column}.bin"))
+            offsets = self._map(os.path.join(self.directory, f"{column}.off"))
+            self.offsets[field] = memoryview(offsets).cast(OFFSET_TYPE) if offsets else array(OFFSET_TYPE)
+        return self.values[field], self.offsets[field]
+
+    def raw(self, index: int, field: str):
+        """Returns the JSON encoded value of a field, or b"" if the record does not have it."""
+        if field not in self.columns:
+            return b""
+        values, offsets = self._column(field)
+        return values[offsets[index]:offsets[index + 1]]
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.count))]
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        return RecordView(self, index)
+
+    def column(self, field: str):
+        """Yields the decoded value of a field for every record, None where it is missing."""
+        for index in range(self.count):
+            raw = self.raw(index, field)
+            yield json.loads(raw) if raw else None
+
+    def find(self, problem_id: str):
+        """Returns the record with the given Problem_ID, or None."""
+        if self.ids is None:
+            self.ids = {ID: index for index, ID in enumerate(self.column('Problem_ID'))}
+        index = self.ids.get(problem_id)
+        return None if index is None else RecordView(self, index)
+
+    def close(self):
+        for offsets in self.offsets.values():
+            if isinstance(offsets, memoryview):
+                offsets.release()
+        for mapped in self.maps:
+            mapped.close()
+        self.maps = []
+        self.values = {}
+        self.offsets = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def open_dataset(source: str):
+    """Opens a JSON array or JSON Lines file through its columns, converting it first if it changed."""
+    return Dataset(update(source))
+
+
+if __name__ == "__main__":
+    # python dataset.py [convert|info] <file>...
+    command = sys.argv[1] if len(sys.argv) > 1 else "info"
+    for source in sys.argv[2:]:
+        directory = convert(source) if command == "convert" else update(source)
+        with Dataset(directory) as dataset:
+            print(f"{source}: {len(dataset)} records, fields: {', '.join(dataset.fields)}")
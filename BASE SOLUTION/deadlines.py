@@ -0,0 +1,138 @@
+import asyncio
+from dataset import open_dataset
+
+# Per-request deadlines and hedging for llm_calls. Once a model has MIN_SAMPLES recorded calls in
+# the metrics, a request gets a deadline of DEADLINE_MULTIPLIER times the model's p95 latency,
+# scaled by the problem's difficulty and number of steps, instead of the script's fixed
+# MAX_TIME_LIMIT (which stays the upper bound). With hedging, a request that is still running
+# after the scaled HEDGE_PERCENTILE latency gets a duplicate to the same model on a secondary
+# backend, and the first response wins.
+
+MIN_SAMPLES = 20 # Recorded calls of a model before its percentiles are trusted
+DEADLINE_PERCENTILE = 0.95
+DEADLINE_MULTIPLIER = 3
+MIN_TIME_LIMIT = 30 # seconds
+HEDGE_PERCENTILE = 0.95
+TYPICAL_DIFFICULTY = 5
+TYPICAL_STEPS = 5
+PROBLEMS_FILE = "test set.json" # Looked up for the difficulty and steps of records that do not have them
+
+
+def scale(value, typical: float):
+    """1 for a typical value, between 0.5 and 2 otherwise."""
+    try:
+        return min(2.0, max(0.5, 0.5 + float(value) / (2 * typical)))
+    except (TypeError, ValueError):
+        return 1.0
+
+
+class Deadlines:
+    """Deadlines and hedge delays derived from the latency percentiles in `metrics`."""
+
+    def __init__(self, metrics, adaptive: bool = False, multiplier: float = DEADLINE_MULTIPLIER, min_timeout: float = MIN_TIME_LIMIT,
+                 hedge_percentile: float | None = None, hedge_openai=None, hedge_ollama=None):
+        self.metrics = metrics
+        self.adaptive = adaptive
+        self.multiplier = multiplier
+        self.min_timeout = min_timeout
+        self.hedge_percentile = hedge_percentile
+        # Secondary OpenAI compatible client and secondary Ollama `chat`, which serve the same models
+        self.hedge_openai = hedge_openai
+        self.hedge_ollama = hedge_ollama
+        self.problems = None
+
+    def complexity(self, problem: dict | None):
+        """How much longer than a typical problem this one is expected to take."""
+        if not problem:
+            return 1.0
+        if 'problem_difficulty' not in problem and 'Problem_ID' in problem:
+            if self.problems is None:
+                try:
+                    self.problems = open_dataset(PROBLEMS_FILE)
+                except (FileNotFoundError, ValueError):
+                    self.problems = []
+            found = self.problems.find(problem['Problem_ID']) if self.problems else None
+            problem = found if found is not None else problem
+        return scale(problem.get('problem_difficulty'), TYPICAL_DIFFICULTY) * scale(problem.get('steps'), TYPICAL_STEPS)
+
+    def timeout(self, backend: str, model: str, problem: dict | None, limit: float | None):
+        """The deadline of one request, never more than `limit`."""
+        if not self.adaptive:
+            return limit
+        latency = self.metrics.quantile(backend, model, DEADLINE_PERCENTILE, MIN_SAMPLES)
+        if latency is None:
+            return limit
+        deadline = max(self.min_timeout, latency * self.multiplier * self.complexity(problem))
+        return min(limit, deadline) if limit else deadline
+
+    def hedge_delay(self, backend: str, model: str, problem: dict | None):
+        """Seconds after which a request is duplicated, or None if it should not be hedged."""
+        if self.hedge_percentile is None:
+            return None
+        latency = self.metrics.quantile(backend, model, self.hedge_percentile, MIN_SAMPLES)
+        return None if latency is None else latency * self.complexity(problem)
+
+
+async def hedge(call, backup, delay: float | None, on_hedge=None, dispatched=None):
+    """Awaits `call()`. If it is still running after `delay` seconds, also starts `backup()` and
+    returns whichever finishes first with a response, as (response, True if it came from the backup).
+    The other one is cancelled. With `dispatched`, an asyncio.Event, the delay only starts once the
+    event is set, i.e. once the call was sent."""
+    first = asyncio.ensure_future(call())
+    if delay is None or backup is None:
+        return await first, False
+    second = None
+    try:
+        if dispatched is not None:
+            sent = asyncio.ensure_future(dispatched.wait())
+            await asyncio.wait({first, sent}, return_when=asyncio.FIRST_COMPLETED)
+            sent.cancel()
+            if first.done():
+                return first.result(), False
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done:
+            return first.result(), False
+        if on_hedge:
+            on_hedge("sent")
+        second = asyncio.ensure_future(backup())
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None and task.result():
+                    if task is second and on_hedge:
+                        on_hedge("won")
+                    return task.result(), task is second
+                error = error or task.exception()
+        if error:
+            raise error
+        return first.result(), False
+    finally:
+        for task in (first, second):
+            if task is not None and not task.done():
+                task.cancel()
+
+
+def open_deadlines(config: dict, metrics):
+    """Creates the deadlines from the ADAPTIVE_TIMEOUT, TIMEOUT_MULTIPLIER, MIN_TIME_LIMIT and HEDGE* keys of a .env config."""
+    hedge_openai = hedge_ollama = None
+    hedging = (config.get('HEDGE') or "").lower() in ("1", "true", "yes")
+    if hedging and config.get('HEDGE_BASE_URL'):
+        from openai import AsyncOpenAI
+        hedge_openai = AsyncOpenAI(
+            base_url=config['HEDGE_BASE_URL'],
+            api_key=config.get('HEDGE_API_KEY') or config.get('API_KEY'),
+        )
+    if hedging and config.get('HEDGE_OLLAMA_HOST'):
+        from ollama import AsyncClient
+        hedge_ollama = AsyncClient(host=config['HEDGE_OLLAMA_HOST']).chat
+    return Deadlines(
+        metrics,
+        adaptive=(config.get('ADAPTIVE_TIMEOUT') or "").lower() in ("1", "true", "yes"),
+        multiplier=float(config.get('TIMEOUT_MULTIPLIER') or DEADLINE_MULTIPLIER),
+        min_timeout=float(config.get('MIN_TIME_LIMIT') or MIN_TIME_LIMIT),
+        hedge_percentile=float(config.get('HEDGE_PERCENTILE') or HEDGE_PERCENTILE) if hedging else None,
+        hedge_openai=hedge_openai,
+        hedge_ollama=hedge_ollama,
+    )
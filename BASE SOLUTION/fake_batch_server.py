@@ -0,0 +1,195 @@
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from email import policy
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-in for the OpenAI /files + /batches API and the Gemini batchGenerateContent API,
+# so the batch mode of PROPOSER.py and eval_ollama.py can be tried offline:
+#   python fake_batch_server.py --port 8000 --delay 5
+#   BASE_URL=http://127.0.0.1:8000/v1                            (PROPOSER.py)
+#   python eval_ollama.py --batch --base-url http://127.0.0.1:8000/v1beta    (EVALUATIONS)
+
+
+def fake_solution(messages: list):
+    problem = messages[-1]['content'] if messages else ""
+    return f"Fake solution for: {problem[:80]}\n\n## Final answers\n42 m/s\n\n## Check\nSubstituting the result back into the equations gives the same speed."
+
+def fake_evaluation(prompt: str):
+    """A judge response that passes eval_ollama's validation, with scores derived from the prompt."""
+    match = re.search(r"Problem ID: (\S+)", prompt)
+    problem_id = match.group(1) if match else "unknown"
+    rng = random.Random(hashlib.sha256(prompt.encode('utf-8')).hexdigest())
+    fields = ["mathematical_accuracy", "logical_consistency", "completeness", "clarity_and_coherence", "formulas_principles", "assumptions_made"]
+    evaluation = {"problem_id": problem_id, **{field: rng.randint(1, 5) for field in fields}, "overall_correctness": rng.randint(0, 10)}
+    return json.dumps(evaluation)
+
+
+class FakeBatchServer(ThreadingHTTPServer):
+    def __init__(self, address, delay: float = 2, fail_rate: float = 0):
+        super().__init__(address, FakeBatchHandler)
+        self.delay = delay
+        self.fail_rate = fail_rate
+        self.lock = threading.RLock()
+        self.files = {}
+        self.batches = {}
+        self.gemini_batches = {}
+        self.counter = 0
+
+    def next_id(self, prefix: str):
+        with self.lock:
+            self.counter += 1
+            return f"{prefix}{self.counter}"
+
+    def failed(self):
+        return random.random() < self.fail_rate
+
+    def store_file(self, content: bytes, filename: str, purpose: str):
+        file_id = self.next_id("file-")
+        self.files[file_id] = {
+            "id": file_id, "object": "file", "bytes": len(content), "created_at": int(time.time()),
+            "filename": filename, "purpose": purpose, "status": "processed", "content": content,
+        }
+        return self.files[file_id]
+
+    def openai_batch(self, batch_id: str):
+        batch = self.batches[batch_id]
+        if batch["status"] != "completed" and time.time() - batch["created_at"] >= self.delay:
+            outputs, errors = [], []
+            for line in self.files[batch["input_file_id"]]["content"].decode('utf-8').splitlines():
+                if not line.strip():
+                    continue
+                request = json.loads(line)
+                if self.failed():
+                    errors.append({"id": self.next_id("batch_req_"), "custom_id": request["custom_id"], "response": None,
+                                   "error": {"code": "server_error", "message": "Injected failure"}})
+                    continue
+                body = {
+                    "id": self.next_id("chatcmpl-"), "object": "chat.completion", "created": int(time.time()),
+                    "model": request["body"]["model"],
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": fake_solution(request["body"]["messages"])}}],
+                }
+                outputs.append({"id": self.next_id("batch_req_"), "custom_id": request["custom_id"],
+                                "response": {"status_code": 200, "body": body}, "error": None})
+            for key, records in (("output_file_id", outputs), ("error_file_id", errors)):
+                if records:
+                    content = "".join(json.dumps(record) + "\n" for record in records).encode('utf-8')
+                    batch[key] = self.store_file(content, f"{batch_id}_{key}.jsonl", "batch_output")["id"]
+            batch["status"] = "completed"
+            batch["completed_at"] = int(time.time())
+            batch["request_counts"] = {"total": len(outputs) + len(errors), "completed": len(outputs), "failed": len(errors)}
+        elif batch["status"] == "validating":
+            batch["status"] = "in_progress"
+        return batch
+
+    def gemini_batch(self, name: str):
+        batch = self.gemini_batches[name]
+        if not batch["done"] and time.time() - batch["created"] >= self.delay:
+            responses = []
+            for request in batch["requests"]:
+                metadata = request.get("metadata", {})
+                if self.failed():
+                    responses.append({"error": {"code": 500, "message": "Injected failure"}, "metadata": metadata})
+                    continue
+                prompt = "".join(part.get("text", "") for content in request["request"]["contents"] for part in content["parts"])
+                responses.append({
+                    "response": {"candidates": [{"content": {"role": "model", "parts": [{"text": fake_evaluation(prompt)}]}, "finishReason": "STOP"}]},
+                    "metadata": metadata,
+                })
+            batch["done"] = True
+            batch["metadata"]["state"] = "BATCH_STATE_SUCCEEDED"
+            batch["response"] = {"@type": "type.googleapis.com/google.ai.generativelanguage.v1main.GenerateContentBatchOutput",
+                                 "inlinedResponses": {"inlinedResponses": responses}}
+        elif not batch["done"]:
+            batch["metadata"]["state"] = "BATCH_STATE_RUNNING"
+        return {key: value for key, value in batch.items() if key not in ("requests", "created")}
+
+
+class FakeBatchHandler(BaseHTTPRequestHandler):
+    def send_json(self, data, status: int = 200):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def do_POST(self):
+        server = self.server
+        path = self.path.split("?")[0]
+        if path == "/v1/files":
+            message = BytesParser(policy=policy.default).parsebytes(
+                b"Content-Type: " + self.headers["Content-Type"].encode() + b"\r\n\r\n" + self.read_body()
+            )
+            fields = {part.get_param("name", header="content-disposition"): part for part in message.iter_parts()}
+            upload = fields["file"]
+            stored = server.store_file(upload.get_payload(decode=True), upload.get_filename(), fields["purpose"].get_content().strip())
+            return self.send_json({key: value for key, value in stored.items() if key != "content"})
+        if path == "/v1/batches":
+            request = json.loads(self.read_body())
+            if request.get("input_file_id") not in server.files:
+                return self.send_json({"error": {"message": "No such file"}}, 404)
+            batch_id = server.next_id("batch_")
+            server.batches[batch_id] = {
+                "id": batch_id, "object": "batch", "endpoint": request["endpoint"], "input_file_id": request["input_file_id"],
+                "completion_window": request["completion_window"], "status": "validating", "created_at": int(time.time()),
+                "output_file_id": None, "error_file_id": None, "request_counts": None,
+            }
+            return self.send_json(server.batches[batch_id])
+        match = re.fullmatch(r"/v1beta/models/([^/:]+):batchGenerateContent", path)
+        if match:
+            request = json.loads(self.read_body())["batch"]
+            name = server.next_id("batches/")
+            server.gemini_batches[name] = {
+                "name": name, "done": False, "created": time.time(),
+                "metadata": {"@type": "type.googleapis.com/google.ai.generativelanguage.v1main.GenerateContentBatch",
+                             "model": f"models/{match.group(1)}", "displayName": request.get("display_name", ""),
+                             "state": "BATCH_STATE_PENDING"},
+                "requests": request["input_config"]["requests"]["requests"],
+            }
+            return self.send_json(server.gemini_batch(name))
+        self.send_json({"error": {"message": f"Unknown path {path}"}}, 404)
+
+    def do_GET(self):
+        server = self.server
+        path = self.path.split("?")[0]
+        match = re.fullmatch(r"/v1/files/([^/]+)/content", path)
+        if match and match.group(1) in server.files:
+            content = server.files[match.group(1)]["content"]
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            return self.wfile.write(content)
+        match = re.fullmatch(r"/v1/batches/([^/]+)", path)
+        if match and match.group(1) in server.batches:
+            with server.lock:
+                return self.send_json(server.openai_batch(match.group(1)))
+        match = re.fullmatch(r"/v1beta/(batches/[^/]+)", path)
+        if match and match.group(1) in server.gemini_batches:
+            with server.lock:
+                return self.send_json(server.gemini_batch(match.group(1)))
+        self.send_json({"error": {"message": f"Unknown path {path}"}}, 404)
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake OpenAI and Gemini batch API for offline testing.")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--delay", type=float, default=2, help="Seconds until a submitted batch completes")
+    parser.add_argument("--fail-rate", type=float, default=0, help="Fraction of requests answered with an error")
+    args = parser.parse_args()
+    server = FakeBatchServer(("127.0.0.1", args.port), delay=args.delay, fail_rate=args.fail_rate)
+    print(f"Fake batch server on http://127.0.0.1:{args.port}")
+    server.serve_forever()
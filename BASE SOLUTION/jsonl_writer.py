@@ -0,0 +1,181 @@
+import atexit
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+    import msvcrt
+
+# Output layer for the .jsonl files of every stage. Records are buffered and appended in one write
+# per flush, under an exclusive lock on the file, so several processes can add to the same file
+# without interleaving their lines. A background thread flushes every FLUSH_INTERVAL seconds and the
+# file is fsynced every FSYNC_INTERVAL seconds, so a crash loses at most the last few records (which
+# the next run redoes, usually from the response cache). A torn last line left by a killed run is
+# cut off when the file is opened.
+
+FLUSH_INTERVAL = 1 # seconds a record may wait in the buffer
+FSYNC_INTERVAL = 5 # seconds
+MAX_BUFFER = 256 # records, flushed at once when reached
+
+
+def lock(fd: int):
+    if fcntl:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+
+def unlock(fd: int):
+    if fcntl:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+@contextmanager
+def locked(path: str):
+    """Holds an exclusive lock on the file `path`, created if missing, against other processes."""
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o644)
+    try:
+        lock(fd)
+        try:
+            yield
+        finally:
+            unlock(fd)
+    finally:
+        os.close(fd)
+
+def read_at(fd: int, offset: int, length: int):
+    if hasattr(os, "pread"):
+        return os.pread(fd, length, offset)
+    os.lseek(fd, offset, os.SEEK_SET)
+    return os.read(fd, length)
+
+def repair(fd: int, path: str):
+    """Cuts off a last line without a newline, left by a process that was killed while writing it."""
+    size = os.fstat(fd).st_size
+    if size == 0 or read_at(fd, size - 1, 1) == b"\n":
+        return
+    position = size
+    while position > 0:
+        start = max(0, position - 65536)
+        chunk = read_at(fd, start, position - start)
+        newline = chunk.rfind(b"\n")
+        if newline >= 0:
+            position = start + newline + 1
+            break
+        position = start
+    os.ftruncate(fd, position)
+    print(f"Removed a torn last line ({size - position} bytes) from {path}")
+
+
+class JsonlWriter:
+    """Appends records to one .jsonl file. Use `open_writer`, which shares a writer per file."""
+
+    def __init__(self, path: str, ensure_ascii: bool = True):
+        self.path = path
+        self.ensure_ascii = ensure_ascii
+        self.lock = threading.Lock()
+        self.buffer = []
+        self.last_fsync = time.monotonic()
+        self.fd = os.open(path, os.O_RDWR | os.O_APPEND | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o644)
+        lock(self.fd)
+        try:
+            repair(self.fd, path)
+        finally:
+            unlock(self.fd)
+
+    def write(self, record: dict):
+        line = (json.dumps(record, ensure_ascii=self.ensure_ascii) + '\n').encode('utf-8')
+        with self.lock:
+            self.buffer.append(line)
+            full = len(self.buffer) >= MAX_BUFFER
+        if full:
+            self.flush()
+
+    def flush(self, fsync: bool = False):
+        with self.lock:
+            if self.fd is None:
+                return
+            data, self.buffer = b"".join(self.buffer), []
+            if not data and not fsync:
+                return
+            lock(self.fd)
+            try:
+                # Another process may have been killed halfway through a line since the last flush
+                repair(self.fd, self.path)
+                view = memoryview(data)
+                while view:
+                    view = view[os.write(self.fd, view):]
+                if fsync or time.monotonic() - self.last_fsync >= FSYNC_INTERVAL:
+                    os.fsync(self.fd)
+                    self.last_fsync = time.monotonic()
+            finally:
+                unlock(self.fd)
+
+    def close(self):
+        self.flush(fsync=True)
+        with self.lock:
+            if self.fd is not None:
+                os.close(self.fd)
+                self.fd = None
+
+
+WRITERS = {}
+writers_lock = threading.Lock()
+flusher = None
+
+
+def _flush_all():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        with writers_lock:
+            writers = list(WRITERS.values())
+        for writer in writers:
+            try:
+                writer.flush()
+            except OSError as e:
+                print(f"Could not write to {writer.path}: {e}")
+
+def open_writer(path: str, ensure_ascii: bool = True):
+    """Returns the writer of `path`, opening it the first time. Raises ValueError if it is open with another `ensure_ascii`."""
+    global flusher
+    key = os.path.abspath(path)
+    with writers_lock:
+        writer = WRITERS.get(key)
+        if writer is None or writer.fd is None:
+            writer = WRITERS[key] = JsonlWriter(path, ensure_ascii)
+        elif writer.ensure_ascii != ensure_ascii:
+            raise ValueError(f"{path} is already open with ensure_ascii={writer.ensure_ascii}")
+        if flusher is None:
+            flusher = threading.Thread(target=_flush_all, daemon=True)
+            flusher.start()
+            atexit.register(close_all)
+    return writer
+
+def close_writer(path: str):
+    """Writes out and closes the writer of `path`, e.g. before the file is read back."""
+    with writers_lock:
+        writer = WRITERS.pop(os.path.abspath(path), None)
+    if writer:
+        writer.close()
+
+def close_all():
+    with writers_lock:
+        writers = list(WRITERS.values())
+        WRITERS.clear()
+    for writer in writers:
+        writer.close()
+
+def read_jsonl(path: str):
+    """Reads the records of a .jsonl file, skipping a torn last line."""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.endswith('\n'):
+                break
+            yield json.loads(line)
@@ -0,0 +1,153 @@
+import hashlib
+import json
+import sqlite3
+import sys
+import threading
+import time
+
+CACHE_FILE = "./llm_cache.db"
+CACHE_MODES = ("use", "refresh", "bypass")
+
+
+class LLMCache:
+    """On-disk cache of LLM responses, addressed by a hash of everything that affects the response.
+
+    Modes: "use" reads and writes the cache, "refresh" ignores cached responses but stores
+    new ones, and "bypass" neither reads nor writes. Entries older than `max_age_days` are
+    dropped, and the least recently used entries go once the cache grows past `max_mb`.
+    """
+
+    def __init__(self, path: str = CACHE_FILE, mode: str = "use", max_mb: float = 1024, max_age_days: float = 30):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown cache mode {mode!r}. Use one of {', '.join(CACHE_MODES)}.")
+        self.mode = mode
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.max_age = max_age_days * 24 * 60 * 60
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evicted = 0
+        self.lock = threading.Lock()
+        self.connection = None
+        if mode == "bypass":
+            return
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                backend TEXT NOT NULL,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self.connection.execute("CREATE INDEX IF NOT EXISTS responses_by_last_used ON responses (last_used)")
+        self.evict()
+
+    @staticmethod
+    def key(backend: str, model: str, messages: list, schema=None, params: dict | None = None):
+        request = {"backend": backend, "model": model, "messages": messages, "schema": schema, "params": params or {}}
+        return hashlib.sha256(json.dumps(request, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+    def get(self, key: str):
+        if self.mode != "use":
+            return None
+        with self.lock:
+            row = self.connection.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or time.time() - row[1] > self.max_age:
+                self.misses += 1
+                return None
+            with self.connection:
+                self.connection.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, backend: str, model: str, response: str):
+        if self.mode == "bypass":
+            return
+        now = time.time()
+        with self.lock:
+            with self.connection:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (key, backend, model, response, len(response.encode('utf-8')), now, now)
+                )
+            self.writes += 1
+        if self.writes % 1000 == 0:
+            self.evict()
+
+    def evict(self):
+        """Drops expired entries, then the least recently used ones until the cache fits in `max_mb`."""
+        if self.connection is None:
+            return 0
+        with self.lock, self.connection:
+            evicted = self.connection.execute(
+                "DELETE FROM responses WHERE created < ?", (time.time() - self.max_age,)
+            ).rowcount
+            total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total > self.max_bytes:
+                excess = total - self.max_bytes
+                keys = []
+                for key, size in self.connection.execute("SELECT key, size FROM responses ORDER BY last_used"):
+                    keys.append((key,))
+                    excess -= size
+                    if excess <= 0:
+                        break
+                self.connection.executemany("DELETE FROM responses WHERE key = ?", keys)
+                evicted += len(keys)
+        self.evicted += evicted
+        return evicted
+
+    def size(self):
+        if self.connection is None:
+            return 0, 0
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+
+    def stats(self):
+        entries, size = self.size()
+        return {
+            "mode": self.mode, "hits": self.hits, "misses": self.misses, "writes": self.writes,
+            "evicted": self.evicted, "entries": entries, "size_mb": round(size / 1024 / 1024, 2),
+        }
+
+    def summary(self):
+        stats = self.stats()
+        return (f"LLM cache ({stats['mode']}): {stats['hits']} hits, {stats['misses']} misses, "
+                f"{stats['writes']} writes, {stats['evicted']} evicted, {stats['entries']} entries ({stats['size_mb']} MB)")
+
+    def clear(self):
+        if self.connection is None:
+            return
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM responses")
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+def open_cache(config: dict):
+    """Creates the cache from the LLM_CACHE, LLM_CACHE_MAX_MB and LLM_CACHE_MAX_AGE_DAYS keys of a .env config."""
+    return LLMCache(
+        path=config.get('LLM_CACHE_FILE') or CACHE_FILE,
+        mode=(config.get('LLM_CACHE') or "use").lower(),
+        max_mb=float(config.get('LLM_CACHE_MAX_MB') or 1024),
+        max_age_days=float(config.get('LLM_CACHE_MAX_AGE_DAYS') or 30),
+    )
+
+
+if __name__ == "__main__":
+    # python llm_cache.py [stats|evict|clear] [cache file]
+    command = sys.argv[1] if len(sys.argv) > 1 else "stats"
+    cache = LLMCache(sys.argv[2] if len(sys.argv) > 2 else CACHE_FILE)
+    if command == "clear":
+        cache.clear()
+    elif command == "evict":
+        print("Evicted", cache.evict(), "entries")
+    print(cache.summary())
+    cache.close()
@@ -0,0 +1,329 @@
+import asyncio
+import time
+from llm_cache import LLMCache, open_cache
+from metrics import Metrics, open_metrics, classify
+from streaming import StreamOptions, StreamCollector, open_stream_options
+from deadlines import Deadlines, hedge, open_deadlines
+from ollama_scheduler import OllamaScheduler
+
+# Every stage sends its model calls through these helpers, so caching, metrics, streaming and
+# deadlines apply everywhere
+
+CACHE = LLMCache(mode="bypass")
+METRICS = Metrics()
+STREAM = StreamOptions()
+DEADLINES = Deadlines(METRICS)
+
+
+def setup(config: dict, stage: str = ""):
+    """Opens the response cache, the metrics of `stage`, and the streaming and deadline options configured in the .env file."""
+    global CACHE, METRICS, STREAM, DEADLINES
+    CACHE = open_cache(config)
+    METRICS = open_metrics(config, stage or "default")
+    STREAM = open_stream_options(config)
+    DEADLINES = open_deadlines(config, METRICS)
+    return CACHE
+
+def _check(content, validate):
+    # Only responses that pass `validate` are cached, so a malformed one is retried on the next run
+    if not content:
+        return False
+    if validate is None:
+        return True
+    try:
+        validate(content)
+        return True
+    except Exception:
+        return False
+
+def _record_openai(model: str, started: float, raw):
+    completion = raw.parse()
+    usage = completion.usage
+    METRICS.observe(
+        "openai", model, time.monotonic() - started,
+        prompt_tokens=usage.prompt_tokens if usage else 0, completion_tokens=usage.completion_tokens if usage else 0,
+        retries=getattr(raw, "retries_taken", 0),
+    )
+    return completion
+
+def _record_ollama(model: str, started: float, response):
+    # Ollama reports the load and prompt processing time, which is what passes before the first token
+    load, prompt = getattr(response, "load_duration", None), getattr(response, "prompt_eval_duration", None)
+    METRICS.observe(
+        "ollama", model, time.monotonic() - started,
+        prompt_tokens=getattr(response, "prompt_eval_count", 0), completion_tokens=getattr(response, "eval_count", 0),
+        ttft=(load + prompt) / 1e9 if load is not None and prompt is not None else None,
+    )
+
+def _record_stream(backend: str, model: str, collector: StreamCollector, outcome: str = "ok", prompt_tokens: int = 0):
+    METRICS.observe(backend, model, time.monotonic() - collector.started, outcome, prompt_tokens,
+                    collector.tokens, ttft=collector.first_token)
+
+def _openai_delta(chunk):
+    if not chunk.choices:
+        return None, None
+    delta = chunk.choices[0].delta
+    # Reasoning models may send their thinking in a separate field. It counts towards the budget
+    return delta.content, getattr(delta, "reasoning", None) or getattr(delta, "reasoning_content", None)
+
+def _openai_stream(client, model: str, messages: list, key: str, timeout, early_stop: bool, params: dict):
+    collector = StreamCollector(STREAM, key, timeout, early_stop)
+    prompt_tokens = 0
+    try:
+        stream = client.chat.completions.create(model=model, messages=collector.messages(messages), timeout=timeout, stream=True, **params)
+        try:
+            for chunk in stream:
+                prompt_tokens = chunk.usage.prompt_tokens if getattr(chunk, "usage", None) else prompt_tokens
+                if collector.add(*_openai_delta(chunk)):
+                    break
+        finally:
+            stream.close()
+        content = collector.finish()
+    except Exception as e:
+        collector.fail()
+        _record_stream("openai", model, collector, classify(e), prompt_tokens)
+        raise
+    _record_stream("openai", model, collector, prompt_tokens=prompt_tokens)
+    return content
+
+async def _openai_stream_async(client, model: str, messages: list, key: str, timeout, early_stop: bool, params: dict):
+    collector = StreamCollector(STREAM, key, timeout, early_stop)
+    prompt_tokens = 0
+    try:
+        stream = await client.chat.completions.create(model=model, messages=collector.messages(messages), timeout=timeout, stream=True, **params)
+        try:
+            async for chunk in stream:
+                prompt_tokens = chunk.usage.prompt_tokens if getattr(chunk, "usage", None) else prompt_tokens
+                if collector.add(*_openai_delta(chunk)):
+                    break
+        finally:
+            await stream.close()
+        content = collector.finish()
+    except Exception as e:
+        collector.fail()
+        _record_stream("openai", model, collector, classify(e), prompt_tokens)
+        raise
+    _record_stream("openai", model, collector, prompt_tokens=prompt_tokens)
+    return content
+
+def _ollama_stream(chat, model: str, messages: list, key: str, timeout, format, params: dict):
+    # A structured response can not be continued from a partial one, so it is not saved
+    collector = StreamCollector(STREAM, key, timeout, resume=format is None)
+    prompt_tokens = 0
+    try:
+        stream = chat(messages=collector.messages(messages), model=model, format=format, stream=True, **params)
+        try:
+            for chunk in stream:
+                prompt_tokens = getattr(chunk, "prompt_eval_count", None) or prompt_tokens
+                if collector.add(chunk.message.content, getattr(chunk.message, "thinking", None)):
+                    break
+        finally:
+            stream.close()
+        content = collector.finish()
+    except Exception as e:
+        collector.fail()
+        _record_stream("ollama", model, collector, classify(e), prompt_tokens)
+        raise
+    _record_stream("ollama", model, collector, prompt_tokens=prompt_tokens)
+    return content
+
+async def _ollama_send(chat, dispatched, timeout=None, **kwargs):
+    # The OllamaScheduler holds a request back until its model is loaded, and calls `dispatched` when
+    # it sends it. Deadlines, hedges and latencies count from then, not from the time spent in its queue
+    if isinstance(getattr(chat, "__self__", None), OllamaScheduler):
+        return await chat(timeout=timeout, dispatched=dispatched, **kwargs)
+    dispatched()
+    try:
+        # The Ollama client only has a timeout per client, so the deadline of one request is enforced here
+        return await asyncio.wait_for(chat(**kwargs), timeout)
+    except asyncio.TimeoutError:
+        raise TimeoutError(f"No response from {kwargs['model']} within {timeout:.0f}s")
+
+async def _ollama_stream_async(chat, model: str, messages: list, key: str, timeout, format, params: dict, dispatched=None):
+    collector = StreamCollector(STREAM, key, timeout, resume=format is None)
+    prompt_tokens = 0
+
+    def dispatch():
+        collector.start()
+        if dispatched is not None:
+            dispatched.set()
+
+    try:
+        stream = await _ollama_send(chat, dispatch, timeout, messages=collector.messages(messages), model=model, format=format, stream=True, **params)
+        try:
+            while True:
+                # The collector only sees the deadline when a chunk arrives, so a stalled stream is cut off here
+                try:
+                    chunk = await asyncio.wait_for(anext(stream), collector.remaining())
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError:
+                    collector.stopped = "deadline"
+                    break
+                prompt_tokens = getattr(chunk, "prompt_eval_count", None) or prompt_tokens
+                if collector.add(chunk.message.content, getattr(chunk.message, "thinking", None)):
+                    break
+        finally:
+            await stream.aclose()
+        content = collector.finish()
+    except Exception as e:
+        collector.fail()
+        _record_stream("ollama", model, collector, classify(e), prompt_tokens)
+        raise
+    _record_stream("ollama", model, collector, prompt_tokens=prompt_tokens)
+    return content
+
+def _openai_call(client, model: str, messages: list, key: str, timeout, early_stop: bool, params: dict):
+    if STREAM.enabled:
+        return _openai_stream(client, model, messages, key, timeout, early_stop, params)
+    started = time.monotonic()
+    try:
+        raw = client.chat.completions.with_raw_response.create(model=model, messages=messages, timeout=timeout, **params)
+    except Exception as e:
+        METRICS.observe("openai", model, time.monotonic() - started, classify(e))
+        raise
+    return _record_openai(model, started, raw).choices[0].message.content
+
+async def _openai_call_async(client, model: str, messages: list, key: str, timeout, early_stop: bool, params: dict):
+    if STREAM.enabled:
+        return await _openai_stream_async(client, model, messages, key, timeout, early_stop, params)
+    started = time.monotonic()
+    try:
+        raw = await client.chat.completions.with_raw_response.create(model=model, messages=messages, timeout=timeout, **params)
+    except Exception as e:
+        METRICS.observe("openai", model, time.monotonic() - started, classify(e))
+        raise
+    return _record_openai(model, started, raw).choices[0].message.content
+
+def _ollama_call(chat, model: str, messages: list, key: str, timeout, format, params: dict):
+    if STREAM.enabled:
+        return _ollama_stream(chat, model, messages, key, timeout, format, params)
+    started = time.monotonic()
+    try:
+        response = chat(messages=messages, model=model, format=format, **params)
+    except Exception as e:
+        METRICS.observe("ollama", model, time.monotonic() - started, classify(e))
+        raise
+    _record_ollama(model, started, response)
+    return response.message.content
+
+async def _ollama_call_async(chat, model: str, messages: list, key: str, timeout, format, params: dict, dispatched=None):
+    """`dispatched`, an asyncio.Event, is set when the request is sent."""
+    if STREAM.enabled:
+        return await _ollama_stream_async(chat, model, messages, key, timeout, format, params, dispatched)
+    started = None
+
+    def dispatch():
+        nonlocal started
+        started = time.monotonic()
+        if dispatched is not None:
+            dispatched.set()
+
+    try:
+        response = await _ollama_send(chat, dispatch, timeout, messages=messages, model=model, format=format, **params)
+    except Exception as e:
+        METRICS.observe("ollama", model, None, classify(e))
+        raise
+    _record_ollama(model, started, response)
+    return response.message.content
+
+def _count_hedge(backend: str, model: str):
+    return lambda event: METRICS.count(backend, model, "hedges" if event == "sent" else "hedge_wins")
+
+def openai_chat(client, model: str, messages: list, timeout=None, validate=None, early_stop=False, problem=None, **params):
+    """Returns the text of a chat completion from an OpenAI compatible `client`.
+
+    In streaming mode, `early_stop` ends the response once its final answers section is complete.
+    `problem` is the record the call is about; its difficulty and steps scale the adaptive deadline,
+    and `timeout` is the upper bound.
+    """
+    backend = f"openai:{client.base_url}"
+    key = CACHE.key(backend, model, messages, params=params)
+    content = CACHE.get(key)
+    if content is not None:
+        METRICS.count("openai", model, "cache_hits")
+        return content
+    timeout = DEADLINES.timeout("openai", model, problem, timeout)
+    content = _openai_call(client, model, messages, key, timeout, early_stop, params)
+    if _check(content, validate):
+        CACHE.put(key, backend, model, content)
+    return content
+
+async def openai_chat_async(client, model: str, messages: list, timeout=None, validate=None, early_stop=False, problem=None, **params):
+    """Like `openai_chat`. A call slower than the model's hedge percentile is also sent to the same
+    model on the hedge backend, and a response from there is cached under that backend."""
+    backend = f"openai:{client.base_url}"
+    key = CACHE.key(backend, model, messages, params=params)
+    hedge_client = DEADLINES.hedge_openai
+    hedge_backend = f"openai:{hedge_client.base_url}" if hedge_client is not None else None
+    hedge_key = CACHE.key(hedge_backend, model, messages, params=params) if hedge_client is not None else None
+    for cached_key in (key, hedge_key):
+        content = CACHE.get(cached_key) if cached_key else None
+        if content is not None:
+            METRICS.count("openai", model, "cache_hits")
+            return content
+    timeout = DEADLINES.timeout("openai", model, problem, timeout)
+    backup = None
+    if hedge_client is not None:
+        backup = lambda: _openai_call_async(hedge_client, model, messages, hedge_key, timeout, early_stop, params)
+    content, hedged = await hedge(
+        lambda: _openai_call_async(client, model, messages, key, timeout, early_stop, params),
+        backup, DEADLINES.hedge_delay("openai", model, problem), _count_hedge("openai", model)
+    )
+    if _check(content, validate):
+        # A response of the hedge backend is cached under that backend, as its own output
+        if hedged:
+            CACHE.put(hedge_key, hedge_backend, model, content)
+        else:
+            CACHE.put(key, backend, model, content)
+    return content
+
+def ollama_chat(chat, model: str, messages: list, format=None, validate=None, keep_alive=None, timeout=None, problem=None, **params):
+    """Returns the message text of an Ollama `chat` call, e.g. Client().chat.
+
+    `keep_alive` only controls how long Ollama keeps the model loaded, so it is left out of the cache key.
+    The synchronous client can not cancel a request, so `timeout` only applies in streaming mode.
+    """
+    key = CACHE.key("ollama", model, messages, schema=format, params=params)
+    content = CACHE.get(key)
+    if content is not None:
+        METRICS.count("ollama", model, "cache_hits")
+        return content
+    if keep_alive is not None:
+        params = {**params, "keep_alive": keep_alive}
+    timeout = DEADLINES.timeout("ollama", model, problem, timeout)
+    content = _ollama_call(chat, model, messages, key, timeout, format, params)
+    if _check(content, validate):
+        CACHE.put(key, "ollama", model, content)
+    return content
+
+async def ollama_chat_async(chat, model: str, messages: list, format=None, validate=None, keep_alive=None, timeout=None, problem=None, **params):
+    """Like `ollama_chat`, with the deadline enforced and hedging to HEDGE_OLLAMA_HOST.
+
+    With an OllamaScheduler `chat`, the deadline and the hedge delay count from when the scheduler sends the request.
+    """
+    key = CACHE.key("ollama", model, messages, schema=format, params=params)
+    hedge_key = CACHE.key("ollama:hedge", model, messages, schema=format, params=params) if DEADLINES.hedge_ollama is not None else None
+    for cached_key in (key, hedge_key):
+        content = CACHE.get(cached_key) if cached_key else None
+        if content is not None:
+            METRICS.count("ollama", model, "cache_hits")
+            return content
+    if keep_alive is not None:
+        params = {**params, "keep_alive": keep_alive}
+    timeout = DEADLINES.timeout("ollama", model, problem, timeout)
+    backup = None
+    if DEADLINES.hedge_ollama is not None:
+        backup = lambda: _ollama_call_async(DEADLINES.hedge_ollama, model, messages, hedge_key, timeout, format, params)
+    dispatched = asyncio.Event()
+    content, hedged = await hedge(
+        lambda: _ollama_call_async(chat, model, messages, key, timeout, format, params, dispatched),
+        backup, DEADLINES.hedge_delay("ollama", model, problem), _count_hedge("ollama", model), dispatched
+    )
+    if _check(content, validate):
+        # A response of the hedge backend is cached under that backend, as its own output
+        if hedged:
+            CACHE.put(hedge_key, "ollama:hedge", model, content)
+        else:
+            CACHE.put(key, "ollama", model, content)
+    return content
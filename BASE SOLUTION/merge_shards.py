@@ -0,0 +1,225 @@
+import argparse
+import json
+import os
+import sys
+from collections import defaultdict
+from dotenv import dotenv_values
+from cascade import open_cascade
+from dataset import open_dataset, remove_columns
+from jsonl_writer import open_writer, close_writer
+from run_state import RunState, STATE_FILE
+from shards import SHARD_SUFFIX, shard_of, unsharded_path
+from stages import review_file
+
+# Combines the *.shard-i-of-N files of a sharded run into the usual files and reports duplicates
+# and gaps:
+#   python merge_shards.py                    (SOLUTIONS/ and REVIEWS/, checked against "test set.json")
+#   python merge_shards.py ../EVALUATIONS     (evaluated_*.json, checked against the .jsonl files that were evaluated)
+#   python merge_shards.py --check            (only reports)
+# Records are appended to the merged file, the way a resumed run would add them, so the run state
+# index stays valid. Records that the merged file already has are not written again. With CASCADE=true
+# in the .env file, the problems that the earlier REVIEWERS accepted are not gaps of a later reviewer.
+
+DEFAULT_DIRECTORIES = ["./SOLUTIONS", "./REVIEWS"]
+PROBLEMS_FILE = "test set.json"
+JOURNAL_SUFFIX = ".journal" # Journal of an evaluated_*.json file, see EVALUATIONS/eval_ollama.py
+EXAMPLES = 5 # Problem_IDs listed per problem found
+
+config = dotenv_values(".env")
+CASCADE = open_cascade(config)
+
+
+def read_records(path: str):
+    """Reads a JSON Lines file or journal, or a JSON array. The last record of a Problem_ID wins."""
+    records = {}
+    if not os.path.exists(path):
+        return records
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.endswith(".json"):
+            try:
+                items = json.load(f)
+            except json.JSONDecodeError:
+                print(f"Could not parse {path}")
+                items = []
+        else:
+            items = []
+            for line in f:
+                try:
+                    items.append(json.loads(line))
+                except json.JSONDecodeError:
+                    pass # A torn line from an interrupted run
+    for item in items:
+        if isinstance(item, dict) and item.get('Problem_ID') is not None:
+            records[item['Problem_ID']] = item
+    return records
+
+def find_shard_files(directories: list):
+    """Returns {merged file: {(i, N): shard file}}. The journal of an evaluated shard is preferred
+    to its JSON file, which is only rewritten when the shard finishes."""
+    groups = defaultdict(dict)
+    for directory in directories:
+        if not os.path.isdir(directory):
+            continue
+        for name in sorted(os.listdir(directory)):
+            match = SHARD_SUFFIX.search(name)
+            if not match or not (name.endswith(".jsonl") or name.endswith(".json") or name.endswith(JOURNAL_SUFFIX)):
+                continue
+            path = os.path.join(directory, name)
+            merged = unsharded_path(path)
+            if merged.endswith(JOURNAL_SUFFIX):
+                merged = merged[:-len(JOURNAL_SUFFIX)] + ".json"
+            shard = (int(match.group(1)), int(match.group(2)))
+            if not groups[merged].get(shard, "").endswith(JOURNAL_SUFFIX):
+                groups[merged][shard] = path
+    return groups
+
+def expected_ids(merged: str, problems_file: str):
+    """The Problem_IDs that the merged file should have, or None if that is not known."""
+    directory, name = os.path.split(merged)
+    if name.startswith("evaluated_") and name.endswith(".json"):
+        source = os.path.join(directory, name[len("evaluated_"):-len(".json")] + ".jsonl")
+        fields = ('ai_solution', 'elaborated_solution_steps')
+    else:
+        source, fields = problems_file, ()
+    if not os.path.exists(source):
+        return None
+    with open_dataset(source) as dataset:
+        return [item['Problem_ID'] for item in dataset if item.get('Problem_ID') and all(item.get(field) for field in fields)]
+
+def cascade_accepted(merged: str, groups: dict):
+    """The Problem_IDs that a review file does not need because the cascade accepted them before its reviewer."""
+    if not CASCADE.enabled or not config.get('MODEL') or not config.get('REVIEWERS'):
+        return set()
+    REVIEWERS = config['REVIEWERS'].split(" ")
+    files = [os.path.normpath(review_file(config['MODEL'], REVIEWER)) for REVIEWER in REVIEWERS]
+    if os.path.normpath(merged) not in files[1:]:
+        return set()
+    shard_files = {os.path.normpath(path): group for path, group in groups.items()}
+    earlier = []
+    for path in files[:files.index(os.path.normpath(merged))]:
+        records = read_records(path)
+        for shard_path in shard_files.get(path, {}).values():
+            records.update(read_records(shard_path))
+        earlier.append(records)
+    IDs = set().union(*earlier)
+    return {ID for ID in IDs if CASCADE.accepted_after([records.get(ID) for records in earlier])}
+
+def examples(ids: list):
+    shown = ", ".join(str(ID) for ID in ids[:EXAMPLES])
+    return shown + (", ..." if len(ids) > EXAMPLES else "")
+
+def append_records(path: str, records: list):
+    writer = open_writer(path, ensure_ascii=False)
+    for record in records:
+        writer.write(record)
+    close_writer(path)
+
+def write_merged(merged: str, existing: dict, new_records: list):
+    """Appends to a JSON Lines file, or to the journal of an evaluated_*.json file, which is then rewritten."""
+    if not merged.endswith(".json"):
+        append_records(merged, new_records)
+        return
+    journal = merged[:-len(".json")] + JOURNAL_SUFFIX
+    if not os.path.exists(journal):
+        # Same as seeding the journal in eval_ollama.py, so a later evaluation run resumes from it
+        append_records(journal, list(existing.values()))
+    append_records(journal, new_records)
+    latest = read_records(journal)
+    temp_path = merged + ".tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(sorted(latest.values(), key=lambda x: str(x.get('Problem_ID', ''))), f, indent=2, ensure_ascii=False)
+    os.replace(temp_path, merged)
+
+def merge(merged: str, shard_files: dict, problems_file: str, check: bool = False, accepted: set = frozenset()):
+    """Merges one group of shard files. Returns the number of problems found. `accepted` are not gaps."""
+    existing = read_records(merged[:-len(".json")] + JOURNAL_SUFFIX) if merged.endswith(".json") else {}
+    existing = existing or read_records(merged)
+    merged_records = {}
+    conflicts, misplaced, missing_shards = [], [], []
+    duplicates = 0
+    for (index, count), path in sorted(shard_files.items()):
+        for ID, record in read_records(path).items():
+            if shard_of(ID, count) != index:
+                misplaced.append(ID)
+            if ID in merged_records:
+                duplicates += 1
+                if merged_records[ID] != record:
+                    conflicts.append(ID)
+            merged_records[ID] = record
+    for count in sorted({count for _, count in shard_files}):
+        missing_shards += [f"{index}/{count}" for index in range(1, count + 1) if (index, count) not in shard_files]
+
+    expected = expected_ids(merged, problems_file)
+    order = {ID: position for position, ID in enumerate(expected or [])}
+    new_records = sorted(
+        (record for ID, record in merged_records.items() if existing.get(ID) != record),
+        key=lambda record: order.get(record['Problem_ID'], len(order))
+    )
+    print(f"{merged}: {len(shard_files)} shard files, {len(merged_records)} records, {len(new_records)} new")
+
+    found = 0
+    if missing_shards:
+        found += len(missing_shards)
+        print(f"  missing shards: {', '.join(missing_shards)}")
+    if duplicates:
+        print(f"  {duplicates} problems are in more than one shard file, {len(conflicts)} of them with different records (the last shard wins)")
+        found += len(conflicts)
+        if conflicts:
+            print(f"    {examples(conflicts)}")
+    if misplaced:
+        found += len(misplaced)
+        print(f"  {len(misplaced)} problems are in the wrong shard file: {examples(misplaced)}")
+    if expected is not None:
+        count = max(count for _, count in shard_files)
+        gaps = defaultdict(list)
+        for ID in expected:
+            if ID not in existing and ID not in merged_records and ID not in accepted:
+                gaps[shard_of(ID, count)].append(ID)
+        if accepted:
+            print(f"  {len(accepted)} problems were accepted by the cascade before this reviewer")
+        for index, ids in sorted(gaps.items()):
+            found += len(ids)
+            print(f"  shard {index}/{count}: {len(ids)} problems missing: {examples(ids)}")
+    if not check and new_records:
+        write_merged(merged, existing, new_records)
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge the outputs of a sharded run into the usual files.")
+    parser.add_argument("directories", nargs="*", default=DEFAULT_DIRECTORIES)
+    parser.add_argument("--problems", default=PROBLEMS_FILE, help="Dataset whose problems every stage output should have")
+    parser.add_argument("--check", action="store_true", help="Only report duplicates and gaps, do not write anything")
+    parser.add_argument("--delete", action="store_true", help="Delete the shard files once they are merged without any problems found")
+    args = parser.parse_args()
+
+    groups = find_shard_files(args.directories)
+    if not groups:
+        print("No shard files found in", ", ".join(args.directories))
+        return 0
+    found = 0
+    for merged, shard_files in sorted(groups.items()):
+        found += merge(merged, shard_files, args.problems, args.check, cascade_accepted(merged, groups))
+    if found:
+        print(f"{found} problems found. Run the shards again to fill the gaps, then merge again.")
+    elif args.delete and not args.check:
+        state = RunState() if os.path.exists(STATE_FILE) else None
+        for merged, shard_files in groups.items():
+            for path in shard_files.values():
+                if state:
+                    # Later stages look the records up in the merged file from now on
+                    state.move(path, merged)
+                os.remove(path)
+                remove_columns(path)
+                # The JSON file of an evaluated shard is merged through its journal
+                for other in (path[:-len(JOURNAL_SUFFIX)] + ".json",) if path.endswith(JOURNAL_SUFFIX) else ():
+                    if os.path.exists(other):
+                        os.remove(other)
+        if state:
+            state.close()
+        print("Deleted the shard files")
+    return 1 if found else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
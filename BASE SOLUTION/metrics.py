@@ -0,0 +1,297 @@
+import atexit
+import contextvars
+import glob
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from jsonl_writer import locked
+
+# Per-call metrics of every model call, per (stage, backend, model): request counts by outcome,
+# retries, cache hits, hedged requests, prompt and completion tokens, and histograms of the latency
+# of successful calls and the time to the first token. They are saved to ./METRICS/<stage>.json
+# (added to on every run) and can be served in the Prometheus text format on METRICS_PORT. Several
+# processes, e.g. the shards of a run, can add to the same file: each one adds the calls it made
+# since its last save to what is in the file, under a lock on "<file>.lock".
+
+METRICS_DIR = "./METRICS"
+FLUSH_INTERVAL = 10 # seconds between saves of the metrics file
+BUCKETS = (0.1, 0.15, 0.25, 0.4, 0.6, 1, 1.5, 2.5, 4, 6, 10, 15, 25, 40, 60, 90, 120, 180, 300, 600) # seconds, plus +Inf
+OUTCOMES = ("ok", "error", "timeout", "rate_limited")
+
+# The stage the calls of the current task belong to, for scripts like PIPELINE.py that run several stages
+STAGE = contextvars.ContextVar("metrics_stage", default=None)
+
+
+def classify(error: Exception):
+    """Returns the outcome of a failed call: rate_limited, timeout or error."""
+    if getattr(error, "status_code", None) == 429:
+        return "rate_limited"
+    if isinstance(error, TimeoutError) or "Timeout" in type(error).__name__:
+        return "timeout"
+    return "error"
+
+def new_series(stage: str, backend: str, model: str):
+    return {
+        "stage": stage, "backend": backend, "model": model,
+        "requests": {outcome: 0 for outcome in OUTCOMES},
+        "retries": 0, "cache_hits": 0, "hedges": 0, "hedge_wins": 0, "prompt_tokens": 0, "completion_tokens": 0,
+        "latency": [0] * (len(BUCKETS) + 1), "latency_sum": 0.0,
+        "ttft": [0] * (len(BUCKETS) + 1), "ttft_sum": 0.0,
+    }
+
+def add_to_histogram(counts: list, value: float):
+    for i, bound in enumerate(BUCKETS):
+        if value <= bound:
+            counts[i] += 1
+            return
+    counts[-1] += 1
+
+def quantile(counts: list, q: float):
+    """Estimates a quantile from histogram counts, interpolating inside the bucket it falls in."""
+    total = sum(counts)
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    for i, count in enumerate(counts):
+        if count and seen + count >= rank:
+            lower = BUCKETS[i - 1] if i > 0 else 0
+            upper = BUCKETS[i] if i < len(BUCKETS) else BUCKETS[-1]
+            return lower + (upper - lower) * (rank - seen) / count
+        seen += count
+    return BUCKETS[-1]
+
+def add_call(item: dict, latency: float | None, outcome: str, prompt_tokens: int | None, completion_tokens: int | None,
+             ttft: float | None, retries: int):
+    item["requests"][outcome] = item["requests"].get(outcome, 0) + 1
+    item["retries"] += retries
+    item["prompt_tokens"] += prompt_tokens or 0
+    item["completion_tokens"] += completion_tokens or 0
+    # A failed call ends at its deadline or early with an error, and would skew the latency quantiles
+    if outcome == "ok" and latency is not None:
+        add_to_histogram(item["latency"], latency)
+        item["latency_sum"] += latency
+    if ttft is not None:
+        add_to_histogram(item["ttft"], ttft)
+        item["ttft_sum"] += ttft
+
+def merge(series: list):
+    """Adds up series with the same (stage, backend, model), e.g. from several metrics files."""
+    merged = {}
+    for item in series:
+        key = (item["stage"], item["backend"], item["model"])
+        if key not in merged:
+            merged[key] = new_series(*key)
+        total = merged[key]
+        for outcome, count in item["requests"].items():
+            total["requests"][outcome] = total["requests"].get(outcome, 0) + count
+        for field in ("retries", "cache_hits", "hedges", "hedge_wins", "prompt_tokens", "completion_tokens", "latency_sum", "ttft_sum"):
+            total[field] += item.get(field, 0)
+        for field in ("latency", "ttft"):
+            total[field] = [a + b for a, b in zip(total[field], item[field])]
+    return list(merged.values())
+
+
+def _labels(**labels):
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in labels.items()) + "}"
+
+def prometheus_text(series: list):
+    """Renders series in the Prometheus text exposition format."""
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(samples)
+
+    def histogram(name, field):
+        samples = []
+        for item in series:
+            labels = {"stage": item["stage"], "backend": item["backend"], "model": item["model"]}
+            cumulative = 0
+            for bound, count in zip([*BUCKETS, "+Inf"], item[field]):
+                cumulative += count
+                samples.append(f"{name}_bucket{_labels(**labels, le=bound)} {cumulative}")
+            samples.append(f"{name}_sum{_labels(**labels)} {item[field + '_sum']}")
+            samples.append(f"{name}_count{_labels(**labels)} {cumulative}")
+        return samples
+
+    metric("llm_requests_total", "counter", "Model calls by outcome (ok, error, timeout, rate_limited).", [
+        f"llm_requests_total{_labels(stage=item['stage'], backend=item['backend'], model=item['model'], outcome=outcome)} {count}"
+        for item in series for outcome, count in item["requests"].items()
+    ])
+    for name, field, help_text in (
+        ("llm_retries_total", "retries", "Retries made by the client or the script."),
+        ("llm_cache_hits_total", "cache_hits", "Calls answered from the response cache."),
+        ("llm_hedges_total", "hedges", "Slow calls duplicated on the secondary backend."),
+        ("llm_hedge_wins_total", "hedge_wins", "Hedged calls answered first by the secondary backend."),
+    ):
+        metric(name, "counter", help_text, [
+            f"{name}{_labels(stage=item['stage'], backend=item['backend'], model=item['model'])} {item.get(field, 0)}" for item in series
+        ])
+    metric("llm_tokens_total", "counter", "Prompt and completion tokens reported by the provider.", [
+        f"llm_tokens_total{_labels(stage=item['stage'], backend=item['backend'], model=item['model'], kind=kind)} {item[kind + '_tokens']}"
+        for item in series for kind in ("prompt", "completion")
+    ])
+    metric("llm_request_duration_seconds", "histogram", "Latency of successful model calls.", histogram("llm_request_duration_seconds", "latency"))
+    metric("llm_time_to_first_token_seconds", "histogram", "Time until the first token, where the backend reports it.",
+           histogram("llm_time_to_first_token_seconds", "ttft"))
+    return "\n".join(lines) + "\n"
+
+def summary_lines(series: list):
+    lines = [f"{'stage':<22}{'backend':<9}{'model':<32}{'calls':>7}{'errors':>7}{'timeouts':>9}{'429s':>6}{'retries':>8}"
+             f"{'cached':>7}{'p50 s':>8}{'p99 s':>8}{'ttft p50':>9}{'tokens in':>11}{'tokens out':>11}"]
+    for item in sorted(series, key=lambda item: (item["stage"], item["backend"], item["model"])):
+        requests = item["requests"]
+        p50, p99, ttft = quantile(item["latency"], 0.5), quantile(item["latency"], 0.99), quantile(item["ttft"], 0.5)
+        lines.append(
+            f"{item['stage']:<22}{item['backend']:<9}{item['model'][:31]:<32}{sum(requests.values()):>7}{requests.get('error', 0):>7}"
+            f"{requests.get('timeout', 0):>9}{requests.get('rate_limited', 0):>6}{item['retries']:>8}{item['cache_hits']:>7}"
+            f"{p50 if p50 is None else round(p50, 2)!s:>8}{p99 if p99 is None else round(p99, 2)!s:>8}"
+            f"{ttft if ttft is None else round(ttft, 2)!s:>9}{item['prompt_tokens']:>11}{item['completion_tokens']:>11}"
+        )
+    return lines
+
+
+class Metrics:
+    """Thread-safe recorder of model calls. `stage` labels the calls made outside any STAGE context.
+
+    With a `path`, the series saved there by earlier runs are loaded and added to, and the file
+    is saved every FLUSH_INTERVAL seconds and when the process exits. `series` holds everything
+    that is known, `unsaved` only the calls since the last save.
+    """
+
+    def __init__(self, stage: str = "", path: str | None = None):
+        self.stage = stage
+        self.path = path
+        self.lock = threading.Lock()
+        self.series = {}
+        self.unsaved = {}
+        self.last_flush = time.monotonic()
+        self.server = None
+        if path is None:
+            return
+        for item in read_series(path):
+            self.series[(item["stage"], item["backend"], item["model"])] = item
+        atexit.register(self.flush)
+
+    def _get(self, backend: str, model: str):
+        """The item of the series in `series` and in `unsaved`."""
+        stage = STAGE.get() or self.stage
+        key = (stage, backend, model)
+        for series in (self.series, self.unsaved):
+            if key not in series:
+                series[key] = new_series(stage, backend, model)
+        return self.series[key], self.unsaved[key]
+
+    def observe(self, backend: str, model: str, latency: float | None, outcome: str = "ok", prompt_tokens: int | None = 0,
+                completion_tokens: int | None = 0, ttft: float | None = None, retries: int = 0):
+        """Records one call. `latency` includes the retries the client made inside it.
+
+        Only the latency of successful calls goes into the histogram, which the adaptive deadlines read.
+        """
+        with self.lock:
+            for item in self._get(backend, model):
+                add_call(item, latency, outcome, prompt_tokens, completion_tokens, ttft, retries)
+        if self.path and time.monotonic() - self.last_flush > FLUSH_INTERVAL:
+            self.flush()
+
+    def count(self, backend: str, model: str, field: str, value: int = 1):
+        """Adds to a counter of the series, e.g. "retries" or "cache_hits"."""
+        with self.lock:
+            for item in self._get(backend, model):
+                item[field] = item.get(field, 0) + value
+
+    def quantile(self, backend: str, model: str, q: float, min_samples: int = 1):
+        """The q-quantile of the latency of a model over all stages, or None with fewer than `min_samples` calls."""
+        with self.lock:
+            histograms = [item["latency"] for (_, b, m), item in self.series.items() if b == backend and m == model]
+        counts = [sum(column) for column in zip(*histograms)]
+        if sum(counts) < min_samples:
+            return None
+        return quantile(counts, q)
+
+    def snapshot(self):
+        with self.lock:
+            return json.loads(json.dumps(list(self.series.values())))
+
+    def flush(self):
+        """Adds the unsaved calls to the file, and takes in what other processes added to it."""
+        if not self.path:
+            return
+        self.last_flush = time.monotonic()
+        with self.lock:
+            unsaved, self.unsaved = list(self.unsaved.values()), {}
+        if not unsaved:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        try:
+            with locked(self.path + ".lock"):
+                series = merge(read_series(self.path) + unsaved)
+                temp_path = f"{self.path}.{os.getpid()}.tmp"
+                with open(temp_path, "w", encoding="utf-8") as f:
+                    json.dump({"buckets": list(BUCKETS), "updated": time.time(), "series": series}, f, indent=1)
+                os.replace(temp_path, self.path)
+        except OSError:
+            with self.lock:
+                self.unsaved = {(item["stage"], item["backend"], item["model"]): item for item in merge(unsaved + list(self.unsaved.values()))}
+            raise
+        with self.lock:
+            self.series = {(item["stage"], item["backend"], item["model"]): item for item in merge(series + list(self.unsaved.values()))}
+
+    def serve(self, port: int):
+        """Serves the metrics at http://127.0.0.1:<port>/metrics in the Prometheus text format."""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = prometheus_text(metrics.snapshot()).encode('utf-8')
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        print(f"Serving metrics on http://127.0.0.1:{port}/metrics")
+
+    def summary(self):
+        return "\n".join(summary_lines(self.snapshot()))
+
+
+def open_metrics(config: dict, stage: str):
+    """Creates the metrics of a stage from the METRICS, METRICS_DIR and METRICS_PORT keys of a .env config."""
+    if (config.get('METRICS') or "true").lower() in ("0", "false", "no"):
+        return Metrics(stage)
+    metrics = Metrics(stage, os.path.join(config.get('METRICS_DIR') or METRICS_DIR, f"{stage}.json"))
+    if config.get('METRICS_PORT'):
+        metrics.serve(int(config['METRICS_PORT']))
+    return metrics
+
+def read_series(path: str):
+    """The series saved in a metrics file, or [] if it does not exist or has other buckets."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            saved = json.load(f)
+        return saved["series"] if saved.get("buckets") == list(BUCKETS) else []
+    except (FileNotFoundError, json.JSONDecodeError, KeyError):
+        return []
+
+def load_series(paths: list):
+    return merge([item for path in paths for item in read_series(path)])
+
+
+if __name__ == "__main__":
+    # python metrics.py [summary|prometheus] [metrics files, default ./METRICS/*.json]
+    command = sys.argv[1] if len(sys.argv) > 1 else "summary"
+    series = load_series(sys.argv[2:] or sorted(glob.glob(os.path.join(METRICS_DIR, "*.json"))))
+    print(prometheus_text(series) if command == "prometheus" else "\n".join(summary_lines(series)), end="" if command == "prometheus" else "\n")
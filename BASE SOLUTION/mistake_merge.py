@@ -0,0 +1,138 @@
+import hashlib
+import re
+import unicodedata
+from cascade import MISTAKE_FIELDS, NO_MISTAKE, review_mistakes
+
+# Merges the mistakes that the REVIEWERS list before they go to the META_REVIEWER. Instead of the
+# full JSON of every review, with its scores and the same mistake worded by several reviewers, the
+# META_REVIEWER gets one list with each distinct mistake once and the number of reviewers that
+# found it. Mistakes are normalized (case, LaTeX delimiters, punctuation, filler words), exact
+# duplicates are found by the hash of the normalized text, and the rest are clustered by the
+# Jaccard similarity of their words. Mistakes with different numbers are never merged, so that
+# "the mass should be 2 kg" and "the mass should be 3 kg" both reach the META_REVIEWER.
+
+SIMILARITY = 0.6 # Jaccard similarity of the words from which two mistakes count as the same
+CHARS_PER_TOKEN = 4 # for the token estimates, as in eval_ollama.py
+FILLER_WORDS = frozenset(
+    "a an the is are was were be been of in on at to for by with and or that this it its as there".split()
+    + "solution step answer mistake error incorrect incorrectly wrong wrongly".split()
+)
+LATEX_NOISE = re.compile(r"\\left|\\right|\\[,;:! ]|\\[()\[\]]|\$")
+# LaTeX commands keep their name, so "\\sin" and "sin" match
+WORD = re.compile(r"[a-z]+|\d+(?:\.\d+)?|[=<>^/*+-]")
+
+
+def normalize(mistake: str):
+    text = unicodedata.normalize("NFKC", str(mistake)).lower()
+    text = LATEX_NOISE.sub(" ", text)
+    return " ".join(WORD.findall(text))
+
+def digest(normalized: str):
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+
+def words(normalized: str):
+    # Plurals are folded so "force" and "forces" match
+    return frozenset(
+        word[:-1] if len(word) > 3 and word.endswith("s") and not word.endswith("ss") else word
+        for word in normalized.split() if word not in FILLER_WORDS
+    )
+
+def numbers(normalized: str):
+    return frozenset(float(word) for word in normalized.split() if word[0].isdigit())
+
+def similarity(a: frozenset, b: frozenset):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class Cluster:
+    def __init__(self, mistake: str, reviewer: str, field: str, normalized: str):
+        self.mistakes = [mistake]
+        self.reviewers = [reviewer]
+        self.fields = [field]
+        self.hashes = {digest(normalized)}
+        self.words = [words(normalized)]
+        self.numbers = [numbers(normalized)]
+
+    def add(self, mistake: str, reviewer: str, field: str, normalized: str):
+        self.mistakes.append(mistake)
+        if reviewer not in self.reviewers:
+            self.reviewers.append(reviewer)
+        if field not in self.fields:
+            self.fields.append(field)
+        self.hashes.add(digest(normalized))
+        self.words.append(words(normalized))
+        self.numbers.append(numbers(normalized))
+
+    def record(self):
+        # The longest wording usually carries the most detail
+        return {"mistake": max(self.mistakes, key=len), "reviewers": self.reviewers, "categories": self.fields}
+
+
+def merge_mistakes(reviews: dict, threshold: float = SIMILARITY):
+    """Merges the mistakes of `reviews`, which maps each reviewer to its review.
+
+    Returns one dict per distinct mistake with its longest wording, the reviewers that found it and
+    the review fields it was listed under, the ones most reviewers agree on first.
+    """
+    clusters = []
+    for REVIEWER, review in reviews.items():
+        for field in MISTAKE_FIELDS:
+            for mistake in review.get(field) or []:
+                if NO_MISTAKE.match(str(mistake)):
+                    continue
+                normalized = normalize(mistake)
+                match = next((cluster for cluster in clusters if digest(normalized) in cluster.hashes), None)
+                if match is None:
+                    mistake_words, mistake_numbers = words(normalized), numbers(normalized)
+                    scores = [
+                        max((similarity(mistake_words, other) for other, other_numbers in zip(cluster.words, cluster.numbers)
+                             if other_numbers == mistake_numbers), default=0.0)
+                        for cluster in clusters
+                    ]
+                    if scores and max(scores) >= threshold:
+                        match = clusters[scores.index(max(scores))]
+                if match is None:
+                    clusters.append(Cluster(str(mistake), REVIEWER, field, normalized))
+                else:
+                    match.add(str(mistake), REVIEWER, field, normalized)
+    order = {id(cluster): i for i, cluster in enumerate(clusters)}
+    clusters.sort(key=lambda cluster: (-len(cluster.reviewers), order[id(cluster)]))
+    return [cluster.record() for cluster in clusters]
+
+def estimate_tokens(messages: list):
+    return sum(len(message['content']) for message in messages) // CHARS_PER_TOKEN
+
+
+class MergeStats:
+    """Counts the mistakes merged and the prompt tokens saved over a run."""
+
+    def __init__(self):
+        self.prompts = 0
+        self.mistakes = 0
+        self.merged = 0
+        self.full_tokens = 0
+        self.merged_tokens = 0
+
+    def add(self, reviews: dict, merged: list, full_messages: list, merged_messages: list):
+        self.prompts += 1
+        self.mistakes += sum(len(review_mistakes(review)) for review in reviews.values())
+        self.merged += len(merged)
+        self.full_tokens += estimate_tokens(full_messages)
+        self.merged_tokens += estimate_tokens(merged_messages)
+
+    def summary(self):
+        if not self.prompts:
+            return "Mistake merging: no meta-review prompts"
+        saved = self.full_tokens - self.merged_tokens
+        return (f"Mistake merging: {self.mistakes} mistakes from the reviewers merged into {self.merged}; "
+                f"{self.prompts} meta-review prompts of about {self.merged_tokens} tokens instead of {self.full_tokens} "
+                f"({saved / max(1, self.full_tokens):.0%} saved)")
+
+
+def open_merge(config: dict):
+    """The Jaccard threshold from the MERGE_MISTAKES and MERGE_SIMILARITY keys of a .env config, or None when merging is off."""
+    if (config.get('MERGE_MISTAKES') or "").lower() not in ("1", "true", "yes"):
+        return None
+    return float(config.get('MERGE_SIMILARITY') or SIMILARITY)
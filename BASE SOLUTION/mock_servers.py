@@ -0,0 +1,260 @@
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+from fake_batch_server import FakeBatchServer, FakeBatchHandler, fake_solution, fake_evaluation
+
+# Stand-in for every API the pipeline calls, for benchmarks that must not spend real quota:
+#   POST /v1/chat/completions                         OpenAI compatible, used by the PROPOSER scripts
+#   POST /api/chat, /api/generate, GET /api/ps        Ollama, used by the reviewers
+#   POST /v1beta/models/<model>:generateContent       Gemini, used by eval_ollama.py
+# plus the batch endpoints of fake_batch_server.py. Every call sleeps for a latency drawn from a
+# log-normal distribution and can be failed with a 500 or a 429 at a configurable rate. Requests
+# with "stream": true are answered chunk by chunk, with the first chunk after a fifth of the latency.
+# Optionally, non-streamed calls also take a time per prompt and per completion token, so that
+# requests of different sizes (e.g. packed reviews) cost what they would on a real model.
+
+
+def resolve(schema: dict, definitions: dict):
+    return resolve(definitions[schema["$ref"].split("/")[-1]], definitions) if "$ref" in schema else schema
+
+def synthesize(schema: dict, rng: random.Random, definitions: dict | None = None, ids: list | None = None):
+    """Returns a value that matches a (pydantic generated) JSON schema.
+
+    An array of objects with a Problem_ID gets one item for each of `ids`, the Problem_IDs of the prompt.
+    """
+    definitions = definitions if definitions is not None else schema.get("$defs", {})
+    if "$ref" in schema:
+        return synthesize(resolve(schema, definitions), rng, definitions, ids)
+    if "anyOf" in schema:
+        return synthesize(schema["anyOf"][0], rng, definitions, ids)
+    kind = schema.get("type")
+    if kind == "object":
+        return {name: synthesize(field, rng, definitions, ids) for name, field in schema.get("properties", {}).items()}
+    if kind == "array":
+        items = schema.get("items", {})
+        if ids and "Problem_ID" in resolve(items, definitions).get("properties", {}):
+            return [{**synthesize(items, rng, definitions), "Problem_ID": ID} for ID in ids]
+        return [synthesize(items, rng, definitions) for _ in range(rng.randint(0, 2))]
+    if kind == "number":
+        return round(rng.uniform(schema.get("minimum", 0), schema.get("maximum", 10)), 1)
+    if kind == "integer":
+        return rng.randint(schema.get("minimum", 0), schema.get("maximum", 10))
+    if kind == "boolean":
+        return rng.random() < 0.5
+    return f"Synthetic statement {rng.randint(1, 1000)}"
+
+
+class MockServer(FakeBatchServer):
+    """FakeBatchServer that also answers single requests, with injected latency and errors, and records every call."""
+
+    def __init__(self, address, latency_median: float = 0.2, latency_sigma: float = 0.5,
+                 error_rate: float = 0, rate_limit_rate: float = 0, batch_delay: float = 2, retry_after: float = 1,
+                 prompt_token_latency: float = 0, token_latency: float = 0):
+        super().__init__(address, delay=batch_delay)
+        self.RequestHandlerClass = MockHandler
+        self.latency_median = latency_median
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after # Sent with every 429, as Gemini's RetryInfo
+        self.prompt_token_latency = prompt_token_latency # Seconds per prompt token
+        self.token_latency = token_latency # Seconds per completion token
+        self.calls = []
+        self.connections = 0
+        self.rng = random.Random(0)
+
+    def draw(self):
+        """Returns (latency, status) for the next call."""
+        with self.lock:
+            latency = self.latency_median * math.exp(self.rng.gauss(0, self.latency_sigma)) if self.latency_median > 0 else 0
+            roll = self.rng.random()
+        if roll < self.rate_limit_rate:
+            return latency / 10, 429
+        if roll < self.rate_limit_rate + self.error_rate:
+            return latency, 500
+        return latency, 200
+
+    def connect(self):
+        """Numbers a new client connection, so the calls show whether clients reuse theirs."""
+        with self.lock:
+            self.connections += 1
+            return self.connections
+
+    def record(self, api: str, model: str, status: int, started: float, tokens: int, connection: int = 0):
+        with self.lock:
+            self.calls.append({"api": api, "model": model, "status": status, "start": started,
+                               "end": time.monotonic(), "tokens": tokens, "connection": connection})
+
+    def reset(self):
+        with self.lock:
+            calls, self.calls = self.calls, []
+        return calls
+
+
+class MockHandler(FakeBatchHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.connection_number = self.server.connect()
+
+    def respond(self, api: str, model: str, make_response, prompt_tokens: int = 0):
+        started = time.monotonic()
+        latency, status = self.server.draw()
+        try:
+            if status == 200:
+                data, tokens = make_response()
+                time.sleep(latency + prompt_tokens * self.server.prompt_token_latency + tokens * self.server.token_latency)
+                self.send_json(data)
+            else:
+                time.sleep(latency)
+                tokens = 0
+                message = "Rate limit exceeded" if status == 429 else "Injected server error"
+                error = {"code": status, "message": message, "status": "RESOURCE_EXHAUSTED" if status == 429 else "INTERNAL"}
+                if status == 429:
+                    error["details"] = [{"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": f"{self.server.retry_after}s"}]
+                self.send_json({"error": error}, status)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up, e.g. after a deadline or because a hedged request answered first
+            self.close_connection = True
+        self.server.record(api, model, status, started, tokens, self.connection_number)
+
+    def send_stream(self, api: str, model: str, content: str, make_chunk, make_last, lines: str = "ndjson"):
+        """Streams `content` in word sized chunks, ending with the chunk made by `make_last`."""
+        started = time.monotonic()
+        latency, status = self.server.draw()
+        if status != 200:
+            time.sleep(latency)
+            self.send_json({"error": {"code": status, "message": "Injected error"}}, status)
+            return self.server.record(api, model, status, started, 0, self.connection_number)
+        pieces = re.findall(r"\S+\s*|\s+", content) or [""]
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream" if lines == "sse" else "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        sent = 0
+        try:
+            time.sleep(latency / 5)
+            for piece in pieces:
+                self.write_chunk(make_chunk(piece), lines)
+                sent += 1
+                time.sleep(latency * 4 / 5 / len(pieces))
+            self.write_chunk(make_last(sent), lines)
+            if lines == "sse":
+                self.write_line(b"data: [DONE]\n\n")
+            self.write_line(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading, e.g. after the final answers
+            self.close_connection = True
+        self.server.record(api, model, 200, started, sent, self.connection_number)
+
+    def write_chunk(self, data: dict, lines: str):
+        text = json.dumps(data)
+        self.write_line((f"data: {text}\n\n" if lines == "sse" else text + "\n").encode('utf-8'))
+
+    def write_line(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_POST(self):
+        path = self.path.split("?")[0]
+        if path == "/v1/chat/completions":
+            request = json.loads(self.read_body())
+            if request.get("stream"):
+                ID, created = self.server.next_id("chatcmpl-"), int(time.time())
+
+                def chunk(piece, finish_reason=None):
+                    return {"id": ID, "object": "chat.completion.chunk", "created": created, "model": request["model"],
+                            "choices": [{"index": 0, "delta": {"content": piece} if piece else {}, "finish_reason": finish_reason}]}
+                return self.send_stream("openai", request["model"], fake_solution(request["messages"]), chunk,
+                                        lambda sent: chunk(None, "stop"), "sse")
+
+            def completion():
+                content = fake_solution(request["messages"])
+                usage = {"prompt_tokens": sum(len(m["content"]) // 4 for m in request["messages"]), "completion_tokens": len(content) // 4}
+                usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+                return {
+                    "id": self.server.next_id("chatcmpl-"), "object": "chat.completion", "created": int(time.time()), "model": request["model"],
+                    "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+                    "usage": usage,
+                }, usage["completion_tokens"]
+            return self.respond("openai", request["model"], completion, sum(len(m["content"]) // 4 for m in request["messages"]))
+        if path == "/api/chat":
+            request = json.loads(self.read_body())
+            if request.get("stream", True):
+                rng = random.Random(json.dumps(request["messages"], sort_keys=True))
+                schema = request.get("format")
+                content = json.dumps(synthesize(schema, rng)) if isinstance(schema, dict) else fake_solution(request["messages"])
+
+                def message(piece, sent=None):
+                    data = {"model": request["model"], "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                            "message": {"role": "assistant", "content": piece}, "done": sent is not None}
+                    if sent is not None:
+                        data.update(done_reason="stop", eval_count=sent,
+                                    prompt_eval_count=sum(len(m["content"]) // 4 for m in request["messages"]))
+                    return data
+                return self.send_stream("ollama", request["model"], content, message, lambda sent: message("", sent))
+
+            prompt_tokens = sum(len(m["content"]) // 4 for m in request["messages"])
+
+            def chat():
+                rng = random.Random(json.dumps(request["messages"], sort_keys=True))
+                schema = request.get("format")
+                ids = re.findall(r"Problem_ID: (\S+)", request["messages"][-1]["content"])
+                content = json.dumps(synthesize(schema, rng, ids=ids)) if isinstance(schema, dict) else fake_solution(request["messages"])
+                return {
+                    "model": request["model"], "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                    "message": {"role": "assistant", "content": content}, "done": True, "done_reason": "stop",
+                    "prompt_eval_count": prompt_tokens, "eval_count": len(content) // 4,
+                }, len(content) // 4
+            return self.respond("ollama", request["model"], chat, prompt_tokens)
+        if path == "/api/generate":
+            # Only used to load and unload models
+            request = json.loads(self.read_body())
+            return self.send_json({"model": request["model"], "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                                   "response": "", "done": True})
+        match = re.fullmatch(r"/v1beta/models/([^/:]+):generateContent", path)
+        if match:
+            request = json.loads(self.read_body())
+
+            def generate():
+                prompt = "".join(part.get("text", "") for content in request["contents"] for part in content["parts"])
+                text = fake_evaluation(prompt)
+                return {
+                    "candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP"}],
+                    "usageMetadata": {"promptTokenCount": len(prompt) // 4, "candidatesTokenCount": len(text) // 4},
+                }, len(text) // 4
+            return self.respond("gemini", match.group(1), generate)
+        super().do_POST()
+
+    def do_GET(self):
+        if self.path.split("?")[0] == "/api/ps":
+            return self.send_json({"models": []})
+        super().do_GET()
+
+
+def start_mock_server(port: int = 0, **options):
+    """Starts a MockServer on a background thread. Port 0 picks a free port."""
+    server = MockServer(("127.0.0.1", port), **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock OpenAI, Ollama and Gemini server for offline runs.")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency-median", type=float, default=0.2, help="Median seconds per call")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="Spread of the log-normal latency")
+    parser.add_argument("--error-rate", type=float, default=0, help="Fraction of calls answered with a 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0, help="Fraction of calls answered with a 429")
+    parser.add_argument("--prompt-token-latency", type=float, default=0, help="Extra seconds per prompt token")
+    parser.add_argument("--token-latency", type=float, default=0, help="Extra seconds per completion token")
+    args = parser.parse_args()
+    server = MockServer(("127.0.0.1", args.port), args.latency_median, args.latency_sigma, args.error_rate, args.rate_limit_rate,
+                        prompt_token_latency=args.prompt_token_latency, token_latency=args.token_latency)
+    print(f"Mock server on http://127.0.0.1:{args.port} (OpenAI: /v1, Ollama: OLLAMA_HOST=http://127.0.0.1:{args.port}, Gemini: /v1beta)")
+    server.serve_forever()
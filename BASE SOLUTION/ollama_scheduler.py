@@ -0,0 +1,224 @@
+import asyncio
+import time
+from collections import Counter, deque
+
+
+class OllamaScheduler:
+    """Sends Ollama chat requests grouped by model, so that models are swapped in and out as rarely as possible.
+
+    At most `max_loaded` models are kept resident. A resident model keeps serving its queue
+    until the queue is empty, or until it has served `batch_size` requests while another model
+    is waiting. Only then is it unloaded (keep_alive=0) and the model with the most pending
+    requests is loaded in its place. A model is only swapped in once it has `batch_size`
+    requests queued or its oldest request has waited `max_wait` seconds, so requests that
+    trickle in are batched instead of each causing a swap. Use `chat` as a drop-in for
+    `AsyncClient().chat`. The `timeout` of a request only counts from when it is sent to Ollama,
+    not while it waits in the queue, and `dispatched` is called at that moment.
+    """
+
+    def __init__(self, client, max_loaded: int = 1, keep_alive="30m", concurrency: int = 1, batch_size: int = 32, max_wait: float = 10):
+        self.client = client
+        self.max_loaded = max(1, max_loaded)
+        self.keep_alive = keep_alive
+        self.concurrency = max(1, concurrency)
+        self.batch_size = max(1, batch_size)
+        self.max_wait = max_wait
+        self.pending = {}
+        self.running = Counter()
+        self.served = Counter()
+        self.loaded = []
+        self.ready = set()
+        self.unloading = {}
+        self.loads = 0
+        self.swaps = 0
+        self.requests = Counter()
+        self.discovered = None
+
+    async def discover(self):
+        """Treats the models Ollama already has in memory as loaded."""
+        if self.discovered is None:
+            self.discovered = asyncio.ensure_future(self._discover())
+        await self.discovered
+
+    async def _discover(self):
+        try:
+            response = await self.client.ps()
+            for model in response.models[:self.max_loaded]:
+                self.loaded.append(model.model)
+                self.ready.add(model.model)
+        except Exception as e:
+            print("Could not list loaded Ollama models:", e)
+
+    async def chat(self, model: str, timeout: float | None = None, dispatched=None, **kwargs):
+        await self.discover()
+        future = asyncio.get_running_loop().create_future()
+        self.pending.setdefault(model, deque()).append((kwargs, future, time.monotonic(), timeout, dispatched))
+        if model not in self.loaded:
+            asyncio.get_running_loop().call_later(self.max_wait, self._schedule)
+        self._schedule()
+        try:
+            return await future
+        except asyncio.CancelledError:
+            # A stream that arrived just before the caller was cancelled is never read, so it is closed here
+            if future.done() and not future.cancelled() and future.exception() is None and isinstance(future.result(), ScheduledStream):
+                await future.result().aclose()
+            raise
+
+    async def prefetch(self, models: list[str]):
+        """Loads models ahead of their first request while there are free slots."""
+        await self.discover()
+        for model in models:
+            if model not in self.loaded and len(self.loaded) < self.max_loaded:
+                self._load(model, None)
+
+    def _waiting(self):
+        return [model for model, queue in self.pending.items() if queue and model not in self.loaded]
+
+    def _worth_swap(self, model: str):
+        queue = self.pending[model]
+        return len(queue) >= self.batch_size or time.monotonic() - queue[0][2] >= self.max_wait
+
+    def _draining(self, model: str):
+        return self.served[model] >= self.batch_size and len(self._waiting()) > 0
+
+    def _schedule(self):
+        for model in self.loaded:
+            if model not in self.ready or self._draining(model):
+                continue
+            queue = self.pending.get(model)
+            while queue and self.running[model] < self.concurrency:
+                kwargs, future, _, timeout, dispatched = queue.popleft()
+                if future.done():
+                    # The caller gave up (deadline or hedge) before the request was sent
+                    continue
+                self.running[model] += 1
+                self.served[model] += 1
+                task = asyncio.ensure_future(self._run(model, kwargs, future, timeout, dispatched))
+                future.add_done_callback(lambda f, task=task: task.cancel() if f.cancelled() else None)
+
+        # The model with the most pending requests is loaded first
+        for model in sorted(self._waiting(), key=lambda m: len(self.pending[m]), reverse=True):
+            evicted = None
+            if len(self.loaded) >= self.max_loaded:
+                if not self._worth_swap(model):
+                    continue
+                idle = [
+                    m for m in self.loaded
+                    if m in self.ready and self.running[m] == 0 and (not self.pending.get(m) or self._draining(m))
+                ]
+                if not idle:
+                    break
+                evicted = idle[0]
+                self.loaded.remove(evicted)
+                self.ready.discard(evicted)
+                self.swaps += 1
+                self.unloading[evicted] = asyncio.ensure_future(self._unload(evicted))
+            self._load(model, evicted)
+
+    def _load(self, model: str, evicted: str | None):
+        self.loaded.append(model)
+        self.served[model] = 0
+        self.loads += 1
+        asyncio.ensure_future(self._warm(model, self.unloading.get(evicted)))
+
+    async def _warm(self, model: str, unloading):
+        if unloading is not None:
+            await unloading
+        try:
+            # A request without a prompt only loads the model
+            await self.client.generate(model=model, keep_alive=self.keep_alive)
+        except Exception as e:
+            print(f"Could not warm up {model}:", e)
+        self.ready.add(model)
+        self._schedule()
+
+    async def _unload(self, model: str):
+        try:
+            await self.client.generate(model=model, keep_alive=0)
+        except Exception as e:
+            print(f"Could not unload {model}:", e)
+
+    async def _run(self, model: str, kwargs: dict, future, timeout: float | None, dispatched):
+        if dispatched is not None:
+            dispatched()
+        try:
+            # The Ollama client only has a timeout per client, so the deadline of one request is enforced here
+            response = await asyncio.wait_for(self.client.chat(model=model, keep_alive=self.keep_alive, **kwargs), timeout)
+        except asyncio.CancelledError:
+            self._finish(model)
+            raise
+        except Exception as e:
+            if isinstance(e, TimeoutError):
+                e = TimeoutError(f"No response from {model} within {timeout:.0f}s")
+            if not future.done():
+                future.set_exception(e)
+            return self._finish(model)
+        if future.done():
+            if kwargs.get("stream"):
+                await response.aclose()
+            return self._finish(model)
+        if kwargs.get("stream"):
+            # The request holds its slot until the caller has read or closed the stream
+            future.set_result(ScheduledStream(self, model, response))
+        else:
+            future.set_result(response)
+            self._finish(model)
+
+    def _finish(self, model: str):
+        self.running[model] -= 1
+        self.requests[model] += 1
+        self._schedule()
+
+    def summary(self):
+        per_model = ", ".join(f"{model}: {count}" for model, count in self.requests.items())
+        return f"Ollama scheduler: {self.loads} model loads, {self.swaps} swaps, requests per model: {per_model or 'none'}"
+
+
+class ScheduledStream:
+    """The chunks of a streamed response, holding their model's slot until read to the end or closed.
+
+    Unlike an async generator, `aclose` also releases the slot when no chunk was read yet.
+    """
+
+    def __init__(self, scheduler: OllamaScheduler, model: str, chunks):
+        self.scheduler = scheduler
+        self.model = model
+        self.chunks = chunks
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self.chunks.__anext__()
+        except BaseException:
+            await self.aclose()
+            raise
+
+    async def aclose(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            await self.chunks.aclose()
+        finally:
+            self.scheduler._finish(self.model)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+
+def create_scheduler(client, config: dict, concurrency: int = 1):
+    """Creates a scheduler from the MAX_LOADED_MODELS, KEEP_ALIVE, MODEL_BATCH_SIZE and MODEL_MAX_WAIT keys of a .env config."""
+    return OllamaScheduler(
+        client,
+        max_loaded=int(config.get('MAX_LOADED_MODELS') or 1),
+        keep_alive=config.get('KEEP_ALIVE') or "30m",
+        concurrency=concurrency,
+        batch_size=int(config.get('MODEL_BATCH_SIZE') or 32),
+        max_wait=float(config.get('MODEL_MAX_WAIT') or 10),
+    )
@@ -0,0 +1,76 @@
+import asyncio
+
+# Prompt packing for the REVIEWERS. The reviews of up to REVIEW_PACK problems are asked for in one
+# request, which sends the long review rubric once and pays the per-request overhead of a small
+# Ollama model once instead of for every problem. The packed response is split back into one
+# record per Problem_ID. Problems the packed response leaves out, or a pack that fails as a whole,
+# are reviewed again with one request per problem.
+
+PACK_WAIT = 0.1 # seconds an incomplete pack waits for more problems before it is sent
+
+
+class Packer:
+    """Collects the problems of concurrent `review` calls into packs of `size`.
+
+    `review_pack` is a coroutine that takes a list of problems and returns their records by
+    Problem_ID; `review_one` takes one problem and returns its record.
+    """
+
+    def __init__(self, size: int, review_pack, review_one, wait: float = PACK_WAIT):
+        self.size = size
+        self.review_pack = review_pack
+        self.review_one = review_one
+        self.wait = wait
+        self.pending = []
+        self.timer = None
+        self.tasks = set()
+        self.packs = 0
+        self.packed = 0
+        self.fallbacks = 0
+
+    async def review(self, problem: dict):
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((problem, future))
+        if len(self.pending) >= self.size:
+            self._send()
+        elif self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(self.wait, self._send)
+        return await future
+
+    def _send(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        pack, self.pending = self.pending, []
+        if pack:
+            task = asyncio.create_task(self._run(pack))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _run(self, pack: list):
+        records = {}
+        if len(pack) > 1:
+            self.packs += 1
+            try:
+                records = await self.review_pack([problem for problem, _ in pack])
+            except Exception as e:
+                print(f"Packed review of {len(pack)} problems failed, reviewing them one by one: {e}")
+            self.packed += len(records)
+        missing = [(problem, future) for problem, future in pack if problem['Problem_ID'] not in records]
+        if len(pack) > 1:
+            self.fallbacks += len(missing)
+        for problem, future in pack:
+            if problem['Problem_ID'] in records and not future.done():
+                future.set_result(records[problem['Problem_ID']])
+        results = await asyncio.gather(*(self.review_one(problem) for problem, _ in missing), return_exceptions=True)
+        for (_, future), result in zip(missing, results):
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def summary(self):
+        return f"{self.packs} packed requests reviewed {self.packed} problems, {self.fallbacks} problems were reviewed on their own"
+
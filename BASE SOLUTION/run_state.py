@@ -0,0 +1,155 @@
+import json
+import os
+import sqlite3
+import sys
+from shards import unsharded_path
+
+STATE_FILE = "./run_state.db"
+TAIL_SIZE = 64 # bytes before the synced offset that must be unchanged for a file to count as appended to
+
+
+def read_tail(f, offset: int):
+    f.seek(max(0, offset - TAIL_SIZE))
+    return f.read(min(offset, TAIL_SIZE))
+
+def model_key(*models: str):
+    """Joins the models that produced an output, e.g. the proposer and its reviewer."""
+    return "|".join(models)
+
+
+class RunState:
+    """Index of finished problems per (stage, model), stored in a local SQLite file.
+
+    The JSONL outputs stay the source of truth. `sync_jsonl` only reads the lines appended
+    since the previous sync, so startup does not re-parse whole output files. A file that was
+    replaced (another inode) or rewritten (the bytes before the synced offset changed) is indexed
+    again from the start.
+    """
+
+    def __init__(self, path: str = STATE_FILE):
+        self.connection = sqlite3.connect(path, timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS completed (
+                stage TEXT NOT NULL,
+                model TEXT NOT NULL,
+                problem_id TEXT NOT NULL,
+                output_file TEXT NOT NULL,
+                line_offset INTEGER NOT NULL,
+                PRIMARY KEY (stage, model, problem_id)
+            );
+            CREATE INDEX IF NOT EXISTS completed_by_file ON completed (output_file);
+            CREATE TABLE IF NOT EXISTS synced_files (
+                output_file TEXT PRIMARY KEY,
+                offset INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                tail BLOB NOT NULL
+            );
+        """)
+        self.open_files = {}
+
+    def sync_jsonl(self, stage: str, model: str, output_file: str):
+        """Indexes the records appended to `output_file` since the last sync. Returns how many were added."""
+        path = os.path.abspath(output_file)
+        if not os.path.exists(path):
+            return 0
+        rows = []
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            row = self.connection.execute("SELECT offset, inode, tail FROM synced_files WHERE output_file = ?", (path,)).fetchone()
+            offset = row[0] if row else 0
+            if row and (stat.st_ino != row[1] or stat.st_size < offset or read_tail(f, offset) != row[2]):
+                # The file was replaced, truncated or rewritten, so index it again from the start
+                with self.connection:
+                    self.connection.execute("DELETE FROM completed WHERE output_file = ?", (path,))
+                if path in self.open_files:
+                    self.open_files.pop(path).close()
+                offset = 0
+            if stat.st_size == offset:
+                return 0
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # A torn last line is left for the next sync
+                    break
+                try:
+                    rows.append((stage, model, json.loads(line)['Problem_ID'], path, offset))
+                except (json.JSONDecodeError, KeyError, TypeError):
+                    pass
+                offset += len(line)
+            tail = read_tail(f, offset)
+        with self.connection:
+            # A later record for the same problem replaces the earlier one, as it would in a dict
+            self.connection.executemany("INSERT OR REPLACE INTO completed VALUES (?, ?, ?, ?, ?)", rows)
+            self.connection.execute("INSERT OR REPLACE INTO synced_files VALUES (?, ?, ?, ?)", (path, offset, stat.st_ino, tail))
+        return len(rows)
+
+    def read_record(self, stage: str, model: str, problem_id: str):
+        """Reads the output record of a finished problem straight from its JSONL file, or returns None."""
+        row = self.connection.execute(
+            "SELECT output_file, line_offset FROM completed WHERE stage = ? AND model = ? AND problem_id = ?",
+            (stage, model, problem_id)
+        ).fetchone()
+        if row is None:
+            return None
+        output_file, line_offset = row
+        if output_file not in self.open_files:
+            self.open_files[output_file] = open(output_file, 'rb')
+        f = self.open_files[output_file]
+        f.seek(line_offset)
+        return json.loads(f.readline())
+
+    def move(self, old_file: str, new_file: str):
+        """Indexes the problems finished in `old_file` from `new_file` instead, e.g. after merging shard files."""
+        old_path = os.path.abspath(old_file)
+        models = self.connection.execute("SELECT DISTINCT stage, model FROM completed WHERE output_file = ?", (old_path,)).fetchall()
+        with self.connection:
+            self.connection.execute("DELETE FROM completed WHERE output_file = ?", (old_path,))
+            self.connection.execute("DELETE FROM synced_files WHERE output_file = ?", (old_path,))
+        for stage, model in models:
+            self.sync_jsonl(stage, model, new_file)
+
+    def completed(self, stage: str, model: str):
+        """Returns the set of finished Problem_IDs for a stage."""
+        return set(row[0] for row in self.connection.execute(
+            "SELECT problem_id FROM completed WHERE stage = ? AND model = ?", (stage, model)
+        ))
+
+    def remaining(self, stage: str, model: str, problem_ids):
+        """Returns the Problem_IDs from `problem_ids` that are not finished yet, in order."""
+        done = self.completed(stage, model)
+        return [ID for ID in problem_ids if ID not in done]
+
+    def summary(self):
+        return self.connection.execute(
+            "SELECT stage, model, COUNT(*) FROM completed GROUP BY stage, model ORDER BY stage, model"
+        ).fetchall()
+
+    def close(self):
+        for f in self.open_files.values():
+            f.close()
+        self.open_files = {}
+        self.connection.close()
+
+
+def load_completed(stage: str, model: str, output_file: str):
+    """Syncs `output_file` into the run state and returns its finished Problem_IDs."""
+    state = RunState()
+    state.sync_jsonl(stage, model, output_file)
+    if unsharded_path(output_file) != output_file:
+        # A shard also skips the problems that have been merged already
+        state.sync_jsonl(stage, model, unsharded_path(output_file))
+    COMPLETED_PROBLEMS = state.completed(stage, model)
+    state.close()
+    return COMPLETED_PROBLEMS
+
+
+if __name__ == "__main__":
+    # python run_state.py                                 -> progress of every stage
+    # python run_state.py import <stage> <model> <file>   -> index an existing JSONL output
+    state = RunState()
+    if len(sys.argv) == 5 and sys.argv[1] == "import":
+        print("Imported", state.sync_jsonl(sys.argv[2], sys.argv[3], sys.argv[4]), "records")
+    for stage, model, count in state.summary():
+        print(f"{stage:<22} {model:<60} {count}")
+    state.close()
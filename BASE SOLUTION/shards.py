@@ -0,0 +1,108 @@
+import argparse
+import hashlib
+import os
+import re
+import sys
+from collections.abc import Sequence
+from dataset import open_dataset
+
+# Deterministic sharding, to spread a run over several machines. With `--shard i/N` (or SHARD=i/N
+# in the .env file) a script only works on the problems whose Problem_ID hashes to shard i of N,
+# and reads and writes its own *.shard-i-of-N.jsonl files. merge_shards.py combines them into the
+# usual files afterwards.
+
+SHARD_SUFFIX = re.compile(r"\.shard-(\d+)-of-(\d+)(?=\.[^./\\]+$)")
+
+
+def shard_of(problem_id, count: int):
+    """The shard (1 to `count`) of a problem. The hash does not depend on the machine or the Python version."""
+    digest = hashlib.sha256(str(problem_id).encode('utf-8')).digest()
+    return 1 + int.from_bytes(digest[:8], 'big') % count
+
+
+class Shard:
+    def __init__(self, index: int, count: int):
+        if not 1 <= index <= count:
+            raise ValueError(f"Shard {index}/{count} does not exist, use 1/{count} to {count}/{count}")
+        self.index = index
+        self.count = count
+
+    def __contains__(self, problem_id):
+        return shard_of(problem_id, self.count) == self.index
+
+    def __str__(self):
+        return f"{self.index}/{self.count}"
+
+    def path(self, path: str):
+        """proposed_solution_by_x.jsonl -> proposed_solution_by_x.shard-1-of-4.jsonl"""
+        root, extension = os.path.splitext(path)
+        return f"{root}.shard-{self.index}-of-{self.count}{extension}"
+
+
+class Selection(Sequence):
+    """The problems of one shard, as a view over the opened dataset."""
+
+    def __init__(self, problems, indexes: list):
+        self.problems = problems
+        self.indexes = indexes
+
+    def __len__(self):
+        return len(self.indexes)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return self.problems[self.indexes[index]]
+
+    def close(self):
+        if hasattr(self.problems, "close"):
+            self.problems.close()
+
+
+def parse_shard(value: str | None):
+    """Parses "i/N". Returns None for an empty value."""
+    if not value:
+        return None
+    match = re.fullmatch(r"\s*(\d+)\s*/\s*(\d+)\s*", value)
+    if not match:
+        raise ValueError(f"Invalid shard {value!r}, expected i/N such as 1/4")
+    return Shard(int(match.group(1)), int(match.group(2)))
+
+def unsharded_path(path: str):
+    """The file that the shards of `path` are merged into, or `path` itself."""
+    return SHARD_SUFFIX.sub("", path)
+
+
+SHARD = None
+
+
+def open_shard(config: dict, argv: list | None = None):
+    """Sets the shard of this run from `--shard i/N` on the command line or the SHARD key of a .env config."""
+    global SHARD
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--shard')
+    args, _ = parser.parse_known_args(sys.argv[1:] if argv is None else argv)
+    SHARD = parse_shard(args.shard or config.get('SHARD'))
+    if SHARD:
+        print(f"Shard {SHARD}")
+    return SHARD
+
+def shard_file(path: str):
+    """The file of this shard in place of `path`."""
+    return SHARD.path(path) if SHARD else path
+
+def select(problems):
+    """The problems of this shard."""
+    if SHARD is None:
+        return problems
+    return Selection(problems, [index for index, problem in enumerate(problems) if problem['Problem_ID'] in SHARD])
+
+def shard_input(path: str):
+    """The shard file of an earlier stage, or the whole file if that stage was not sharded."""
+    if SHARD and not os.path.exists(path):
+        return unsharded_path(path)
+    return path
+
+def open_problems(path: str):
+    """Opens the input of a stage with the problems of this shard."""
+    return select(open_dataset(shard_input(path)))
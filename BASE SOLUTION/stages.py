@@ -0,0 +1,292 @@
+from pydantic import BaseModel
+import json
+from shards import shard_file
+
+# Prompts, schemas and output records shared by the pipeline scripts and PIPELINE.py
+
+
+def sanitize_file_name(name: str):
+    _forbidden_chars = "<>:\"/\\|?* "
+    for _c in _forbidden_chars:
+        name = name.replace(_c, "_")
+    return name
+
+def reviewers_suffix(REVIEWERS: list[str]):
+    return "_and_".join([sanitize_file_name(i) for i in REVIEWERS])
+
+def proposed_solution_file(MODEL: str):
+    return shard_file(f"./SOLUTIONS/proposed_solution_by_{sanitize_file_name(MODEL)}.jsonl")
+
+def self_refined_solution_file(MODEL: str):
+    return shard_file(f"./SOLUTIONS/self_refined_solution_by_{sanitize_file_name(MODEL)}.jsonl")
+
+def review_file(MODEL: str, REVIEWER: str):
+    return shard_file(f"./REVIEWS/review_of_{sanitize_file_name(MODEL)}_by_{sanitize_file_name(REVIEWER)}.jsonl")
+
+def meta_review_file(MODEL: str, META_REVIEWER: str, REVIEWERS: list[str]):
+    return shard_file(f'./REVIEWS/meta_review_of_{sanitize_file_name(MODEL)}_by_{sanitize_file_name(META_REVIEWER)}_for_{reviewers_suffix(REVIEWERS)}.jsonl')
+
+def single_agent_review_file(MODEL: str, META_REVIEWER: str):
+    return shard_file(f'./REVIEWS/sar_of_{sanitize_file_name(MODEL)}_by_{sanitize_file_name(META_REVIEWER)}.jsonl')
+
+def single_agent_solution_file(MODEL: str, META_REVIEWER: str):
+    return shard_file(f"./SOLUTIONS/solution_by_{sanitize_file_name(MODEL)}_after_single_agent_review_by_{sanitize_file_name(META_REVIEWER)}.jsonl")
+
+def multi_agent_solution_file(MODEL: str, META_REVIEWER: str, REVIEWERS: list[str]):
+    return shard_file(f"./SOLUTIONS/solution_by_{sanitize_file_name(MODEL)}_after_multi_agent_review_by_{sanitize_file_name(META_REVIEWER)}_for_{reviewers_suffix(REVIEWERS)}.jsonl")
+
+
+# Proposer
+
+def proposer_messages(problem: str):
+    return [
+        {
+            "role": "user",
+            "content": (f"You are an expert on Physics. You solve problems step by step while maintaining logical consistency. Solve the following Physics problem: {problem}"
+
+            "Finally, write the final answers in brief. Make sure you write all equations in LaTeX.")
+        }
+    ]
+
+def self_refinement_messages(problem: str, ai_solution: str):
+    return proposer_messages(problem) + [
+        {
+            "role": "assistant",
+            "content": f"{ai_solution}"
+        },
+        {
+            "role": "user",
+            "content": "You are a Physics Professor. Outline physics principles of given problem and please check your own answers for any mistakes, then answer again."
+        }
+    ]
+
+def feedback_messages(problem: str, ai_solution: str, feedback: list[str]):
+    return proposer_messages(problem) + [
+        {
+            "role": "assistant",
+            "content": f"{ai_solution}"
+        },
+        {
+            "role": "user",
+            "content": f"I have some feedback. {' '.join(feedback)} After taking this into account, please generate the solution once again. Remember to write all equations in LaTeX"
+        }
+    ]
+
+def solution_record(problem: dict, solution: str, no_mistakes: bool = False):
+    DATA = {}
+    DATA['Problem_ID'] = problem['Problem_ID']
+    DATA['problem'] = problem['problem']
+    DATA['ai_solution'] = solution
+    DATA['elaborated_solution_steps'] = problem['elaborated_solution_steps']
+    if problem.get('final_answers_in_brief'):
+        # Lets the evaluation check the final answers locally before calling the judge
+        DATA['final_answers_in_brief'] = problem['final_answers_in_brief']
+    if no_mistakes:
+        DATA['no_mistakes'] = True
+    return DATA
+
+
+# Reviewers
+
+REVIEWER_SYSTEM_PROMPT = 'You are an expert on Physics. You are tasked to review the solutions to some problems.'
+
+class Review(BaseModel):
+  calculation_accuracy_score: float
+  calculation_mistakes: list[str]
+  formula_correctness_score: float
+  formula_mistakes: list[str]
+  logical_consistency_score: float
+  logical_mistakes: list[str]
+  completeness_score: float
+  incomplete_requirements: list[str]
+  assumption_validity_score: float
+  mistaken_assumptions: list[str]
+  clarity_and_coherence_score: float
+  incoherent_statements: list[str]
+
+class MistakeReview(BaseModel):
+  mistakes: list[str]
+
+class Identified(BaseModel):
+  Problem_ID: str
+
+# Review of one problem in a packed request. Problem_ID comes first, so the model names the problem before reviewing it
+class PackedReview(Review, Identified):
+  pass
+
+class PackedReviews(BaseModel):
+  reviews: list[PackedReview]
+
+# Shared by the single and packed review prompts. The single prompt is unchanged, so its cached responses stay valid
+REVIEW_QUESTION = "Is this solution correct? If there are any mathematical or logical mistakes, point out the mistakes briefly."
+REVIEW_RUBRIC = """ 
+    Score the solution on the following criteria:
+    Accuracy of calculations (calculation_accuracy_score): Are the numbers correct based on the formulas used?
+
+    Correctness of formulas and principles (formula_correctness_score): Are the right physics and engineering concepts being applied?
+
+    Logical consistency (logical_consistency_score): Does the reasoning flow correctly from one step to the next?
+
+    Completeness (completeness_score): Does it address all parts of the question?
+
+    Assumptions made (assumption_validity_score): Are any new assumptions introduced, and are they reasonable?
+
+    Clarty and coherence (clarity_and_coherence_score): Is the explanation clear and easy to understand?
+
+    Each score must be between 0 and 10.
+
+    Also, point out the mistakes made in each of the categories mentioned.
+    """
+
+def review_messages(problem: dict):
+    PROMPT = (f"Problem: {problem['problem']} \n\n Solution: {problem['ai_solution']} \n\n {REVIEW_QUESTION}" + REVIEW_RUBRIC)
+    return [
+        {
+            'role': 'system',
+            'content': REVIEWER_SYSTEM_PROMPT,
+        },
+        {
+            'role': 'user',
+            'content': PROMPT,
+        }
+    ]
+
+def packed_review_messages(problems: list[dict]):
+    """One request for the reviews of several problems, with the rubric sent once instead of once per problem."""
+    PROMPT = f"Below are {len(problems)} problems, each with a solution. Review every solution on its own.\n\n"
+    for problem in problems:
+        PROMPT += f"Problem_ID: {problem['Problem_ID']} \n Problem: {problem['problem']} \n\n Solution: {problem['ai_solution']} \n\n"
+    PROMPT += f"For each solution: {REVIEW_QUESTION}" + REVIEW_RUBRIC
+    PROMPT += "Return one review for every Problem_ID above, in the same order, each with its Problem_ID."
+    return [
+        {
+            'role': 'system',
+            'content': REVIEWER_SYSTEM_PROMPT,
+        },
+        {
+            'role': 'user',
+            'content': PROMPT,
+        }
+    ]
+
+def final_score(review: dict):
+    return (
+        review['calculation_accuracy_score'] * 0.3
+        + review['formula_correctness_score'] * 0.25
+        + review['logical_consistency_score'] * 0.25
+        + review['completeness_score'] * 0.1
+        + review['assumption_validity_score'] * 0.05
+        + review['clarity_and_coherence_score'] * 0.05
+    )
+
+def score_review(content: str, ID: str):
+    review = Review.model_validate_json(content)
+    review = review.model_dump()
+    review['Problem_ID'] = ID
+    review['final_score'] = final_score(review)
+    return review
+
+def packed_review_records(content: str, IDs: list[str]):
+    """Splits a packed review into the records `score_review` would have written, by Problem_ID.
+
+    Reviews of unknown or repeated IDs are dropped, so a problem the model skipped or mixed up is
+    missing from the result and can be reviewed on its own.
+    """
+    records = {}
+    for review in PackedReviews.model_validate_json(content).reviews:
+        ID = review.Problem_ID.strip()
+        if ID not in IDs or ID in records:
+            continue
+        record = review.model_dump(exclude={'Problem_ID'})
+        record['Problem_ID'] = ID
+        record['final_score'] = final_score(record)
+        records[ID] = record
+    return records
+
+META_REVIEW_CRITERIA = """Accuracy of calculations: Are the numbers correct based on the formulas used?
+
+Correctness of formulas and principles: Are the right physics and engineering concepts being applied?
+
+Logical consistency: Does the reasoning flow correctly from one step to the next?
+
+Completeness: Does it address all parts of the question?
+
+Assumptions made: Are any new assumptions introduced, and are they reasonable?
+
+Clarty and coherence: Is the explanation clear and easy to understand?
+
+"""
+
+def meta_review_messages(problem: dict, reviews: dict):
+    """`reviews` maps each reviewer model to its review, without the Problem_ID."""
+    PROMPT = (f"Problem: {problem['problem']} \n\n I had an LLM generate a solution to this. Solution: {problem['ai_solution']}  \n\n I had three other LLMs review this solution and point out any mistakes."
+                    "Are there any mistakes in the solution? If there are, list them down. Consider the following:"
+                    + META_REVIEW_CRITERIA + """Each score must be between 0 and 10.
+
+Also, the mistakes made in each of the categories have been mentioned.
+"""
+        )
+    for REVIEWER, review in reviews.items():
+        PROMPT += f"{REVIEWER}  had the following review:"
+        PROMPT += f"{json.dumps(review)}"
+    PROMPT += "Now, from these lists of mistakes, based on the problem and solution, finalize a list of mistakes which you think are actually mistakes."
+    return [
+        {
+            'role': 'system',
+            'content': REVIEWER_SYSTEM_PROMPT,
+        },
+        {
+            'role': 'user',
+            'content': PROMPT,
+        }
+    ]
+
+def merged_meta_review_messages(problem: dict, merged: list, reviewer_count: int):
+    """Like `meta_review_messages`, with only the mistakes merged by `mistake_merge.merge_mistakes` instead of the full reviews."""
+    PROMPT = (f"Problem: {problem['problem']} \n\n I had an LLM generate a solution to this. Solution: {problem['ai_solution']}  \n\n I had {reviewer_count} other LLMs review this solution and point out any mistakes."
+                    "Are there any mistakes in the solution? If there are, list them down. Consider the following:"
+                    + META_REVIEW_CRITERIA
+                    + "The reviewers found the following mistakes. Mistakes found by several reviewers are listed once, "
+                    f"with the number of the {reviewer_count} reviewers that found them:\n"
+        )
+    for mistake in merged:
+        PROMPT += f"- [{len(mistake['reviewers'])}/{reviewer_count}] ({', '.join(mistake['categories'])}) {mistake['mistake']}\n"
+    if not merged:
+        PROMPT += "- None\n"
+    PROMPT += "Now, from this list of mistakes, based on the problem and solution, finalize a list of mistakes which you think are actually mistakes."
+    return [
+        {
+            'role': 'system',
+            'content': REVIEWER_SYSTEM_PROMPT,
+        },
+        {
+            'role': 'user',
+            'content': PROMPT,
+        }
+    ]
+
+def single_agent_review_messages(problem: dict):
+    PROMPT = (f"Problem: {problem['problem']} \n\n I had an LLM generate a solution to this. Solution: {problem['ai_solution']}  \n"
+                    "Are there any mistakes in the solution? If there are, list them down. Consider the following:"
+                    + META_REVIEW_CRITERIA
+        )
+    return [
+        {
+            'role': 'system',
+            'content': REVIEWER_SYSTEM_PROMPT,
+        },
+        {
+            'role': 'user',
+            'content': PROMPT,
+        }
+    ]
+
+def mistake_record(content: str, ID: str):
+    review = MistakeReview.model_validate_json(content)
+    review = review.model_dump()
+    review['Problem_ID'] = ID
+    return review
+
+def accepted_record(ID: str, reviewers: list[str]):
+    """Meta-review record of a solution that the review cascade accepted without the META_REVIEWER."""
+    return {'mistakes': [], 'Problem_ID': ID, 'accepted_by': reviewers}
@@ -0,0 +1,191 @@
+import re
+import sqlite3
+import threading
+import time
+
+# Streaming mode of llm_calls. A streamed response is collected chunk by chunk, so that it can be
+# cut off once it has used its token budget or once its final answers section is complete, and
+# the text received so far is saved. A call that runs past its deadline keeps its partial text in
+# partial_outputs.db, and the next attempt asks the model to continue from there instead of
+# starting over.
+
+PARTIALS_FILE = "./partial_outputs.db"
+SAVE_INTERVAL = 2 # seconds between saves of the partial text of a running stream
+CONTINUE_PROMPT = "Your previous answer was cut off. Continue exactly where it stopped, without repeating anything."
+
+FINAL_ANSWERS_HEADING = re.compile(r"^[ \t>]*(?:(?P<hashes>#{1,6})[ \t]*|\*\*[ \t]*)?final[ \t]+answers?\b.*$", re.IGNORECASE | re.MULTILINE)
+# A heading or a horizontal rule. Bold lines such as "**(b)**" are parts of the answers, not breaks
+SECTION_BREAK = re.compile(r"^[ \t]*(?:(?P<hashes>#{1,6})[ \t]+\S|-{3,}[ \t]*$)", re.MULTILINE)
+THINK_BLOCK = re.compile(r"<think>.*?(?:</think>|\Z)", re.DOTALL)
+
+
+def strip_thinking(text: str):
+    """Drops <think> blocks, including one that is still open, so only the visible answer is checked."""
+    text = re.sub(r"<think>.*?</think>", "", text, flags=re.DOTALL)
+    start = text.find("<think>")
+    return text if start < 0 else text[:start]
+
+def final_answers_section(text: str):
+    """Returns the text after the last "Final answers" heading, or None if there is none."""
+    headings = list(FINAL_ANSWERS_HEADING.finditer(strip_thinking(text)))
+    if not headings:
+        return None
+    return strip_thinking(text)[headings[-1].end():]
+
+def has_final_answers(text: str):
+    section = final_answers_section(text)
+    return section is not None and section.strip() != ""
+
+def final_answers_end(text: str):
+    """Position in `text` where the final answers section ends, or None while it has not ended.
+
+    The section ends at the first horizontal rule, or heading of the same or a higher level as its
+    own, after its first content. Any heading ends a section that has a bold or plain heading.
+    """
+    thinking = [match.span() for match in THINK_BLOCK.finditer(text)]
+    def visible(position):
+        return not any(start <= position < end for start, end in thinking)
+    headings = [match for match in FINAL_ANSWERS_HEADING.finditer(text) if visible(match.start())]
+    if not headings:
+        return None
+    heading = headings[-1]
+    level = len(heading.group("hashes") or "######")
+    content = re.compile(r"\S").search(text, heading.end())
+    if content is None:
+        return None
+    for match in SECTION_BREAK.finditer(text, content.end()):
+        if visible(match.start()) and (match.group("hashes") is None or len(match.group("hashes")) <= level):
+            return match.start()
+    return None
+
+def final_answers_complete(text: str):
+    """True once the final answers section has content and a new section or a rule has started after it."""
+    return final_answers_end(text) is not None
+
+
+class PartialStore:
+    """Partial text of interrupted streams, keyed by the cache key of the request."""
+
+    def __init__(self, path: str = PARTIALS_FILE):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS partials (key TEXT PRIMARY KEY, text TEXT NOT NULL, updated REAL NOT NULL)")
+
+    def get(self, key: str):
+        with self.lock:
+            row = self.connection.execute("SELECT text FROM partials WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else ""
+
+    def put(self, key: str, text: str):
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO partials VALUES (?, ?, ?)", (key, text, time.time()))
+
+    def delete(self, key: str):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM partials WHERE key = ?", (key,))
+
+
+class StreamOptions:
+    """`max_tokens` is the budget of one call, counted in streamed chunks. `store` keeps partial text."""
+
+    def __init__(self, enabled: bool = False, max_tokens: int | None = None, store: PartialStore | None = None):
+        self.enabled = enabled
+        self.max_tokens = max_tokens
+        self.store = store
+
+
+def open_stream_options(config: dict):
+    """Creates the options from the STREAM, STREAM_MAX_TOKENS and PARTIALS_FILE keys of a .env config."""
+    enabled = (config.get('STREAM') or "").lower() in ("1", "true", "yes")
+    return StreamOptions(
+        enabled=enabled,
+        max_tokens=int(config['STREAM_MAX_TOKENS']) if config.get('STREAM_MAX_TOKENS') else None,
+        store=PartialStore(config.get('PARTIALS_FILE') or PARTIALS_FILE) if enabled else None,
+    )
+
+
+class StreamCollector:
+    """Collects the chunks of one streamed call.
+
+    `add` returns True when the stream should be closed: the token budget is used up, the
+    deadline has passed, or (with `early_stop`) the final answers section is complete. With
+    `resume`, the partial text of an earlier attempt is continued, and the text received so far
+    is saved every SAVE_INTERVAL seconds.
+    """
+
+    def __init__(self, options: StreamOptions, key: str, timeout: float | None = None, early_stop: bool = False, resume: bool = True):
+        self.options = options
+        self.key = key
+        self.store = options.store if resume else None
+        self.early_stop = early_stop
+        self.timeout = timeout
+        self.prefix = self.store.get(key) if self.store else ""
+        self.parts = []
+        self.tokens = 0
+        self.first_token = None
+        self.stopped = None
+        self.start()
+
+    def start(self):
+        """Starts the clock of the deadline and the time to the first token, e.g. when a scheduler sends the request."""
+        self.started = time.monotonic()
+        self.deadline = self.started + self.timeout if self.timeout else None
+        self.last_save = self.started
+
+    def remaining(self):
+        """Seconds until the deadline, or None without one."""
+        return None if self.deadline is None else max(0.0, self.deadline - time.monotonic())
+
+    def messages(self, messages: list):
+        """The request messages, asking the model to continue the partial text if there is one."""
+        if not self.prefix:
+            return messages
+        return messages + [{"role": "assistant", "content": self.prefix}, {"role": "user", "content": CONTINUE_PROMPT}]
+
+    @property
+    def text(self):
+        return self.prefix + "".join(self.parts)
+
+    def add(self, text: str | None, thinking: str | None = None):
+        if not text and not thinking:
+            return False
+        now = time.monotonic()
+        if self.first_token is None:
+            self.first_token = now - self.started
+        self.tokens += 1
+        if text:
+            self.parts.append(text)
+        if self.store and text and now - self.last_save >= SAVE_INTERVAL:
+            self.last_save = now
+            self.store.put(self.key, self.text)
+        if self.options.max_tokens and self.tokens >= self.options.max_tokens:
+            self.stopped = "budget"
+        elif self.deadline and now >= self.deadline:
+            self.stopped = "deadline"
+        elif self.early_stop and text and "\n" in text and final_answers_complete(self.text):
+            self.stopped = "early_stop"
+        return self.stopped is not None
+
+    def finish(self):
+        """Returns the response text, or raises if the stream was cut off before it had an answer."""
+        text = self.text
+        if self.stopped in ("budget", "deadline") and not (self.early_stop and has_final_answers(text)):
+            if self.stopped == "deadline":
+                # Kept for the next attempt, which continues it instead of starting over
+                self.fail()
+                raise TimeoutError(f"Stream passed its deadline after {self.tokens} tokens")
+            if self.store:
+                self.store.delete(self.key)
+            raise ValueError(f"Stream used its budget of {self.options.max_tokens} tokens without an answer")
+        if self.store:
+            self.store.delete(self.key)
+        if self.stopped == "early_stop":
+            # Drop the start of the section that came after the final answers
+            text = text[:final_answers_end(text)].rstrip()
+        return text
+
+    def fail(self):
+        """Saves the text received so far after the stream failed."""
+        if self.store and self.parts:
+            self.store.put(self.key, self.text)
@@ -1,15 +1,188 @@
+import argparse
 import json
+import os
 import random
+import sqlite3
+from dataset import scan_records
 
-minimum = int(input("Enter minimum difficulty (1-10): ") or 1)
-maximum = int(input("Enter maximum difficulty (1-10): ") or 10)
-with open("test.json", 'r', encoding='utf-8') as f:
-    problems = json.load(f)
-    problems = [i for i in problems if i['problem_difficulty'] >= minimum and i["problem_difficulty"] <= maximum]
-    print(len(problems), "problems found")
+# python testmaker.py -n 100 --min-difficulty 4 --max-difficulty 7 --seed 1
+# python testmaker.py -n 5 --stratify category --seed 1
 
-n = int(input("How many problems do you want? "))
-problems = random.sample(problems, min(n, len(problems)))
+INPUT_FILE = "test.json"
+OUTPUT_FILE = "test set.json"
+STRATA = ("category", "problem_difficulty", "steps")
 
-with open("test set.json", 'w', encoding='utf-8') as f:
-    json.dump(problems, f, indent=4, ensure_ascii=False)
\ No newline at end of file
+
+def get_index_path(input_file: str):
+    return os.path.splitext(input_file)[0] + ".index.db"
+
+
+class ProblemIndex:
+    """SQLite index over the metadata of a dataset file, so sampling never parses the problems themselves.
+
+    Each problem is stored with its position, byte offset and length in the dataset file together
+    with `category`, `problem_difficulty`, `steps` and its `soft_labels`. The index is rebuilt
+    whenever the dataset file changes.
+    """
+
+    def __init__(self, input_file: str = INPUT_FILE, path: str | None = None, rebuild: bool = False):
+        self.input_file = input_file
+        self.connection = sqlite3.connect(path or get_index_path(input_file))
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS source (
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS problems (
+                position INTEGER PRIMARY KEY,
+                problem_id TEXT NOT NULL,
+                category TEXT,
+                problem_difficulty INTEGER,
+                steps INTEGER,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS soft_labels (
+                position INTEGER NOT NULL,
+                label TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS problems_by_difficulty ON problems (problem_difficulty);
+            CREATE INDEX IF NOT EXISTS problems_by_category ON problems (category, problem_difficulty);
+            CREATE INDEX IF NOT EXISTS soft_labels_by_label ON soft_labels (label);
+        """)
+        if rebuild or self.is_stale():
+            self.build()
+
+    def file_signature(self):
+        stat = os.stat(self.input_file)
+        return os.path.abspath(self.input_file), stat.st_size, stat.st_mtime_ns
+
+    def is_stale(self):
+        row = self.connection.execute("SELECT path, size, mtime FROM source").fetchone()
+        return row is None or tuple(row) != self.file_signature()
+
+    def build(self):
+        print("Indexing", self.input_file)
+        with open(self.input_file, "rb") as f:
+            data = f.read()
+        problems = []
+        labels = []
+        for position, (offset, length, record) in enumerate(scan_records(data)):
+            problems.append((
+                position, record['Problem_ID'], record.get('category'),
+                record.get('problem_difficulty'), record.get('steps'), offset, length
+            ))
+            labels += [(position, label) for label in record.get('soft_labels') or []]
+        with self.connection:
+            self.connection.execute("DELETE FROM source")
+            self.connection.execute("DELETE FROM problems")
+            self.connection.execute("DELETE FROM soft_labels")
+            self.connection.executemany("INSERT INTO problems VALUES (?, ?, ?, ?, ?, ?, ?)", problems)
+            self.connection.executemany("INSERT INTO soft_labels VALUES (?, ?)", labels)
+            self.connection.execute("INSERT INTO source VALUES (?, ?, ?)", self.file_signature())
+        print(len(problems), "problems indexed")
+
+    def select(self, min_difficulty=1, max_difficulty=10, categories=None, labels=None, min_steps=None, max_steps=None, stratify=None):
+        """Returns [(stratum, position)] of the matching problems, ordered by position."""
+        if stratify is not None and stratify not in STRATA:
+            raise ValueError(f"Cannot stratify by {stratify!r}. Use one of {', '.join(STRATA)}.")
+        query = f"SELECT {stratify or 'NULL'}, position FROM problems WHERE problem_difficulty BETWEEN ? AND ?"
+        params = [min_difficulty, max_difficulty]
+        if categories:
+            query += f" AND category IN ({', '.join('?' * len(categories))})"
+            params += categories
+        if min_steps is not None:
+            query += " AND steps >= ?"
+            params.append(min_steps)
+        if max_steps is not None:
+            query += " AND steps <= ?"
+            params.append(max_steps)
+        # A problem has to carry every requested soft label
+        for label in labels or []:
+            query += " AND position IN (SELECT position FROM soft_labels WHERE label = ?)"
+            params.append(label)
+        return self.connection.execute(query + " ORDER BY position", params).fetchall()
+
+    def counts(self, field: str):
+        if field not in STRATA:
+            raise ValueError(f"Unknown field {field!r}. Use one of {', '.join(STRATA)}.")
+        return self.connection.execute(f"SELECT {field}, COUNT(*) FROM problems GROUP BY {field} ORDER BY {field}").fetchall()
+
+    def read(self, positions: list[int]):
+        """Reads only the given problems from the dataset file, in the given order."""
+        rows = {}
+        for i in range(0, len(positions), 500):
+            chunk = positions[i:i + 500]
+            query = f"SELECT position, offset, length FROM problems WHERE position IN ({', '.join('?' * len(chunk))})"
+            rows.update((position, (offset, length)) for position, offset, length in self.connection.execute(query, chunk))
+        problems = []
+        with open(self.input_file, "rb") as f:
+            for position in positions:
+                offset, length = rows[position]
+                f.seek(offset)
+                problems.append(json.loads(f.read(length)))
+        return problems
+
+    def close(self):
+        self.connection.close()
+
+
+def sample(rows: list, n: int, seed: int, stratified: bool):
+    """Picks n problems overall, or n from every stratum when `stratified`, reproducibly for a given seed."""
+    rng = random.Random(seed)
+    if not stratified:
+        return rng.sample([position for _, position in rows], min(n, len(rows)))
+    strata = {}
+    for stratum, position in rows:
+        strata.setdefault(stratum, []).append(position)
+    picked = []
+    for stratum in sorted(strata, key=lambda stratum: (stratum is None, str(stratum or ""))):
+        picked += rng.sample(strata[stratum], min(n, len(strata[stratum])))
+        print(f"{stratum}: {min(n, len(strata[stratum]))} of {len(strata[stratum])}")
+    return picked
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sample a test set from the PhysicsEval dataset.")
+    parser.add_argument("-n", "--count", type=int, help="Problems to pick, or problems per stratum with --stratify")
+    parser.add_argument("--input", default=INPUT_FILE, help="Dataset file, a JSON array or JSON Lines")
+    parser.add_argument("--output", default=OUTPUT_FILE)
+    parser.add_argument("--min-difficulty", type=int, default=1)
+    parser.add_argument("--max-difficulty", type=int, default=10)
+    parser.add_argument("--category", action="append", help="Only this category. Can be repeated")
+    parser.add_argument("--label", action="append", help="Only problems with this soft label. Can be repeated")
+    parser.add_argument("--min-steps", type=int)
+    parser.add_argument("--max-steps", type=int)
+    parser.add_argument("--stratify", choices=STRATA, help="Pick --count problems from every value of this field")
+    parser.add_argument("--seed", type=int, help="Random seed. A random one is chosen and printed if omitted")
+    parser.add_argument("--rebuild-index", action="store_true", help="Rebuild the index even if the dataset is unchanged")
+    parser.add_argument("--counts", choices=STRATA, help="Only print how many problems there are per value of this field")
+    args = parser.parse_args()
+
+    index = ProblemIndex(args.input, rebuild=args.rebuild_index)
+    if args.counts:
+        for value, count in index.counts(args.counts):
+            print(f"{value}: {count}")
+        index.close()
+        return
+    if args.count is None:
+        parser.error("-n/--count is required")
+
+    rows = index.select(
+        args.min_difficulty, args.max_difficulty, args.category, args.label,
+        args.min_steps, args.max_steps, args.stratify
+    )
+    print(len(rows), "problems found")
+    seed = args.seed if args.seed is not None else random.randrange(2 ** 32)
+    print("Seed:", seed)
+    problems = index.read(sample(rows, args.count, seed, args.stratify is not None))
+    index.close()
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(problems, f, indent=4, ensure_ascii=False)
+    print(len(problems), "problems written to", args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import pytest
+
+from answer_check import check_answers, normalize, quantities
+
+
+def solution(final_answers: str):
+    return "Step 1: ...\n\n## Final Answers\n" + final_answers
+
+
+@pytest.mark.parametrize("reference, answers, verdict", [
+    ("5 m", "d = 5.01 m", "match"),
+    ("5 m", "d = 8 m", "mismatch"),
+    ("500 g", "m = 0.5 kg", "match"),
+    ("-3 N", "F = 3 N", "unknown"), # only the direction differs
+    ("v = 5 m/s, t = 2 s", "v = 5 m/s, t = 2 s", "match"),
+    ("(3 m, 4 m)", "(3 m, 4 m)", "match"),
+    (["(a) 5 m/s", "(b) 2 s"], "(a) v = 5 m/s\n(b) t = 2 s", "match"),
+    (["(a) 5 m/s", "(b) 2 s"], "(b) t = 2 s\n(a) v = 5 m/s", "match"),
+    (["(a) 5 m/s", "(b) 2 s"], "(a) v = 5 m/s\n(b) t = 3 s", "partial"),
+    ("x = v_0 t", "x = v_0 t", "match"),
+])
+def test_verdicts(reference, answers, verdict):
+    assert check_answers(solution(answers), reference)["verdict"] == verdict
+
+def test_boxed_answer_without_final_answers_section():
+    assert check_answers(r"so $\boxed{9.81 \text{ m/s}^2}$", r"9.8 \, \text{m/s}^2")["verdict"] == "match"
+
+def test_no_final_answers():
+    result = check_answers("I could not solve it.", "5 m")
+    assert result["verdict"] == "unknown"
+    assert result["reason"] == "no final answers"
+
+def test_a_list_of_values_does_not_match_one_of_them():
+    result = check_answers(solution("The distances are 1 2 3 4 5 6 7 8 9 10 m"), "7 m")
+    assert result["verdict"] == "unknown"
+    assert result["reason"] == "numbers do not pair up"
+
+@pytest.mark.parametrize("answers", ["The answer is not 5 m", r"x \neq 5 m"])
+def test_a_ruled_out_value_does_not_match(answers):
+    result = check_answers(solution(answers), "5 m")
+    assert result["verdict"] == "unknown"
+    assert result["reason"] == "an answer rules a value out"
+
+def test_answers_are_paired_by_position_without_labels():
+    # Both values appear, but each is given for the other quantity
+    assert check_answers(solution("v = 2 s\nt = 5 m/s"), ["5 m/s", "2 s"])["verdict"] == "unknown"
+
+def test_missing_answer_does_not_pair_up():
+    result = check_answers(solution("v = 5 m/s"), ["5 m/s", "2 s"])
+    assert result["verdict"] == "unknown"
+    assert result["reason"] == "answers do not pair up"
+
+def test_latex_is_normalized_to_si():
+    [quantity] = quantities(r"E = \frac{1}{2} \times 10^{3}\,\text{kJ}")
+    assert quantity.si == pytest.approx(5e5)
+    assert normalize(r"\frac{1}{2}") == "((1)/(2))"
@@ -0,0 +1,82 @@
+import json
+import os
+
+from dataset import Dataset, convert, get_columns_path, open_dataset, remove_columns, update
+
+RECORDS = [
+    {"Problem_ID": "1", "Problem_Statement": "A ball is dropped.", "steps": 3},
+    {"Problem_ID": "2", "Problem_Statement": "Ein Wagen fährt los.", "tags": ["µ", None]},
+    {"Problem_ID": "3", "steps": 0},
+]
+
+
+def write_jsonl(path, records, mode="w"):
+    with open(path, mode, encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+def read_all(directory):
+    with Dataset(directory) as dataset:
+        return [dict(record) for record in dataset]
+
+
+def test_json_array_round_trip(tmp_path):
+    source = tmp_path / "test set.json"
+    source.write_text(json.dumps(RECORDS, indent=2, ensure_ascii=False), encoding="utf-8")
+    directory = convert(str(source))
+    assert directory == get_columns_path(str(source))
+    assert read_all(directory) == RECORDS
+    with open_dataset(str(source)) as dataset:
+        assert dataset.find("2")["tags"] == ["µ", None]
+        assert "steps" not in dataset[1]
+        assert list(dataset.column("steps")) == [3, None, 0]
+        assert dataset.find("missing") is None
+
+def test_jsonl_update_appends_new_lines(tmp_path):
+    source = str(tmp_path / "solutions.jsonl")
+    write_jsonl(source, RECORDS[:2])
+    directory = update(source)
+    assert read_all(directory) == RECORDS[:2]
+
+    # A new field, a line that is not JSON, and a torn last line
+    write_jsonl(source, [RECORDS[2], {"Problem_ID": "4", "ai_solution": "x"}], mode="a")
+    with open(source, "a", encoding="utf-8") as f:
+        f.write("not json\n")
+        f.write('{"Problem_ID": "5", "ai_sol')
+    update(source)
+    assert read_all(directory) == RECORDS + [{"Problem_ID": "4", "ai_solution": "x"}]
+
+    # The torn line is picked up once it is complete
+    with open(source, "a", encoding="utf-8") as f:
+        f.write('ution": "y"}\n')
+    update(source)
+    assert read_all(directory)[-1] == {"Problem_ID": "5", "ai_solution": "y"}
+
+def test_rewritten_file_is_converted_again(tmp_path):
+    source = str(tmp_path / "solutions.jsonl")
+    write_jsonl(source, RECORDS)
+    directory = update(source)
+    write_jsonl(source, [{"Problem_ID": "9"}])
+    update(source)
+    assert read_all(directory) == [{"Problem_ID": "9"}]
+
+def test_open_dataset_keeps_its_records_through_an_update(tmp_path):
+    source = str(tmp_path / "solutions.jsonl")
+    write_jsonl(source, RECORDS[:1])
+    with open_dataset(source) as dataset:
+        write_jsonl(source, RECORDS[1:], mode="a")
+        update(source)
+        assert len(dataset) == 1
+        assert dict(dataset[0]) == RECORDS[0]
+        write_jsonl(source, [{"Problem_ID": "9"}])
+        update(source)
+        assert dict(dataset[0]) == RECORDS[0]
+    assert read_all(get_columns_path(source)) == [{"Problem_ID": "9"}]
+
+def test_remove_columns(tmp_path):
+    source = str(tmp_path / "solutions.jsonl")
+    write_jsonl(source, RECORDS)
+    directory = update(source)
+    remove_columns(source)
+    assert not os.path.exists(directory)
+    assert not os.path.exists(directory + ".lock")
@@ -0,0 +1,44 @@
+import json
+import pytest
+from jsonl_writer import JsonlWriter, close_writer, open_writer, read_jsonl
+
+
+def test_torn_last_line_is_cut_on_open(tmp_path):
+    path = tmp_path / "out.jsonl"
+    path.write_bytes(b'{"Problem_ID": "1"}\n{"Problem_ID": "2", "ans')
+    writer = JsonlWriter(str(path))
+    writer.write({"Problem_ID": "3"})
+    writer.close()
+    assert path.read_bytes() == b'{"Problem_ID": "1"}\n{"Problem_ID": "3"}\n'
+
+def test_file_of_one_torn_line_is_emptied(tmp_path):
+    path = tmp_path / "out.jsonl"
+    path.write_bytes(b'{"Problem_ID": "1"')
+    JsonlWriter(str(path)).close()
+    assert path.read_bytes() == b""
+
+def test_torn_line_of_another_process_is_cut_before_a_flush(tmp_path):
+    path = tmp_path / "out.jsonl"
+    writer = JsonlWriter(str(path))
+    writer.write({"Problem_ID": "1"})
+    writer.flush()
+    with open(path, 'ab') as f:
+        f.write(b'{"Problem_ID": "killed')
+    writer.write({"Problem_ID": "2"})
+    writer.close()
+    assert [record["Problem_ID"] for record in read_jsonl(str(path))] == ["1", "2"]
+
+def test_read_jsonl_skips_a_torn_last_line(tmp_path):
+    path = tmp_path / "out.jsonl"
+    path.write_text(json.dumps({"Problem_ID": "1"}) + "\n" + '{"Problem_ID"', encoding='utf-8')
+    assert list(read_jsonl(str(path))) == [{"Problem_ID": "1"}]
+
+def test_open_writer_rejects_another_ensure_ascii(tmp_path):
+    path = str(tmp_path / "out.jsonl")
+    writer = open_writer(path, ensure_ascii=False)
+    try:
+        assert open_writer(path, ensure_ascii=False) is writer
+        with pytest.raises(ValueError):
+            open_writer(path)
+    finally:
+        close_writer(path)
@@ -0,0 +1,36 @@
+from metrics import Metrics, quantile, read_series
+
+
+def test_processes_add_to_the_same_file(tmp_path):
+    path = str(tmp_path / "review.json")
+    first, second = Metrics("review", path), Metrics("review", path)
+    first.observe("ollama", "m", 0.2, prompt_tokens=10)
+    second.observe("ollama", "m", 0.3, prompt_tokens=20)
+    second.observe("ollama", "m", 5, "timeout")
+    first.flush()
+    second.flush()
+    first.observe("ollama", "m", 0.2)
+    first.flush()
+    [item] = read_series(path)
+    assert item["requests"]["ok"] == 3
+    assert item["requests"]["timeout"] == 1
+    assert item["prompt_tokens"] == 30
+    # Only the successful calls are in the latency histogram
+    assert sum(item["latency"]) == 3
+    # A flush takes in what the other process saved
+    assert sum(first.series[("review", "ollama", "m")]["latency"]) == 3
+
+def test_earlier_runs_are_loaded(tmp_path):
+    path = str(tmp_path / "review.json")
+    metrics = Metrics("review", path)
+    for _ in range(20):
+        metrics.observe("ollama", "m", 1.2)
+    metrics.flush()
+    assert Metrics("review", path).quantile("ollama", "m", 0.5, min_samples=20) == metrics.quantile("ollama", "m", 0.5)
+    assert Metrics("review", path).quantile("ollama", "m", 0.5, min_samples=21) is None
+
+def test_quantile_interpolates_in_its_bucket():
+    counts = [0] * 21
+    counts[5] = 10 # (0.6, 1]
+    assert quantile(counts, 0.5) == 0.8
+    assert quantile([0] * 21, 0.5) is None
@@ -0,0 +1,51 @@
+from mistake_merge import merge_mistakes, normalize, open_merge
+
+
+def test_same_mistake_in_other_words_is_merged():
+    reviews = {
+        "a": {"formula_mistakes": ["Used $\\sin\\theta$ instead of cos theta for the normal force"]},
+        "b": {"formula_mistakes": ["The solution used sin theta instead of \\cos\\theta for the normal forces."]},
+        "c": {"calculation_mistakes": ["Arithmetic slip: 9.8 * 2 is 19.6, not 18.6"]},
+    }
+    merged = merge_mistakes(reviews)
+    assert len(merged) == 2
+    assert merged[0]["reviewers"] == ["a", "b"]
+    assert merged[0]["categories"] == ["formula_mistakes"]
+    assert merged[0]["mistake"] == reviews["b"]["formula_mistakes"][0]
+    assert merged[1]["reviewers"] == ["c"]
+
+def test_exact_duplicates_across_fields_and_no_mistake_entries():
+    reviews = {
+        "a": {"logical_mistakes": ["Energy is not conserved."], "calculation_mistakes": ["None"]},
+        "b": {"mistaken_assumptions": ["energy is NOT conserved"], "formula_mistakes": ["N/A", "No mistakes found."]},
+    }
+    merged = merge_mistakes(reviews)
+    assert merged == [{"mistake": "Energy is not conserved.", "reviewers": ["a", "b"],
+                       "categories": ["logical_mistakes", "mistaken_assumptions"]}]
+
+def test_different_mistakes_stay_apart():
+    reviews = {
+        "a": {"calculation_mistakes": ["The mass should be 2 kg"], "logical_mistakes": ["Friction was ignored on the incline"]},
+        "b": {"calculation_mistakes": ["The acceleration should be 3 m/s^2"]},
+    }
+    merged = merge_mistakes(reviews)
+    assert len(merged) == 3
+    assert [record["reviewers"] for record in merged] == [["a"], ["a"], ["b"]]
+
+def test_normalize_drops_latex_and_case():
+    assert normalize("$\\left(F = ma\\right)$") == normalize("f = MA")
+
+def test_open_merge():
+    assert open_merge({}) is None
+    assert open_merge({"MERGE_MISTAKES": "true"}) == 0.6
+    assert open_merge({"MERGE_MISTAKES": "1", "MERGE_SIMILARITY": "0.8"}) == 0.8
+
+def test_mistakes_with_different_values_stay_apart():
+    reviews = {
+        "a": {"calculation_mistakes": ["mass should be 2 kg"]},
+        "b": {"calculation_mistakes": ["mass should be 3 kg"]},
+        "c": {"calculation_mistakes": ["The mass should be 2.0 kg"]},
+    }
+    merged = merge_mistakes(reviews)
+    assert [(record["mistake"], record["reviewers"]) for record in merged] == [
+        ("The mass should be 2.0 kg", ["a", "c"]), ("mass should be 3 kg", ["b"])]
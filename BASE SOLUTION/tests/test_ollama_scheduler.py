@@ -0,0 +1,57 @@
+import asyncio
+import types
+from ollama_scheduler import OllamaScheduler
+
+
+class Client:
+    async def ps(self):
+        return types.SimpleNamespace(models=[])
+
+    async def generate(self, **kwargs):
+        pass
+
+    async def chat(self, stream=False, **kwargs):
+        async def chunks():
+            yield "a"
+            yield "b"
+        return chunks()
+
+
+class CancelOnResponse(OllamaScheduler):
+    """Cancels `caller` right after its stream was handed over, before the caller resumes."""
+    caller = None
+
+    async def _run(self, *args):
+        await super()._run(*args)
+        if self.caller is not None:
+            self.caller.cancel()
+
+
+async def read(scheduler):
+    stream = await asyncio.wait_for(scheduler.chat("m", messages=[], stream=True), 1)
+    return [chunk async for chunk in stream]
+
+
+def test_stream_closed_before_reading_releases_its_slot():
+    async def main():
+        scheduler = OllamaScheduler(Client(), max_wait=0)
+        stream = await scheduler.chat("m", messages=[], stream=True)
+        await stream.aclose()
+        assert scheduler.running["m"] == 0
+        assert await read(scheduler) == ["a", "b"]
+        assert scheduler.running["m"] == 0
+    asyncio.run(main())
+
+def test_caller_cancelled_after_the_response_releases_its_slot():
+    async def main():
+        scheduler = CancelOnResponse(Client(), max_wait=0)
+        await scheduler.prefetch(["m"])
+        scheduler.caller = asyncio.ensure_future(scheduler.chat("m", messages=[], stream=True))
+        try:
+            await scheduler.caller
+        except asyncio.CancelledError:
+            pass
+        scheduler.caller = None
+        assert scheduler.running["m"] == 0
+        assert await read(scheduler) == ["a", "b"]
+    asyncio.run(main())
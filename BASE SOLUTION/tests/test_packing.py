@@ -0,0 +1,44 @@
+import asyncio
+from packing import Packer
+
+
+def run(size, review_pack, count=5):
+    singles = []
+
+    async def review_one(problem):
+        singles.append(problem['Problem_ID'])
+        return f"one {problem['Problem_ID']}"
+
+    async def main():
+        packer = Packer(size, review_pack, review_one, wait=0.01)
+        results = await asyncio.gather(*(packer.review({"Problem_ID": str(i)}) for i in range(count)))
+        return packer, results
+
+    packer, results = asyncio.run(main())
+    return packer, results, singles
+
+
+def test_concurrent_problems_are_packed():
+    packs = []
+
+    async def review_pack(problems):
+        packs.append(len(problems))
+        return {problem['Problem_ID']: f"pack {problem['Problem_ID']}" for problem in problems}
+
+    packer, results, singles = run(2, review_pack)
+    # The last problem waits for the timer and goes on its own
+    assert packs == [2, 2]
+    assert results == ["pack 0", "pack 1", "pack 2", "pack 3", "one 4"]
+    assert singles == ["4"]
+    assert (packer.packs, packer.packed, packer.fallbacks) == (2, 4, 0)
+
+def test_missing_problems_and_failed_packs_fall_back():
+    async def review_pack(problems):
+        if problems[0]['Problem_ID'] == "2":
+            raise ValueError("unparsable response")
+        return {problems[0]['Problem_ID']: "pack"}
+
+    packer, results, singles = run(2, review_pack, count=4)
+    assert results == ["pack", "one 1", "one 2", "one 3"]
+    assert sorted(singles) == ["1", "2", "3"]
+    assert (packer.packs, packer.packed, packer.fallbacks) == (2, 1, 3)
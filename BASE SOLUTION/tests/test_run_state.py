@@ -0,0 +1,49 @@
+import json
+import os
+
+from run_state import RunState
+
+
+def write(path, ids, mode="w"):
+    with open(path, mode, encoding="utf-8") as f:
+        for ID in ids:
+            f.write(json.dumps({"Problem_ID": ID, "ai_solution": f"solution {ID}"}) + "\n")
+
+
+def test_sync_reads_only_appended_lines(tmp_path):
+    output = str(tmp_path / "out.jsonl")
+    state = RunState(str(tmp_path / "run_state.db"))
+    write(output, ["1", "2"])
+    assert state.sync_jsonl("propose", "m", output) == 2
+    write(output, ["3"], mode="a")
+    with open(output, "a", encoding="utf-8") as f:
+        f.write('{"Problem_ID": "4"') # torn
+    assert state.sync_jsonl("propose", "m", output) == 1
+    assert state.completed("propose", "m") == {"1", "2", "3"}
+    assert state.read_record("propose", "m", "3")["ai_solution"] == "solution 3"
+    assert state.read_record("propose", "m", "4") is None
+    state.close()
+
+def test_replaced_file_is_indexed_again(tmp_path):
+    output = str(tmp_path / "out.jsonl")
+    state = RunState(str(tmp_path / "run_state.db"))
+    write(output, ["1", "2"])
+    state.sync_jsonl("propose", "m", output)
+    assert state.read_record("propose", "m", "2")["Problem_ID"] == "2"
+    # A longer file put in place of the old one, so the size alone does not show it
+    write(output + ".tmp", ["7", "8", "9"])
+    os.replace(output + ".tmp", output)
+    assert state.sync_jsonl("propose", "m", output) == 3
+    assert state.completed("propose", "m") == {"7", "8", "9"}
+    assert state.read_record("propose", "m", "8")["Problem_ID"] == "8"
+    state.close()
+
+def test_file_rewritten_in_place_is_indexed_again(tmp_path):
+    output = str(tmp_path / "out.jsonl")
+    state = RunState(str(tmp_path / "run_state.db"))
+    write(output, ["1", "2"])
+    state.sync_jsonl("propose", "m", output)
+    write(output, ["5", "6", "7"])
+    assert state.sync_jsonl("propose", "m", output) == 3
+    assert state.completed("propose", "m") == {"5", "6", "7"}
+    state.close()
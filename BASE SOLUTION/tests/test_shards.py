@@ -0,0 +1,24 @@
+import pytest
+from shards import parse_shard, shard_of, unsharded_path
+
+
+def test_shard_of_is_stable():
+    # Fixed values: shards written on one machine are merged on another, maybe with another Python
+    assert [shard_of(problem_id, 4) for problem_id in ["1", "2", "abc", 17]] == [2, 3, 3, 4]
+    assert shard_of("1", 7) == 3
+    assert shard_of(17, 4) == shard_of("17", 4)
+
+def test_shards_cover_every_problem_once():
+    shards = [parse_shard(f"{index}/3") for index in range(1, 4)]
+    for problem_id in range(200):
+        assert sum(problem_id in shard for shard in shards) == 1
+    counts = [sum(shard_of(problem_id, 3) == index for problem_id in range(3000)) for index in range(1, 4)]
+    assert min(counts) > 900
+
+def test_shard_paths():
+    shard = parse_shard("2/4")
+    assert shard.path("proposed_solution_by_x.jsonl") == "proposed_solution_by_x.shard-2-of-4.jsonl"
+    assert unsharded_path("proposed_solution_by_x.shard-2-of-4.jsonl") == "proposed_solution_by_x.jsonl"
+    assert parse_shard("") is None
+    with pytest.raises(ValueError):
+        parse_shard("5/4")
@@ -0,0 +1,47 @@
+from streaming import StreamCollector, StreamOptions, final_answers_complete, final_answers_end
+
+MULTI_PART = """## Solution
+Work.
+
+## Final Answers
+**(a)**
+$v = 3$ m/s
+### (b)
+$a = 2$ m/s$^2$
+**(c)**
+$t = 1.5$ s
+"""
+
+
+def collect(chunks):
+    collector = StreamCollector(StreamOptions(), "key", early_stop=True)
+    for chunk in chunks:
+        if collector.add(chunk):
+            break
+    return collector
+
+def test_parts_of_the_final_answers_do_not_end_it():
+    assert not final_answers_complete(MULTI_PART)
+    collector = collect(line + "\n" for line in MULTI_PART.splitlines())
+    assert collector.stopped is None
+    assert collector.finish() == MULTI_PART
+
+def test_final_answers_end_at_the_next_section_of_the_same_level():
+    text = MULTI_PART + "\n## Verification\nChecking (a) again.\n## More\n"
+    assert final_answers_end(text) == len(MULTI_PART) + 1
+    collector = collect(line + "\n" for line in text.splitlines())
+    assert collector.stopped == "early_stop"
+    assert collector.finish() == MULTI_PART.rstrip()
+
+def test_final_answers_end_at_a_rule():
+    text = MULTI_PART + "---\nNotes\n"
+    assert text[:final_answers_end(text)] == MULTI_PART
+
+def test_bold_heading_ends_at_any_heading():
+    text = "**Final Answer:**\n**(a)** 3 m/s\n**(b)** 2 s\n### Check\n"
+    assert text[:final_answers_end(text)] == "**Final Answer:**\n**(a)** 3 m/s\n**(b)** 2 s\n"
+
+def test_headings_inside_thinking_do_not_count():
+    text = "<think>\n## Final Answers\nmaybe 3\n## Next\n</think>\n## Final Answers\n3 m/s\n"
+    assert not final_answers_complete(text)
+    assert final_answers_complete(text + "# Done\n")
@@ -0,0 +1,10 @@
+from testmaker import sample
+
+
+def test_stratified_sample_with_empty_and_missing_strata():
+    # An empty category sorts among the names instead of being compared with 0
+    rows = [("Mechanics", 0), ("", 1), (None, 2), ("Optics", 3), ("Mechanics", 4)]
+    picked = sample(rows, 1, seed=0, stratified=True)
+    assert len(picked) == 4
+    assert picked == sample(rows, 1, seed=0, stratified=True)
+    assert picked[0] == 1 and picked[-1] == 2
@@ -0,0 +1,451 @@
+import argparse
+import json
+import logging
+import math
+import os
+import re
+import sys
+import time
+import zlib
+from pathlib import Path
+import numpy as np
+
+# Shared components live in the BASE SOLUTION directory
+sys.path.append(str(Path(__file__).resolve().parent.parent / "BASE SOLUTION"))
+from dataset import open_dataset
+from shards import unsharded_path
+
+# Aggregates the evaluations of every run in this directory. The scores of all evaluated_*
+# journals (or evaluated_*.json files without a journal) are held in NumPy columns, with the model,
+# variant and reviewer setup taken from the file name and the category and difficulty of each
+# problem from the dataset. Means, paired deltas and bootstrap confidence intervals are computed
+# over these columns for all groups at once. The columns and the read position in every journal
+# are saved in STATE_FILE, so a later run (or --watch) only reads the evaluations added since.
+#   python analytics.py                                 (means by model and variant)
+#   python analytics.py --by category difficulty
+#   python analytics.py --pair proposed multi_agent     (paired deltas on the same problems)
+#   python analytics.py --watch 60                      (updates while eval_ollama.py runs)
+
+SCORE_FIELDS = ("mathematical_accuracy", "logical_consistency", "completeness", "clarity_and_coherence",
+                "formulas_principles", "assumptions_made", "overall_correctness")
+SHORT_NAMES = {"mathematical_accuracy": "math", "logical_consistency": "logic", "completeness": "complete",
+               "clarity_and_coherence": "clarity", "formulas_principles": "formulas", "assumptions_made": "assume",
+               "overall_correctness": "overall"}
+GROUP_KEYS = ("model", "variant", "setup", "category", "difficulty", "judge", "verdict")
+JOURNAL_SUFFIX = ".journal" # as in eval_ollama.py
+JUDGE_MODEL = "gemini-2.5-pro" # judge of the items without a judge_model field
+DATASET_FILE = "../BASE SOLUTION/test set.json" # category and problem_difficulty of the problems
+STATE_FILE = "analytics_state.npz"
+STATE_VERSION = 2
+TAIL_SIZE = 64 # bytes before the read position of a journal that are checked for a rewrite
+RESAMPLES = 2000
+CONFIDENCE = 0.95
+BOOTSTRAP_CHUNK = 4_000_000 # value counts drawn at once (resamples x groups x distinct values)
+SEED = 0
+UNKNOWN = "unknown"
+# Variant, model and reviewer setup of a solution file, by the file names of stages.py
+VARIANTS = [
+    ("proposed", re.compile(r"^proposed_solution_by_(?P<model>.+)$")),
+    ("self_refined", re.compile(r"^self_refined_solution_by_(?P<model>.+)$")),
+    ("single_agent", re.compile(r"^solution_by_(?P<model>.+?)_after_single_agent_review_by_(?P<setup>.+)$")),
+    ("multi_agent", re.compile(r"^solution_by_(?P<model>.+?)_after_multi_agent_review_by_(?P<setup>.+)$")),
+]
+
+logger = logging.getLogger(__name__)
+
+
+def tail_checksum(f, offset: int):
+    """A checksum of the TAIL_SIZE bytes before `offset`, which change if the file was rewritten."""
+    f.seek(max(0, offset - TAIL_SIZE))
+    return zlib.crc32(f.read(min(offset, TAIL_SIZE)))
+
+def parse_name(path: Path):
+    """(model, variant, setup) of an evaluated_* file. Shards count as the file they are merged into."""
+    name = Path(unsharded_path(str(path))).stem
+    name = name[len("evaluated_"):] if name.startswith("evaluated_") else name
+    for variant, pattern in VARIANTS:
+        match = pattern.match(name)
+        if match:
+            return match.group("model"), variant, match.groupdict().get("setup") or ""
+    return name, "other", ""
+
+
+class Labels:
+    """String table: each distinct label gets an integer code."""
+
+    def __init__(self, names=()):
+        self.names = list(names)
+        self.codes = {name: code for code, name in enumerate(self.names)}
+
+    def code(self, name: str):
+        code = self.codes.get(name)
+        if code is None:
+            code = self.codes[name] = len(self.names)
+            self.names.append(name)
+        return code
+
+    def array(self):
+        return np.array(self.names, dtype=str)
+
+
+class Analytics:
+    """Columns of the evaluations in a directory, updated from the journals as they grow."""
+
+    def __init__(self, dataset_path: str | None = None):
+        self.labels = {key: Labels() for key in ("model", "variant", "setup", "category", "problem", "judge", "verdict")}
+        self.count = 0
+        self.columns = {key: np.zeros(0, dtype=np.int32) for key in ("model", "variant", "setup", "problem", "judge", "verdict")}
+        self.scores = np.zeros((0, len(SCORE_FIELDS)))
+        # Per problem code: category code and difficulty, -1 and NaN until looked up
+        self.category = np.zeros(0, dtype=np.int32)
+        self.difficulty = np.zeros(0)
+        self.rows = {} # (model, variant, setup, problem) codes -> row, so the latest evaluation of a problem wins
+        self.sources = {} # file name -> [read offset or size, mtime in ns, inode, checksum of the bytes before the offset]
+        self.dataset_path = dataset_path
+        self.dataset = None
+
+    def _grow(self, needed: int):
+        capacity = len(self.scores)
+        if needed <= capacity:
+            return
+        capacity = max(needed, 2 * capacity, 1024)
+        for key, column in self.columns.items():
+            self.columns[key] = np.resize(column, capacity)
+        self.scores = np.resize(self.scores, (capacity, len(SCORE_FIELDS)))
+
+    def _problem(self, problem_id: str, item: dict):
+        code = self.labels["problem"].code(problem_id)
+        if code >= len(self.category):
+            size = max(code + 1, 2 * len(self.category), 1024)
+            self.category = np.concatenate([self.category, np.full(size - len(self.category), -1, dtype=np.int32)])
+            self.difficulty = np.concatenate([self.difficulty, np.full(size - len(self.difficulty), np.nan)])
+        if self.category[code] < 0:
+            self.lookup(code, item)
+        return code
+
+    def lookup(self, code: int, item: dict):
+        """Sets the category and difficulty of a problem, from the item or else from the dataset."""
+        problem = item
+        if 'category' not in item and self.dataset_path and os.path.exists(self.dataset_path):
+            if self.dataset is None:
+                self.dataset = open_dataset(self.dataset_path)
+            problem = self.dataset.find(self.labels["problem"].names[code]) or {}
+        category = problem.get('category')
+        self.category[code] = self.labels["category"].code(str(category) if category is not None else UNKNOWN)
+        try:
+            self.difficulty[code] = float(problem.get('problem_difficulty'))
+        except (TypeError, ValueError):
+            self.difficulty[code] = np.nan
+
+    def add(self, item: dict, arm: tuple):
+        """Adds the evaluation of one item. Returns False for items without one, e.g. skipped by --prescreen skip."""
+        evaluation = item.get('gemini_evaluation')
+        problem_id = item.get('Problem_ID')
+        if not isinstance(evaluation, dict) or not problem_id:
+            return False
+        try:
+            scores = [float(evaluation[field]) for field in SCORE_FIELDS]
+        except (KeyError, TypeError, ValueError):
+            return False
+        key = arm + (self._problem(problem_id, item),)
+        row = self.rows.get(key)
+        if row is None:
+            row = self.rows[key] = self.count
+            self._grow(self.count + 1)
+            self.count += 1
+        for column, code in zip(("model", "variant", "setup", "problem"), key):
+            self.columns[column][row] = code
+        self.columns["judge"][row] = self.labels["judge"].code(item.get('judge_model') or JUDGE_MODEL)
+        self.columns["verdict"][row] = self.labels["verdict"].code((item.get('answer_check') or {}).get('verdict') or "not checked")
+        self.scores[row] = scores
+        return True
+
+    def _arm(self, path: Path):
+        model, variant, setup = parse_name(path)
+        return self.labels["model"].code(model), self.labels["variant"].code(variant), self.labels["setup"].code(setup)
+
+    def _read_journal(self, path: Path):
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            offset, _, inode, checksum = self.sources.get(path.name, (0, 0, 0, 0))
+            if offset and (stat.st_ino != inode or stat.st_size < offset or tail_checksum(f, offset) != checksum):
+                # Replaced or rewritten since the last read. Reading it again is safe, the latest evaluation of a problem wins
+                logger.info(f"{path.name} was rewritten, reading it again.")
+                offset = 0
+            if stat.st_size == offset:
+                return 0
+            f.seek(offset)
+            data = f.read(stat.st_size - offset)
+            # Only complete lines; a line that is still being written is read next time
+            end = data.rfind(b"\n") + 1
+            self.sources[path.name] = [offset + end, stat.st_mtime_ns, stat.st_ino, tail_checksum(f, offset + end)]
+        arm = self._arm(path)
+        added = 0
+        for line in data[:end].splitlines():
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(item, dict):
+                added += self.add(item, arm)
+        return added
+
+    def _read_json(self, path: Path):
+        stat = path.stat()
+        if self.sources.get(path.name) == [stat.st_size, stat.st_mtime_ns, stat.st_ino, 0]:
+            return 0
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                items = json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            logger.warning(f"Could not read {path}: {e}")
+            return 0
+        arm = self._arm(path)
+        added = sum(self.add(item, arm) for item in items if isinstance(item, dict)) if isinstance(items, list) else 0
+        self.sources[path.name] = [stat.st_size, stat.st_mtime_ns, stat.st_ino, 0]
+        return added
+
+    def refresh(self, directory: Path):
+        """Reads the evaluations added to the directory since the last refresh. Returns their number."""
+        added = 0
+        journals = sorted(directory.glob(f"evaluated_*{JOURNAL_SUFFIX}"))
+        for path in journals:
+            added += self._read_journal(path)
+        journal_names = {path.with_suffix('.json').name for path in journals}
+        for path in sorted(directory.glob("evaluated_*.json")):
+            if path.name not in journal_names:
+                added += self._read_json(path)
+        return added
+
+    def frame(self):
+        """The columns of the evaluations as arrays of codes, with `scores` (evaluations x SCORE_FIELDS)."""
+        problem = self.columns["problem"][:self.count]
+        frame = {key: column[:self.count] for key, column in self.columns.items()}
+        frame["category"] = self.category[problem]
+        difficulty = self.difficulty[problem]
+        frame["difficulty"] = np.where(np.isnan(difficulty), -1, np.round(np.nan_to_num(difficulty))).astype(np.int64)
+        frame["scores"] = self.scores[:self.count]
+        return frame
+
+    def label(self, key: str, code: int):
+        if key == "difficulty":
+            return UNKNOWN if code < 0 else str(code)
+        return self.labels[key].names[code]
+
+    def save(self, path: str):
+        arrays = {f"column_{key}": column[:self.count] for key, column in self.columns.items()}
+        arrays.update({f"labels_{key}": labels.array() for key, labels in self.labels.items()})
+        count = len(self.labels["problem"].names)
+        temp_path = path + ".tmp.npz"
+        np.savez(
+            temp_path, version=np.array(STATE_VERSION), scores=self.scores[:self.count],
+            category=self.category[:count], difficulty=self.difficulty[:count],
+            source_names=np.array(list(self.sources), dtype=str),
+            source_positions=np.array(list(self.sources.values()), dtype=np.int64).reshape(-1, 4),
+            dataset=np.array(self.dataset_path or ""), **arrays,
+        )
+        os.replace(temp_path, path)
+
+    def load(self, path: str):
+        """Restores the state saved by `save`. Returns False if there is none or it can not be used."""
+        if not os.path.exists(path):
+            return False
+        try:
+            with np.load(path) as state:
+                if int(state["version"]) != STATE_VERSION or str(state["dataset"]) != (self.dataset_path or ""):
+                    return False
+                labels = {key: Labels(state[f"labels_{key}"].tolist()) for key in self.labels}
+                columns = {key: state[f"column_{key}"].astype(np.int32) for key in self.columns}
+                scores = state["scores"].astype(np.float64)
+                category = state["category"].astype(np.int32)
+                difficulty = state["difficulty"].astype(np.float64)
+                positions = state["source_positions"].tolist()
+                sources = {name: [int(value) for value in position] for name, position in zip(state["source_names"].tolist(), positions)}
+        except (OSError, KeyError, ValueError) as e:
+            logger.warning(f"Could not load {path}, reading every file again: {e}")
+            return False
+        self.labels, self.columns, self.scores = labels, columns, scores
+        self.category, self.difficulty, self.sources = category, difficulty, sources
+        self.count = len(self.scores)
+        keys = np.stack([self.columns[key] for key in ("model", "variant", "setup", "problem")], axis=1).tolist()
+        self.rows = {tuple(key): row for row, key in enumerate(keys)}
+        return True
+
+    def close(self):
+        if self.dataset is not None:
+            self.dataset.close()
+            self.dataset = None
+
+
+def group_index(frame: dict, by: list[str]):
+    """The distinct combinations of the `by` columns (groups x len(by)) and the group of every evaluation."""
+    if not by:
+        return np.zeros((1, 0), dtype=np.int64), np.zeros(len(frame["scores"]), dtype=np.int64)
+    stacked = np.stack([frame[key].astype(np.int64) for key in by], axis=1)
+    keys, inverse = np.unique(stacked, axis=0, return_inverse=True)
+    return keys, inverse.reshape(-1)
+
+def group_means(scores: np.ndarray, inverse: np.ndarray, groups: int):
+    """Number of evaluations and mean of every score in each group."""
+    counts = np.bincount(inverse, minlength=groups)
+    sums = np.zeros((groups, scores.shape[1]))
+    np.add.at(sums, inverse, scores)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return counts, sums / counts[:, None]
+
+def bootstrap_ci(values: np.ndarray, inverse: np.ndarray, groups: int, resamples: int = RESAMPLES,
+                 confidence: float = CONFIDENCE, seed: int = SEED):
+    """Bootstrap confidence interval of the mean of `values` in every group, all groups at once.
+
+    Scores take only a few distinct values, so resampling a group with replacement comes down to
+    drawing how often each distinct value occurs, from a multinomial over the group's value counts.
+    That costs resamples x groups x distinct values instead of resamples x evaluations.
+    """
+    low, high = np.full(groups, np.nan), np.full(groups, np.nan)
+    if len(values) == 0 or resamples <= 0:
+        return low, high
+    distinct, value_index = np.unique(values, return_inverse=True)
+    counts = np.zeros((groups, len(distinct)))
+    np.add.at(counts, (inverse, value_index.reshape(-1)), 1)
+    present = np.flatnonzero(counts.sum(axis=1))
+    counts = counts[present]
+    sizes = counts.sum(axis=1).astype(np.int64)
+    rng = np.random.default_rng(seed)
+    means = np.empty((resamples, len(present)))
+    chunk = max(1, BOOTSTRAP_CHUNK // counts.size)
+    for start in range(0, resamples, chunk):
+        size = min(chunk, resamples - start)
+        draws = rng.multinomial(sizes, counts / sizes[:, None], size=(size, len(present)))
+        means[start:start + size] = draws @ distinct / sizes
+    tail = (1 - confidence) / 2 * 100
+    low[present], high[present] = np.percentile(means, [tail, 100 - tail], axis=0)
+    return low, high
+
+def summarize(analytics: Analytics, by: list[str], metric: str = "overall_correctness", resamples: int = RESAMPLES,
+              confidence: float = CONFIDENCE):
+    """One row per group of `by`: its labels, the number of evaluations, the mean scores and the CI of `metric`."""
+    frame = analytics.frame()
+    keys, inverse = group_index(frame, by)
+    counts, means = group_means(frame["scores"], inverse, len(keys))
+    low, high = bootstrap_ci(frame["scores"][:, SCORE_FIELDS.index(metric)], inverse, len(keys), resamples, confidence)
+    rows = []
+    for group, key in enumerate(keys):
+        if not counts[group]:
+            continue
+        row = {column: analytics.label(column, int(code)) for column, code in zip(by, key)}
+        row["n"] = int(counts[group])
+        row.update({field: float(means[group, i]) for i, field in enumerate(SCORE_FIELDS)})
+        row["ci_low"], row["ci_high"] = float(low[group]), float(high[group])
+        rows.append(row)
+    return rows
+
+def paired_deltas(analytics: Analytics, base: str, other: str, metric: str = "overall_correctness",
+                  resamples: int = RESAMPLES, confidence: float = CONFIDENCE):
+    """Difference in `metric` between two variants of the same model on the problems both evaluated.
+
+    One row per model and pair of setups, e.g. each multi_agent review setup against the proposed solutions.
+    """
+    frame = analytics.frame()
+    variants = analytics.labels["variant"].codes
+    if base not in variants or other not in variants:
+        return []
+    values = frame["scores"][:, SCORE_FIELDS.index(metric)]
+    arms = np.unique(np.stack([frame["model"], frame["variant"], frame["setup"]], axis=1), axis=0)
+    pairs, deltas, groups = [], [], []
+    for model, base_variant, base_setup in arms[arms[:, 1] == variants[base]]:
+        for _, _, other_setup in arms[(arms[:, 0] == model) & (arms[:, 1] == variants[other])]:
+            base_rows = np.flatnonzero((frame["model"] == model) & (frame["variant"] == base_variant) & (frame["setup"] == base_setup))
+            other_rows = np.flatnonzero((frame["model"] == model) & (frame["variant"] == variants[other]) & (frame["setup"] == other_setup))
+            _, base_index, other_index = np.intersect1d(frame["problem"][base_rows], frame["problem"][other_rows],
+                                                        assume_unique=True, return_indices=True)
+            if not len(base_index):
+                continue
+            base_values, other_values = values[base_rows[base_index]], values[other_rows[other_index]]
+            delta = other_values - base_values
+            groups.append(np.full(len(delta), len(pairs)))
+            deltas.append(delta)
+            pairs.append({
+                "model": analytics.label("model", int(model)), "base": base, "base_setup": analytics.label("setup", int(base_setup)),
+                "other": other, "other_setup": analytics.label("setup", int(other_setup)), "n": len(delta),
+                "base_mean": float(base_values.mean()), "other_mean": float(other_values.mean()), "delta": float(delta.mean()),
+                "better": int((delta > 0).sum()), "worse": int((delta < 0).sum()),
+            })
+    if pairs:
+        low, high = bootstrap_ci(np.concatenate(deltas), np.concatenate(groups), len(pairs), resamples, confidence)
+        for pair, pair_low, pair_high in zip(pairs, low, high):
+            pair["ci_low"], pair["ci_high"] = float(pair_low), float(pair_high)
+    return pairs
+
+
+def format_value(value):
+    if isinstance(value, float):
+        return "nan" if math.isnan(value) else f"{value:.2f}"
+    return str(value)
+
+def print_table(rows: list, columns: list, headers: list | None = None):
+    if not rows:
+        print("No evaluations.")
+        return
+    headers = headers or columns
+    cells = [[format_value(row[column]) for column in columns] for row in rows]
+    widths = [max(len(header), *(len(line[i]) for line in cells)) for i, header in enumerate(headers)]
+    print("  ".join(header.ljust(width) for header, width in zip(headers, widths)))
+    for line in cells:
+        print("  ".join(cell.ljust(width) for cell, width in zip(line, widths)))
+
+def report(analytics: Analytics, args):
+    results = {"evaluations": analytics.count}
+    percent = f"{args.confidence:.0%}"
+    if args.pair:
+        pairs = paired_deltas(analytics, args.pair[0], args.pair[1], args.metric, args.resamples, args.confidence)
+        results["pairs"] = pairs
+        print(f"\n{args.metric}: {args.pair[1]} - {args.pair[0]} on the same problems, {percent} CI")
+        columns = ["model", "base_setup", "other_setup", "n", "base_mean", "other_mean", "delta", "ci_low", "ci_high", "better", "worse"]
+        print_table(pairs, columns)
+    else:
+        rows = summarize(analytics, args.by, args.metric, args.resamples, args.confidence)
+        results["groups"] = rows
+        print(f"\nMean scores by {', '.join(args.by) or 'all'} ({analytics.count} evaluations), {percent} CI of {args.metric}")
+        columns = list(args.by) + ["n"] + list(SCORE_FIELDS) + ["ci_low", "ci_high"]
+        print_table(rows, columns, list(args.by) + ["n"] + [SHORT_NAMES[field] for field in SCORE_FIELDS] + ["ci_low", "ci_high"])
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Aggregate the evaluations of every evaluated_* file in the current directory.")
+    parser.add_argument("--by", nargs="*", choices=GROUP_KEYS, default=["model", "variant"], help="Columns to group the means by.")
+    parser.add_argument("--pair", nargs=2, metavar=("BASE", "OTHER"),
+                        help="Paired deltas of OTHER against BASE, variants such as proposed, self_refined, single_agent, multi_agent.")
+    parser.add_argument("--metric", choices=SCORE_FIELDS, default="overall_correctness", help="Score of the confidence intervals and deltas.")
+    parser.add_argument("--resamples", type=int, default=RESAMPLES, help="Bootstrap resamples, 0 for no confidence intervals.")
+    parser.add_argument("--confidence", type=float, default=CONFIDENCE)
+    parser.add_argument("--dataset", default=DATASET_FILE, help="Dataset with the category and problem_difficulty of the problems.")
+    parser.add_argument("--json", help="Also save the results to this file.")
+    parser.add_argument("--rescan", action="store_true", help=f"Ignore {STATE_FILE} and read every file again.")
+    parser.add_argument("--watch", type=float, help="Read new evaluations and report again every this many seconds.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    analytics = Analytics(args.dataset)
+    if not args.rescan and analytics.load(STATE_FILE):
+        logger.info(f"Loaded {analytics.count} evaluations from {STATE_FILE}.")
+    try:
+        while True:
+            started = time.monotonic()
+            added = analytics.refresh(Path('.'))
+            if added or not args.watch:
+                logger.info(f"Read {added} new evaluations in {time.monotonic() - started:.2f}s, {analytics.count} in total.")
+                analytics.save(STATE_FILE)
+                report(analytics, args)
+            if not args.watch:
+                break
+            time.sleep(args.watch)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        analytics.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,53 @@
 import os
 import json
+import argparse
 import requests
+from requests.adapters import HTTPAdapter
 import logging
 import time
 from pathlib import Path
 import re
-import itertools
+import threading
+import email.utils
+from collections import Counter, deque
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Shared components live in the BASE SOLUTION directory
+sys.path.append(str(Path(__file__).resolve().parent.parent / "BASE SOLUTION"))
+from llm_cache import LLMCache, CACHE_MODES
+from dataset import open_dataset
+from metrics import Metrics
+from jsonl_writer import open_writer
+from answer_check import check_answers, CLEAR_VERDICTS
+import shards
 
 # Configuration
-GEMINI_API_URL = "https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent?key={api_key}"
+GEMINI_BASE_URL = "https://generativelanguage.googleapis.com/v1beta"
+GEMINI_API_URL = "{base_url}/models/{model}:generateContent" # The key is sent in the x-goog-api-key header
 MODEL_NAME = "gemini-2.5-pro"
+FAST_MODEL_NAME = "gemini-2.5-flash" # Judge of the items whose final answers clearly match or not, with --prescreen tier
 LOG_FILE = "evaluation_run.log"
 MAX_API_RETRIES = 3
 API_RETRY_DELAY = 5 # Increased delay to be safer
 API_TIMEOUT = 180
 API_KEY_FILE = "api_keys.txt"
-SAVE_CHECKPOINT_INTERVAL = 10
+GENERATION_CONFIG = {"temperature": 0.1, "responseMimeType": "application/json"}
+CACHE_FILE = "llm_cache.db" # Judge responses, reused when the same solution is evaluated again
+JOURNAL_SUFFIX = ".journal" # Append-only JSON lines log of evaluations, next to each evaluated_*.json
+WORKERS_PER_KEY = 2 # Concurrent requests per API key
+RATE_LIMIT_BACKOFF = 20 # Cooldown of a rate limited key without a Retry-After, doubled on each 429 in a row
+MAX_KEY_COOLDOWN = 320 # seconds
+KEY_RPM = 0 # Requests per minute per key, 0 for no limit (--rpm)
+KEY_TPM = 0 # Tokens per minute per key, 0 for no limit (--tpm)
+RESPONSE_TOKENS = 1000 # Expected tokens of a judge response, counted against the TPM budget until the real usage is known
+BATCH_STATE_FILE = "gemini_batches.json" # Submitted batch jobs, so a restarted run polls them instead of resubmitting
+BATCH_SIZE = 500 # Requests per batch job
+BATCH_POLL_INTERVAL = 60 # seconds
+MAX_POLL_FAILURES = 10 # Failed polls in a row after which a batch job is given up and its items are sent one request each
+METRICS_FILE = "METRICS/evaluate.json" # Latency, token and retry metrics of the judge calls, added to on every run
+PRESCREEN_MODES = ("off", "record", "tier", "skip")
+BATCH_DONE_STATES = ("BATCH_STATE_SUCCEEDED", "BATCH_STATE_FAILED", "BATCH_STATE_CANCELLED", "BATCH_STATE_EXPIRED")
 
 # Set up logging
 logging.basicConfig(
@@ -30,11 +62,100 @@ logger = logging.getLogger(__name__)
 
 # Global API key management
 API_KEYS = []
-current_api_key_iterator = None
-
-def load_api_keys(file_path):
-    """Loads API keys and creates a cyclical iterator."""
-    global API_KEYS, current_api_key_iterator
+KEYS = None # KeyPool of API_KEYS
+CACHE = LLMCache(mode="bypass")
+BASE_URL = GEMINI_BASE_URL # Overridden by --base-url, e.g. for a local mock server
+METRICS = Metrics("evaluate")
+SESSIONS = {} # One keep-alive session per API key, shared by every file of the run
+PRESCREEN = "record" # What the local final answer check decides, see --prescreen
+ANSWERS = None # Dataset with the final_answers_in_brief of the problems, for solution files without them (--answers)
+VERDICTS = Counter() # Final answer verdicts of this run
+session_lock = threading.Lock()
+
+class KeyPool:
+    """The API keys with their cooldown, per minute budgets and health. `acquire` hands out the key
+    with the most free capacity, so a rate limited or failing key only holds back its own requests."""
+
+    def __init__(self, keys: list, rpm: int = KEY_RPM, tpm: int = KEY_TPM, max_in_flight: int = WORKERS_PER_KEY):
+        self.keys = {key: {"cooldown": 0.0, "requests": deque(), "tokens": deque(), "in_flight": 0, "errors": 0, "rate_limits": 0}
+                     for key in keys}
+        self.evicted = set()
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_in_flight = max_in_flight
+        self.condition = threading.Condition()
+
+    def live(self) -> list:
+        with self.condition:
+            return [key for key in self.keys if key not in self.evicted]
+
+    def wait_time(self, state: dict, now: float, tokens: int) -> float | None:
+        """Seconds until a key can take a request of `tokens`, or None if it has to wait for one of its requests to finish."""
+        while state["requests"] and state["requests"][0] <= now - 60:
+            state["requests"].popleft()
+        while state["tokens"] and state["tokens"][0][0] <= now - 60:
+            state["tokens"].popleft()
+        wait = max(0.0, state["cooldown"] - now)
+        if self.rpm and len(state["requests"]) >= self.rpm:
+            wait = max(wait, state["requests"][0] + 60 - now)
+        used = sum(count for _, count in state["tokens"])
+        if self.tpm and state["tokens"] and used + tokens > self.tpm:
+            for sent, count in state["tokens"]:
+                used -= count
+                if used + tokens <= self.tpm:
+                    break
+            wait = max(wait, sent + 60 - now)
+        if wait == 0 and state["in_flight"] >= self.max_in_flight:
+            return None
+        return wait
+
+    def acquire(self, tokens: int) -> str | None:
+        """Blocks until a key has capacity and returns it, or returns None once every key has been evicted."""
+        with self.condition:
+            while True:
+                live = [key for key in self.keys if key not in self.evicted]
+                if not live:
+                    return None
+                now = time.monotonic()
+                waits = {key: self.wait_time(self.keys[key], now, tokens) for key in live}
+                ready = [key for key, wait in waits.items() if wait == 0]
+                if ready:
+                    key = min(ready, key=lambda key: (self.keys[key]["in_flight"], self.keys[key]["errors"], len(self.keys[key]["requests"])))
+                    state = self.keys[key]
+                    state["in_flight"] += 1
+                    state["requests"].append(now)
+                    state["tokens"].append((now, tokens))
+                    return key
+                timed = [wait for wait in waits.values() if wait is not None]
+                self.condition.wait(min(timed) if timed else None)
+
+    def release(self, key: str, status_code: int | None, estimate: int = 0, tokens: int | None = None, retry_after: float | None = None):
+        """Records the outcome of a request made with `key`."""
+        with self.condition:
+            now = time.monotonic()
+            state = self.keys[key]
+            state["in_flight"] -= 1
+            if tokens is not None:
+                state["tokens"].append((now, tokens - estimate)) # Corrects the estimate counted by acquire
+            if status_code == 200:
+                state["errors"] = state["rate_limits"] = 0
+            elif status_code == 429:
+                state["rate_limits"] += 1
+                delay = retry_after if retry_after is not None else min(MAX_KEY_COOLDOWN, RATE_LIMIT_BACKOFF * 2 ** (state["rate_limits"] - 1))
+                state["cooldown"] = max(state["cooldown"], now + delay)
+                logger.warning(f"Rate limit for key ...{key[-5:]}. Cooling down for {delay:.1f}s.")
+            elif status_code in (401, 403):
+                if key not in self.evicted:
+                    self.evicted.add(key)
+                    logger.error(f"Invalid API key ...{key[-5:]}. It will not be used again in this run.")
+            elif status_code is None or status_code >= 500:
+                state["errors"] += 1
+                state["cooldown"] = max(state["cooldown"], now + min(MAX_KEY_COOLDOWN, API_RETRY_DELAY * 2 ** (state["errors"] - 1)))
+            self.condition.notify_all()
+
+def load_api_keys(file_path, rpm: int = KEY_RPM, tpm: int = KEY_TPM):
+    """Loads API keys into the key pool."""
+    global API_KEYS, KEYS
     try:
         with open(file_path, 'r') as f:
             API_KEYS = [line.strip() for line in f if line.strip()]
@@ -42,72 +163,119 @@ def load_api_keys(file_path):
             logger.error(f"No API keys found in {file_path}.")
             raise ValueError(f"No API keys found in {file_path}.")
         logger.info(f"Loaded {len(API_KEYS)} API keys from {file_path}.")
-        current_api_key_iterator = itertools.cycle(API_KEYS)
+        KEYS = KeyPool(API_KEYS, rpm, tpm)
     except FileNotFoundError:
         logger.error(f"API key file not found at {file_path}.")
         raise
 
-def get_next_api_key():
-    """Cycles to the next API key."""
-    if not current_api_key_iterator:
-        raise ValueError("API keys not loaded.")
-    return next(current_api_key_iterator)
+def get_session(api_key: str) -> requests.Session:
+    """Returns the pooled session of an API key. Its pool holds at most WORKERS_PER_KEY connections,
+    and a worker waits for a free one, so a key never has more requests in flight than that."""
+    with session_lock:
+        session = SESSIONS.get(api_key)
+        if session is None:
+            session = requests.Session()
+            session.headers.update({"x-goog-api-key": api_key, "Content-Type": "application/json"})
+            session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=WORKERS_PER_KEY, pool_block=True))
+            session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=WORKERS_PER_KEY, pool_block=True))
+            SESSIONS[api_key] = session
+        return session
+
+def close_sessions():
+    with session_lock:
+        for session in SESSIONS.values():
+            session.close()
+        SESSIONS.clear()
+
+def get_retry_after(response) -> float | None:
+    """Seconds to wait before the key is used again, from a Retry-After header or Gemini's RetryInfo."""
+    header = response.headers.get("Retry-After")
+    if header:
+        try:
+            return max(0.0, float(header))
+        except ValueError:
+            try:
+                return max(0.0, email.utils.parsedate_to_datetime(header).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    try:
+        for detail in response.json().get("error", {}).get("details", []):
+            if detail.get("@type", "").endswith("google.rpc.RetryInfo"):
+                return float(detail["retryDelay"].rstrip("s"))
+    except (ValueError, AttributeError, KeyError, TypeError):
+        pass
+    return None
 
-def call_gemini_api(prompt: str, api_key: str) -> tuple[str | None, int | None]:
-    """Calls the Gemini API with a given prompt and API key."""
-    url = GEMINI_API_URL.format(model=MODEL_NAME, api_key=api_key)
-    headers = {"Content-Type": "application/json"}
+def call_gemini_api(prompt: str, api_key: str, model: str = MODEL_NAME) -> tuple[str | None, int | None, float | None, int | None]:
+    """Calls the Gemini API with a given prompt and API key.
+    Returns the response text, the status code, the Retry-After delay and the tokens used."""
+    url = GEMINI_API_URL.format(base_url=BASE_URL, model=model)
     data = {
         "contents": [{"parts": [{"text": prompt}]}],
-        "generationConfig": {"temperature": 0.1, "responseMimeType": "application/json"}
+        "generationConfig": GENERATION_CONFIG
     }
+    started = time.monotonic()
     try:
-        response = requests.post(url, headers=headers, json=data, timeout=API_TIMEOUT)
+        response = get_session(api_key).post(url, json=data, timeout=API_TIMEOUT)
         response.raise_for_status()
         json_response = response.json()
+        usage = json_response.get("usageMetadata", {})
+        METRICS.observe("gemini", model, time.monotonic() - started, "ok",
+                        usage.get("promptTokenCount"), usage.get("candidatesTokenCount"))
+        tokens = usage.get("totalTokenCount")
         if "candidates" in json_response and json_response["candidates"]:
             content = json_response["candidates"][0].get("content", {})
             if "parts" in content and content["parts"]:
                 text = content["parts"][0].get("text")
                 if text:
-                    return text, 200
+                    return text, 200, None, tokens
         logger.warning(f"Unexpected response format: {str(json_response)[:500]}...")
-        return None, 200 # Success, but no text
+        return None, 200, None, tokens # Success, but no text
     except requests.exceptions.HTTPError as http_err:
         status_code = http_err.response.status_code
+        METRICS.observe("gemini", model, time.monotonic() - started, "rate_limited" if status_code == 429 else "error")
         logger.warning(f"HTTP error {status_code} for key ...{api_key[-5:]}.")
-        return None, status_code
+        if status_code == 400 and "API_KEY_INVALID" in http_err.response.text:
+            # Gemini answers an invalid key with a 400, reported as a 401 so that the key is evicted
+            status_code = 401
+        return None, status_code, get_retry_after(http_err.response), None
     except requests.exceptions.RequestException as req_err:
+        METRICS.observe("gemini", model, time.monotonic() - started,
+                        "timeout" if isinstance(req_err, requests.exceptions.Timeout) else "error")
         logger.error(f"Request failed: {req_err}")
-        return None, None
-    return None, None
+        return None, None, None, None
 
-def get_gemini_response(prompt: str) -> str | None:
-    """Manages API key rotation and retries for a single prompt."""
-    if not API_KEYS:
+def get_gemini_response(prompt: str, model: str = MODEL_NAME) -> str | None:
+    """Sends a prompt with whichever key has capacity. Rate limits and server errors are retried,
+    usually with another key, since the key that failed is cooling down."""
+    if KEYS is None:
         raise ValueError("API keys are not loaded.")
 
-    for _ in range(len(API_KEYS)): # Try each key once
-        api_key = get_next_api_key()
-        
-        for attempt in range(MAX_API_RETRIES):
-            response_text, status_code = call_gemini_api(prompt, api_key)
-            
-            if status_code == 200:
-                return response_text
-            
-            if status_code == 429: # Rate limit
-                logger.warning(f"Rate limit for key ...{api_key[-5:]}. Switching key and delaying for 20s.")
-                time.sleep(20)
-                break # Switch to the next key
-            
-            if status_code in [400, 401, 403]: # Invalid key
-                logger.error(f"Invalid API key ...{api_key[-5:]}. This key will be skipped.")
-                break # Permanently fail for this key
-            
-            # For other retryable errors like 500, 503
-            logger.warning(f"Attempt {attempt + 1} failed with status {status_code}. Retrying in {API_RETRY_DELAY}s.")
-            time.sleep(API_RETRY_DELAY)
+    estimate = len(prompt) // 4 + RESPONSE_TOKENS
+    calls = errors = rate_limits = 0
+    while errors < MAX_API_RETRIES and rate_limits < MAX_API_RETRIES * len(API_KEYS):
+        api_key = KEYS.acquire(estimate)
+        if api_key is None:
+            logger.error("Every API key has been evicted.")
+            return None
+        if calls:
+            METRICS.count("gemini", model, "retries")
+        calls += 1
+        response_text, status_code, retry_after, tokens = call_gemini_api(prompt, api_key, model)
+        KEYS.release(api_key, status_code, estimate, tokens, retry_after)
+
+        if status_code == 200:
+            return response_text
+        if status_code == 429:
+            rate_limits += 1
+        elif status_code in (401, 403):
+            continue # The key is evicted, the next attempt uses another one
+        elif status_code is not None and status_code < 500:
+            logger.error(f"The request was rejected with status {status_code}.")
+            return None
+        else:
+            errors += 1
+            logger.warning(f"Attempt {errors} failed with status {status_code}.")
 
     logger.error("All API keys failed for the request.")
     return None
@@ -286,87 +454,454 @@ def save_evaluated_data(data_to_save, file_path):
     except Exception as e:
         logger.error(f"Failed to save data to {file_path}: {e}", exc_info=True)
 
-def process_single_jsonl_file(input_filepath: Path):
-    """Processes a single .jsonl file sequentially."""
+def get_journal_path(output_path: Path) -> Path:
+    """Returns the journal that backs an evaluated_*.json output file."""
+    return output_path.with_suffix(JOURNAL_SUFFIX)
+
+def read_journal(journal_path: Path):
+    """Streams the evaluations recorded in a journal, skipping unreadable lines."""
+    if not journal_path.exists():
+        return
+    with open(journal_path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, start=1):
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"Skipping unreadable line {line_number} in {journal_path}.")
+                continue
+            if isinstance(item, dict):
+                yield item
+
+def seed_journal(output_path: Path, journal_path: Path):
+    """Creates a journal from an existing evaluated_*.json file, so older runs can be resumed."""
+    if journal_path.exists() or not output_path.exists() or output_path.stat().st_size == 0:
+        return
+    try:
+        with open(output_path, 'r', encoding='utf-8') as f:
+            loaded_data = json.load(f)
+    except (json.JSONDecodeError, TypeError):
+        logger.warning(f"Could not load or parse {output_path}. Starting fresh.")
+        return
+    if not isinstance(loaded_data, list):
+        return
+    temp_path = journal_path.with_suffix(JOURNAL_SUFFIX + ".tmp")
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        for item in loaded_data:
+            if isinstance(item, dict):
+                f.write(json.dumps(item, ensure_ascii=False) + '\n')
+    os.replace(temp_path, journal_path)
+    logger.info(f"Seeded {journal_path} from {len(loaded_data)} items in {output_path}.")
+
+def compact_journal(output_path: Path):
+    """Rewrites evaluated_*.json from its journal. The latest evaluation of a problem wins."""
+    journal_path = get_journal_path(output_path)
+    if not journal_path.exists():
+        logger.info(f"No journal found for {output_path}. Nothing to compact.")
+        return
+    latest = {}
+    for item in read_journal(journal_path):
+        if item.get('Problem_ID'):
+            latest[item['Problem_ID']] = item
+    save_evaluated_data(list(latest.values()), output_path)
+
+def finished_ids(journal_path: Path) -> set:
+    """The Problem_IDs of a journal that need no more evaluation. An item that was only checked
+    locally (--prescreen skip) is sent to the judge when a later run does not skip it."""
+    return set(item['Problem_ID'] for item in read_journal(journal_path)
+               if item.get('Problem_ID') and ('gemini_evaluation' in item or PRESCREEN == "skip"))
+
+def load_pending_items(input_filepath: Path) -> tuple[Path, int, list] | None:
+    """Finds the items of a .jsonl file that have not been evaluated yet."""
     output_filename = f"evaluated_{input_filepath.stem}.json"
     output_path = input_filepath.parent / output_filename
-
-    evaluated_data = []
-    processed_problem_ids = set()
-    if output_path.exists() and output_path.stat().st_size > 0:
-        try:
-            with open(output_path, 'r', encoding='utf-8') as f:
-                loaded_data = json.load(f)
-            if isinstance(loaded_data, list):
-                evaluated_data.extend(item for item in loaded_data if isinstance(item, dict))
-                processed_problem_ids.update(item.get('Problem_ID') for item in evaluated_data if item.get('Problem_ID'))
-            logger.info(f"Loaded {len(evaluated_data)} previously evaluated items from {output_path}.")
-        except (json.JSONDecodeError, TypeError):
-            logger.warning(f"Could not load or parse {output_path}. Starting fresh.")
-            evaluated_data = []
-            processed_problem_ids = set()
+    journal_path = get_journal_path(output_path)
+
+    seed_journal(output_path, journal_path)
+    # Only the IDs are kept, the evaluations themselves stay on disk
+    processed_problem_ids = finished_ids(journal_path)
+    if shards.SHARD:
+        # A shard writes its own file, and skips the items that are already in the merged one
+        output_path = Path(shards.shard_file(str(output_path)))
+        journal_path = get_journal_path(output_path)
+        seed_journal(output_path, journal_path)
+        processed_problem_ids |= finished_ids(journal_path)
+        processed_problem_ids = set(ID for ID in processed_problem_ids if ID in shards.SHARD)
+    if processed_problem_ids:
+        logger.info(f"Found {len(processed_problem_ids)} previously evaluated items in {journal_path}.")
 
     items_to_process = []
     try:
-        with open(input_filepath, 'r', encoding='utf-8') as f:
-            for line in f:
-                try:
-                    item = json.loads(line)
-                    problem_id = item.get('Problem_ID')
-                    if problem_id and problem_id not in processed_problem_ids:
-                        if item.get('elaborated_solution_steps') and item.get('ai_solution'):
-                            items_to_process.append(item)
-                except (json.JSONDecodeError, AttributeError):
-                    continue
+        # Items are lazy views over the memory-mapped columns of the file, so only the pending IDs stay in memory
+        dataset = open_dataset(str(input_filepath))
     except FileNotFoundError:
         logger.error(f"Input file not found: {input_filepath}")
-        return
+        return None
+    for item in dataset:
+        problem_id = item.get('Problem_ID')
+        if problem_id and problem_id not in processed_problem_ids and (shards.SHARD is None or problem_id in shards.SHARD):
+            if item.get('elaborated_solution_steps') and item.get('ai_solution'):
+                items_to_process.append(item)
+
+    return output_path, len(processed_problem_ids), items_to_process
+
+def get_item_prompt(item: dict) -> str:
+    return create_evaluation_prompt(
+        item.get('Problem_ID'),
+        item.get('elaborated_solution_steps', ''),
+        item.get('ai_solution', '')
+    )
+
+def get_cache_key(prompt: str, model: str = MODEL_NAME) -> str:
+    return CACHE.key("gemini", model, [{"role": "user", "content": prompt}], params=GENERATION_CONFIG)
+
+def check_item(item: dict) -> dict | None:
+    """Checks the final answers of an item against its final_answers_in_brief. None without a reference."""
+    if PRESCREEN == "off":
+        return None
+    reference = item.get('final_answers_in_brief')
+    if reference is None and ANSWERS is not None:
+        problem = ANSWERS.find(item.get('Problem_ID'))
+        reference = problem.get('final_answers_in_brief') if problem else None
+    if not reference:
+        return None
+    return check_answers(item.get('ai_solution', ''), reference)
+
+def judge_model(check: dict | None) -> str | None:
+    """The model that judges an item, or None if the final answer check settles it."""
+    if check and check["verdict"] in CLEAR_VERDICTS:
+        if PRESCREEN == "skip":
+            return None
+        if PRESCREEN == "tier":
+            return FAST_MODEL_NAME
+    return MODEL_NAME
+
+def answer_checked(item: dict, check: dict) -> dict:
+    logger.info(f"Final answers of {item.get('Problem_ID')}: {check['verdict']}. Not sent to the judge.")
+    result = dict(item)
+    result['answer_check'] = check
+    return result
+
+def count_verdict(result: dict):
+    VERDICTS[result.get('answer_check', {}).get('verdict', "not checked")] += 1
+    if 'gemini_evaluation' not in result:
+        VERDICTS["not judged"] += 1
+
+def apply_evaluation(item: dict, response_text: str | None, cache_key: str, check: dict | None = None, model: str = MODEL_NAME) -> dict | None:
+    """Validates a judge response. Returns the item with its evaluation, or None if the response is unusable."""
+    problem_id = item.get('Problem_ID')
+    if response_text:
+        evaluation = extract_json_from_response(response_text, problem_id)
+        if evaluation and validate_evaluation(evaluation, problem_id):
+            CACHE.put(cache_key, "gemini", model, response_text)
+            result = dict(item)
+            result['gemini_evaluation'] = evaluation
+            if check:
+                result['answer_check'] = check
+            if model != MODEL_NAME:
+                result['judge_model'] = model
+            logger.info(f"Successfully evaluated {problem_id}.")
+            return result
+        logger.error(f"Failed to get a valid evaluation for {problem_id}. It will be skipped.")
+    else:
+        logger.error(f"Failed to get any response for {problem_id}. It will be skipped.")
+    return None
 
-    if not items_to_process:
-        logger.info(f"No new items to process in {input_filepath.name}.")
+def evaluate_item(item: dict) -> dict | None:
+    """Evaluates a single solution. Returns the item with its evaluation, or None on failure."""
+    problem_id = item.get('Problem_ID')
+    logger.info(f"Processing item: {problem_id}")
+
+    check = check_item(item)
+    model = judge_model(check)
+    if model is None:
+        return answer_checked(item, check)
+    prompt = get_item_prompt(item)
+    cache_key = get_cache_key(prompt, model)
+    response_text = CACHE.get(cache_key)
+    if response_text is not None:
+        logger.info(f"Using cached evaluation for {problem_id}.")
+        METRICS.count("gemini", model, "cache_hits")
+    else:
+        response_text = get_gemini_response(prompt, model)
+    return apply_evaluation(item, response_text, cache_key, check, model)
+
+def process_jsonl_files(input_filepaths: list[Path]):
+    """Evaluates the items of all given .jsonl files with a shared pool of workers."""
+    files = {}
+    work = []
+    for input_filepath in input_filepaths:
+        pending = load_pending_items(input_filepath)
+        if pending is None:
+            continue
+        output_path, evaluated_count, items_to_process = pending
+        if not items_to_process:
+            logger.info(f"No new items to process in {input_filepath.name}.")
+            continue
+        logger.info(f"Found {len(items_to_process)} new items to process in {input_filepath.name}.")
+        files[input_filepath] = {
+            "output_path": output_path,
+            "journal": open_writer(str(get_journal_path(output_path)), ensure_ascii=False),
+            "evaluated": evaluated_count,
+            "total": len(items_to_process),
+            "done": 0,
+        }
+        work.extend((input_filepath, item) for item in items_to_process)
+
+    if not work:
         return
 
-    logger.info(f"Found {len(items_to_process)} new items to process in {input_filepath.name}.")
+    max_workers = max(1, len(API_KEYS) * WORKERS_PER_KEY)
+    logger.info(f"Evaluating {len(work)} items from {len(files)} files with {max_workers} workers.")
 
-    for i, item in enumerate(items_to_process):
-        problem_id = item.get('Problem_ID')
-        logger.info(f"Processing item {i + 1}/{len(items_to_process)}: {problem_id}")
-
-        prompt = create_evaluation_prompt(
-            problem_id,
-            item.get('elaborated_solution_steps', ''),
-            item.get('ai_solution', '')
-        )
-        
-        response_text = get_gemini_response(prompt)
-
-        if response_text:
-            evaluation = extract_json_from_response(response_text, problem_id)
-            if evaluation and validate_evaluation(evaluation, problem_id):
-                item['gemini_evaluation'] = evaluation
-                evaluated_data.append(item)
-                logger.info(f"Successfully evaluated {problem_id}.")
-            else:
-                logger.error(f"Failed to get a valid evaluation for {problem_id}. It will be skipped.")
+    # Results are collected on this thread, so the per-file state needs no locking
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(evaluate_item, item): input_filepath for input_filepath, item in work}
+            del work
+            for future in as_completed(futures):
+                input_filepath = futures.pop(future)
+                state = files[input_filepath]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logger.error(f"Worker failed on an item from {input_filepath.name}: {e}", exc_info=True)
+                    result = None
+                if result:
+                    state["journal"].write(result)
+                    state["evaluated"] += 1
+                    count_verdict(result)
+                state["done"] += 1
+                logger.info(f"[{input_filepath.name}] {state['done']}/{state['total']} items done.")
+
+                if state["done"] == state["total"]:
+                    state["journal"].close()
+                    compact_journal(state["output_path"])
+                    logger.info(f"Finished processing {input_filepath.name}. Total evaluated items: {state['evaluated']}")
+    finally:
+        for state in files.values():
+            state["journal"].close()
+
+def load_batch_state() -> list:
+    try:
+        with open(BATCH_STATE_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return []
+
+def save_batch_state(state: list):
+    temp_path = BATCH_STATE_FILE + ".tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+    os.replace(temp_path, BATCH_STATE_FILE)
+
+def find_api_key(suffix: str) -> str | None:
+    # Only the end of the key is saved in the batch state file
+    return next((api_key for api_key in API_KEYS if api_key.endswith(suffix)), None)
+
+def submit_gemini_batch(base_url: str, prompts: dict, api_key: str, model: str = MODEL_NAME) -> str | None:
+    """Submits {key: prompt} as one inline Gemini batch job. Returns the job name."""
+    body = {"batch": {
+        "display_name": f"physicseval-{int(time.time())}",
+        "input_config": {"requests": {"requests": [
+            {"request": {"contents": [{"parts": [{"text": prompt}]}], "generationConfig": GENERATION_CONFIG}, "metadata": {"key": key}}
+            for key, prompt in prompts.items()
+        ]}},
+    }}
+    try:
+        response = get_session(api_key).post(f"{base_url}/models/{model}:batchGenerateContent", json=body, timeout=API_TIMEOUT)
+        response.raise_for_status()
+        return response.json()["name"]
+    except (requests.exceptions.RequestException, KeyError, ValueError) as e:
+        logger.warning(f"Could not submit a batch with key ...{api_key[-5:]}: {e}")
+        return None
+
+def get_gemini_batch(base_url: str, name: str, api_key: str) -> tuple[dict | None, int | None]:
+    """Returns the batch job, or None, and the status code of the poll."""
+    try:
+        response = get_session(api_key).get(f"{base_url}/{name}", timeout=API_TIMEOUT)
+        response.raise_for_status()
+        return response.json(), response.status_code
+    except requests.exceptions.HTTPError as http_err:
+        logger.warning(f"Could not poll {name}: {http_err}")
+        return None, http_err.response.status_code
+    except (requests.exceptions.RequestException, ValueError) as e:
+        logger.warning(f"Could not poll {name}: {e}")
+        return None, None
+
+def read_gemini_batch_responses(batch: dict) -> dict:
+    """Returns {key: response text or None} from a finished batch job."""
+    results = {}
+    responses = batch.get("response", {}).get("inlinedResponses", {}).get("inlinedResponses", [])
+    for response in responses:
+        key = response.get("metadata", {}).get("key")
+        try:
+            results[key] = response["response"]["candidates"][0]["content"]["parts"][0]["text"]
+        except (KeyError, IndexError, TypeError):
+            logger.warning(f"Batch request {key} failed: {str(response.get('error') or response)[:300]}")
+            results[key] = None
+    return results
+
+def process_jsonl_files_batch(input_filepaths: list[Path], base_url: str = GEMINI_BASE_URL, poll_interval: float = BATCH_POLL_INTERVAL):
+    """Evaluates the items of all given .jsonl files through Gemini batch jobs instead of one request per item."""
+    files = {}
+    pending = {}
+    for input_filepath in input_filepaths:
+        loaded = load_pending_items(input_filepath)
+        if loaded is None:
+            continue
+        output_path, evaluated_count, items_to_process = loaded
+        if not items_to_process:
+            logger.info(f"No new items to process in {input_filepath.name}.")
+            continue
+        logger.info(f"Found {len(items_to_process)} new items to process in {input_filepath.name}.")
+        files[input_filepath.name] = {
+            "output_path": output_path,
+            "journal": open_writer(str(get_journal_path(output_path)), ensure_ascii=False),
+            "evaluated": evaluated_count,
+        }
+        for item in items_to_process:
+            # The file name is part of the key because the same Problem_ID appears in every file
+            pending[f"{input_filepath.name}|{item['Problem_ID']}"] = item
+
+    checks = {key: check_item(item) for key, item in pending.items()}
+    models = {key: judge_model(check) for key, check in checks.items()}
+    cache_keys = {}
+
+    def record(key: str, response_text: str | None):
+        file_name = key.split("|", 1)[0]
+        if models[key] is None:
+            result = answer_checked(pending.pop(key), checks[key])
         else:
-            logger.error(f"Failed to get any response for {problem_id}. It will be skipped.")
-        
-        # Checkpoint saving
-        if (i + 1) % SAVE_CHECKPOINT_INTERVAL == 0:
-            save_evaluated_data(evaluated_data, output_path)
-            logger.info(f"Checkpoint saved after {i + 1} items.")
-            
-        time.sleep(3) # Add a 3-second delay between each request
-            
-    # Final save
-    save_evaluated_data(evaluated_data, output_path)
-    logger.info(f"Finished processing {input_filepath.name}. Total evaluated items: {len(evaluated_data)}")
+            result = apply_evaluation(pending.pop(key), response_text, cache_keys[key], checks[key], models[key])
+        if result:
+            state = files[file_name]
+            state["journal"].write(result)
+            state["evaluated"] += 1
+            count_verdict(result)
+
+    try:
+        prompts = {}
+        for key, item in list(pending.items()):
+            if models[key] is None:
+                record(key, None)
+                continue
+            prompt = get_item_prompt(item)
+            cache_keys[key] = get_cache_key(prompt, models[key])
+            response_text = CACHE.get(cache_keys[key])
+            if response_text is not None:
+                METRICS.count("gemini", models[key], "cache_hits")
+                record(key, response_text)
+            else:
+                prompts[key] = prompt
+
+        state = load_batch_state()
+        submitted = {key for batch in state for key in batch["keys"]}
+        unsubmitted = [key for key in prompts if key not in submitted]
+        # A batch job has one model, so the items of each judge model go into their own jobs
+        for model in dict.fromkeys(models[key] for key in unsubmitted):
+            model_keys = [key for key in unsubmitted if models[key] == model]
+            for i in range(0, len(model_keys), BATCH_SIZE):
+                chunk = {key: prompts[key] for key in model_keys[i:i + BATCH_SIZE]}
+                # Jobs are spread over the keys, starting each chunk at the next one
+                live = KEYS.live()
+                start = (i // BATCH_SIZE) % max(1, len(live))
+                for api_key in live[start:] + live[:start]:
+                    name = submit_gemini_batch(base_url, chunk, api_key, model)
+                    if name:
+                        logger.info(f"Submitted {name} with {len(chunk)} requests to {model}.")
+                        state.append({"name": name, "key": api_key[-8:], "keys": list(chunk)})
+                        save_batch_state(state)
+                        break
+                else:
+                    logger.error(f"Could not submit {len(chunk)} requests with any key. Run again to retry them.")
+
+        failures = {}
+        abandoned = []
+        while state:
+            for batch_entry in list(state):
+                api_key = find_api_key(batch_entry["key"])
+                if api_key is None:
+                    logger.error(f"The key that submitted {batch_entry['name']} is no longer in {API_KEY_FILE}. Forgetting the batch.")
+                    state.remove(batch_entry)
+                    save_batch_state(state)
+                    continue
+                batch, status_code = get_gemini_batch(base_url, batch_entry["name"], api_key)
+                if batch is None:
+                    failures[batch_entry["name"]] = failures.get(batch_entry["name"], 0) + 1
+                    # A job that does not exist (any more) is never going to finish
+                    if status_code == 404 or failures[batch_entry["name"]] >= MAX_POLL_FAILURES:
+                        reason = "was not found" if status_code == 404 else f"could not be polled {MAX_POLL_FAILURES} times in a row"
+                        logger.error(f"{batch_entry['name']} {reason}. Its items are evaluated one request each.")
+                        abandoned += batch_entry["keys"]
+                        state.remove(batch_entry)
+                        save_batch_state(state)
+                    continue
+                failures.pop(batch_entry["name"], None)
+                batch_state = batch.get("metadata", {}).get("state")
+                if not batch.get("done") and batch_state not in BATCH_DONE_STATES:
+                    logger.info(f"{batch_entry['name']}: {batch_state}")
+                    continue
+                logger.info(f"{batch_entry['name']} finished: {batch_state}")
+                responses = read_gemini_batch_responses(batch)
+                for key in batch_entry["keys"]:
+                    # Batches from an earlier run may include items that have been evaluated since
+                    if key in pending:
+                        record(key, responses.get(key))
+                state.remove(batch_entry)
+                save_batch_state(state)
+            if state:
+                time.sleep(poll_interval)
+
+        fallback = [key for key in abandoned if key in pending]
+        if fallback:
+            with ThreadPoolExecutor(max_workers=max(1, len(API_KEYS) * WORKERS_PER_KEY)) as executor:
+                futures = {executor.submit(get_gemini_response, prompts[key], models[key]): key for key in fallback}
+                for future in as_completed(futures):
+                    record(futures[future], future.result())
+    finally:
+        for file_state in files.values():
+            file_state["journal"].close()
+    for file_name, file_state in files.items():
+        compact_journal(file_state["output_path"])
+        logger.info(f"Finished processing {file_name}. Total evaluated items: {file_state['evaluated']}")
+    if pending:
+        logger.warning(f"{len(pending)} items were not evaluated. Run again to retry them.")
+
+def process_single_jsonl_file(input_filepath: Path):
+    """Processes a single .jsonl file."""
+    process_jsonl_files([input_filepath])
 
 def main():
     """Main function to run the evaluation script."""
+    parser = argparse.ArgumentParser(description="Evaluate the solutions in every .jsonl file of the current directory.")
+    parser.add_argument("--compact", action="store_true", help="Only rebuild the evaluated_*.json files from their journals.")
+    parser.add_argument("--cache", choices=CACHE_MODES, default="use",
+                        help="use: reuse cached judge responses, refresh: call the judge again and update the cache, bypass: no cache.")
+    parser.add_argument("--batch", action="store_true", help="Submit the items as Gemini batch jobs instead of one request each.")
+    parser.add_argument("--base-url", default=GEMINI_BASE_URL, help="Gemini API base URL, e.g. a local mock_servers.py or fake_batch_server.py.")
+    parser.add_argument("--metrics-port", type=int, help="Serve the call metrics in the Prometheus text format on this port.")
+    parser.add_argument("--rpm", type=int, default=KEY_RPM, help="Requests per minute allowed for each API key, 0 for no limit.")
+    parser.add_argument("--tpm", type=int, default=KEY_TPM, help="Tokens per minute allowed for each API key, 0 for no limit.")
+    parser.add_argument("--shard", help="Only evaluate the problems of shard i/N, into evaluated_*.shard-i-of-N.json files.")
+    parser.add_argument("--prescreen", choices=PRESCREEN_MODES, default="record",
+                        help="Local check of the final answers. record: judge every item and keep the verdict, "
+                             "tier: judge clear matches and mismatches with FAST_MODEL_NAME, skip: do not judge them, off: no check.")
+    parser.add_argument("--answers", help="Dataset with final_answers_in_brief, e.g. \"../BASE SOLUTION/test set.json\", for solution files without it.")
+    parser.add_argument("--poll-interval", type=float, default=BATCH_POLL_INTERVAL, help="Seconds between polls of the batch jobs.")
+    args = parser.parse_args()
+
+    current_dir = Path('.')
+    shards.SHARD = shards.parse_shard(args.shard)
+    global PRESCREEN, ANSWERS
+    PRESCREEN = args.prescreen
+    if args.compact:
+        for journal_path in sorted(current_dir.glob(f'evaluated_*{JOURNAL_SUFFIX}')):
+            compact_journal(journal_path.with_suffix('.json'))
+        return
+
     logger.info("Starting evaluation script run.")
     try:
-        load_api_keys(API_KEY_FILE)
+        load_api_keys(API_KEY_FILE, args.rpm, args.tpm)
     except Exception as e:
         logger.error(f"Failed to load API keys: {e}. Exiting.")
         return
@@ -375,7 +910,6 @@ def main():
         logger.error("No API keys loaded. Cannot proceed.")
         return
 
-    current_dir = Path('.')
     jsonl_files = sorted(list(current_dir.glob('*.jsonl')))
     if not jsonl_files:
         logger.warning("No .jsonl files found in the current directory.")
@@ -383,10 +917,24 @@ def main():
 
     logger.info(f"Found {len(jsonl_files)} files to process: {[f.name for f in jsonl_files]}")
 
-    for jsonl_file in jsonl_files:
-        logger.info(f"--- Processing file: {jsonl_file.name} ---")
-        process_single_jsonl_file(jsonl_file)
-        logger.info(f"--- Finished processing file: {jsonl_file.name} ---")
+    global CACHE, BASE_URL, METRICS
+    if args.answers:
+        ANSWERS = open_dataset(args.answers)
+    CACHE = LLMCache(CACHE_FILE, mode=args.cache)
+    BASE_URL = args.base_url
+    METRICS = Metrics("evaluate", METRICS_FILE)
+    if args.metrics_port:
+        METRICS.serve(args.metrics_port)
+    if args.batch:
+        process_jsonl_files_batch(jsonl_files, args.base_url, args.poll_interval)
+    else:
+        process_jsonl_files(jsonl_files)
+    close_sessions()
+    if VERDICTS:
+        logger.info("Final answer check: " + ", ".join(f"{count} {verdict}" for verdict, count in VERDICTS.most_common()))
+    logger.info(CACHE.summary())
+    logger.info("Call metrics:\n" + METRICS.summary())
+    CACHE.close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,6 @@
+import sys
+from pathlib import Path
+
+# The scripts import each other as top-level modules, the shared ones from BASE SOLUTION
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent / "BASE SOLUTION"))
@@ -0,0 +1,76 @@
+import json
+import os
+from analytics import SCORE_FIELDS, Analytics
+
+JOURNAL = "evaluated_proposed_solution_by_qwen.journal"
+
+
+def evaluation(problem_id, score):
+    return {"Problem_ID": problem_id, "gemini_evaluation": {field: score for field in SCORE_FIELDS}}
+
+def write(path, items, mode='w'):
+    with open(path, mode, encoding='utf-8') as f:
+        for item in items:
+            f.write(json.dumps(item) + "\n")
+
+def table(analytics):
+    frame = analytics.frame()
+    problems = [analytics.label("problem", code) for code in frame["problem"]]
+    return dict(zip(problems, frame["scores"][:, -1].tolist()))
+
+def rescan(directory):
+    analytics = Analytics()
+    analytics.refresh(directory)
+    return table(analytics)
+
+
+def test_appended_lines_match_a_full_rescan(tmp_path):
+    analytics = Analytics()
+    write(tmp_path / JOURNAL, [evaluation("1", 3), evaluation("2", 4)])
+    assert analytics.refresh(tmp_path) == 2
+    write(tmp_path / JOURNAL, [evaluation("3", 5), evaluation("1", 1)], 'a')
+    assert analytics.refresh(tmp_path) == 2
+    assert analytics.refresh(tmp_path) == 0
+    assert table(analytics) == rescan(tmp_path) == {"1": 1, "2": 4, "3": 5}
+
+def test_torn_last_line_is_read_once_complete(tmp_path):
+    analytics = Analytics()
+    line = json.dumps(evaluation("2", 4))
+    with open(tmp_path / JOURNAL, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(evaluation("1", 3)) + "\n" + line[:10])
+    assert analytics.refresh(tmp_path) == 1
+    with open(tmp_path / JOURNAL, 'a', encoding='utf-8') as f:
+        f.write(line[10:] + "\n")
+    assert analytics.refresh(tmp_path) == 1
+    assert table(analytics) == rescan(tmp_path)
+
+def test_replaced_journal_is_read_again(tmp_path):
+    analytics = Analytics()
+    write(tmp_path / JOURNAL, [evaluation("1", 3), evaluation("2", 4)])
+    analytics.refresh(tmp_path)
+    # Same length, different content, in a new file moved over the old one
+    write(tmp_path / "new", [evaluation("1", 5), evaluation("2", 2)])
+    os.replace(tmp_path / "new", tmp_path / JOURNAL)
+    assert analytics.refresh(tmp_path) == 2
+    assert table(analytics) == rescan(tmp_path) == {"1": 5, "2": 2}
+
+def test_journal_rewritten_in_place_is_read_again(tmp_path):
+    analytics = Analytics()
+    write(tmp_path / JOURNAL, [evaluation("1", 3)])
+    analytics.refresh(tmp_path)
+    # Longer than before, so the size alone does not show the rewrite
+    write(tmp_path / JOURNAL, [evaluation("1", 2), evaluation("2", 4)])
+    assert analytics.refresh(tmp_path) == 2
+    assert table(analytics) == rescan(tmp_path) == {"1": 2, "2": 4}
+
+def test_saved_state_continues_where_it_stopped(tmp_path):
+    state = str(tmp_path / "state.npz")
+    analytics = Analytics()
+    write(tmp_path / JOURNAL, [evaluation("1", 3)])
+    analytics.refresh(tmp_path)
+    analytics.save(state)
+    write(tmp_path / JOURNAL, [evaluation("2", 4)], 'a')
+    restored = Analytics()
+    assert restored.load(state)
+    assert restored.refresh(tmp_path) == 1
+    assert table(restored) == rescan(tmp_path) == {"1": 3, "2": 4}